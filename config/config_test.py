@@ -26,5 +26,7 @@ APP_SETTINGS = {
     'handle_events_plugin': 'plugins_test.plugin_test',
     'clickhouse_dropdown_sleep': 2,
     'clickhouse_max_batch_len': 10000,
+    #memory budget for read, but not dumped yet events (approximate), None - unlimited
+    'synch_storage_max_bytes': 256 * 1024 * 1024,
 
 }
\ No newline at end of file
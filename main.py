@@ -1,5 +1,18 @@
-from src.engine import run
+import sys
+import json
+
 from config.config import MYSQL_SETTINGS, APP_SETTINGS
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        # команда запущенному движку через health socket, например: python main.py regenerate items
+        from src.tools import get_health_answer
+        answer = get_health_answer(APP_SETTINGS['health_socket'], command=sys.argv[1], args=sys.argv[2:])
+        print(json.dumps(answer, ensure_ascii=False, indent=2))
+        sys.exit(0 if answer.get('status') == 'ok' else 1)
+
+    if APP_SETTINGS.get('engine') == 'asyncio':
+        from src.async_engine import run
+    else:
+        from src.engine import run
     run(MYSQL_SETTINGS, APP_SETTINGS)
@@ -52,7 +52,6 @@ class statistic_class:
 
 
 statistic = statistic_class()
-version = None
 emulate_error = False
 
 def set_emulate_error(v):
@@ -88,13 +87,10 @@ def dump_values(table_name, columns, values):
 
 
 def init():
-    from src.tools import insert_buffer
-    from src.synch_storage import version_lock
-    global statistic, version
+    global statistic
 
     logger.debug("INIT")
     statistic.init += 1
-    version = version_lock()
 
 
 
@@ -112,30 +108,9 @@ def finished_full_regeneration():
 
 def initiate_synch_mode():
     #print('initiate_synch_mode')
-    global statistic, version
+    global statistic
     statistic.initiate_synch_mode +=1
 
-    client = clickhouse_connect.get_client(
-        host=CLICKHOUSE_SETTINGS_ACTOR["host"],
-        port=CLICKHOUSE_SETTINGS_ACTOR["port"],
-        username=CLICKHOUSE_SETTINGS_ACTOR["user"],
-        password=CLICKHOUSE_SETTINGS_ACTOR["password"],
-        database=CLICKHOUSE_SETTINGS_ACTOR["database"],
-    )
-
-    result = client.query(
-        "SELECT max(version) FROM items"
-    )
-
-    version_id = result.result_rows[0][0]
-    if not version_id:
-        #none
-        version.set_version(1)
-    else:
-        version.set_version(version_id)
-
-    client.close()
-
 def initiate_dropdown_workers():
     pass
 
@@ -147,9 +122,8 @@ def tear_down():
     logger.debug("DEINIT")
 
 
-def process_event(event_type, table, event):
+def process_event(event_type, table, event, version):
     from src.tools import process_event_result
-    global version
     if table != 'items':
         return []
 
@@ -162,7 +136,7 @@ def process_event(event_type, table, event):
         with statistic.lock:
             statistic.process_event_insert +=1
 
-        event['version'] = version.get_version()
+        event['version'] = version
 
         columns = list(event.keys())
         values = [event[col] for col in columns]
@@ -175,7 +149,7 @@ def process_event(event_type, table, event):
         logger.debug(f"update event {table} event: {event}")
 
         after = event['after_values']
-        after['version'] = version.get_version()
+        after['version'] = version
 
         columns = list(after.keys())
         values = [ after[col] for col in columns ]
@@ -188,7 +162,7 @@ def process_event(event_type, table, event):
         logger.debug(f"delete event {table} event: {event}")
         deleted_record = event['values']
         deleted_record['deleted'] = 1
-        deleted_record['version'] = version.get_version()
+        deleted_record['version'] = version
 
         columns = list(deleted_record.keys())
         values = [deleted_record[col] for col in columns]
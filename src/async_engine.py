@@ -0,0 +1,479 @@
+import os
+import json
+import time
+import signal
+import asyncio
+import inspect
+import logging
+
+import pymysql
+from .table_mapping import compile_table_mapping
+from .delivery import batch_id, buffer_origin
+from .tools import binlog_file, plugin_wrapper, get_binlog_from_db, table_filter, insert_buffer, rows_to_columns, \
+    select_columns, version_horizon, accepts_argument, startup_timings
+from .binlog_decoder import open_binlog_stream, binlog_decoder
+from .synch_storage import synch_buffer
+from .rows import compact_row, materialize_event
+from .value_converters import value_converters
+
+logging.getLogger("pymysqlreplication").setLevel(logging.ERROR)
+
+logger = logging.getLogger(__name__)
+
+
+# settings of the threaded engine only, the asyncio engine refuses to start with them
+UNSUPPORTED_SETTINGS = ('extra_sinks', 'clickhouse_sink', 'apply_mode', 'spill_path', 'parallel_domains')
+
+# a health client which sends a command waits for the answer up to this
+HEALTH_REQUEST_WAIT = 0.2
+
+
+async def call_hook(func, *args, **kwargs):
+    """Plugin hooks may be plain functions or coroutines."""
+    result = func(*args, **kwargs)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+class async_engine:
+    """
+    asyncio variant of engine.run(): one event loop instead of a thread per stage.
+
+    The binlog reader (pymysqlreplication is blocking) and regeneration selects run in executor threads
+    and feed a bounded asyncio.Queue. The flush coroutine builds synch_buffer batches up to a commit marker,
+    transforms them through process_event (plain or async) and dumps packs concurrently,
+    up to async_max_in_flight sink requests at once; the checkpoint is saved after all packs are done.
+    STOP is an asyncio.Event, every wait of the loop is interrupted by it.
+    """
+
+    def __init__(self, mysql_settings, app_settings):
+        unsupported = [k for k in UNSUPPORTED_SETTINGS if app_settings.get(k)]
+        if app_settings.get('apply_mode', 'batch') == 'batch' and 'apply_mode' in unsupported:
+            unsupported.remove('apply_mode')
+        if unsupported:
+            raise ValueError(f"engine 'asyncio' doesn't support {', '.join(unsupported)}, use the threaded engine")
+        self.mysql_settings = mysql_settings
+        self.app_settings = app_settings
+        self.plugin = plugin_wrapper(app_settings['handle_events_plugin'])
+        if self.plugin.dump_values is None and self.plugin.dump_columns is None:
+            raise ValueError("Plugin must define dump_values or dump_columns")
+        self.table_mapping = compile_table_mapping(app_settings)
+        self.dump_batch_id = accepts_argument(self.plugin.dump_columns or self.plugin.dump_values, 'batch_id')
+        self.tables = table_filter(app_settings)
+
+        self.batch_len = app_settings['clickhouse_max_batch_len']
+        self.interval = app_settings['clickhouse_dropdown_sleep']
+        self.max_in_flight = app_settings.get('async_max_in_flight', 16)
+        self.retries = app_settings.get('delivery_retries', 0)
+        self.backoff = app_settings.get('delivery_backoff', 0.5)
+        self.max_backoff = app_settings.get('delivery_max_backoff', 30.0)
+        self.compaction = app_settings.get('synch_compaction', False)
+        self.compact_rows = app_settings.get('compact_rows', False)
+        self.converters = None
+        if app_settings.get('value_converters'):
+            self.converters = value_converters(mysql_settings, app_settings['value_converters'])
+
+        self.loop = None
+        self.stop_event = None
+        # set together with stop_event, read by executor threads
+        self.stopped = False
+        self.queue = None
+        self.semaphore = None
+        self.regeneration = False
+        # marker of the end of regeneration is flushed
+        self.regeneration_flushed = None
+
+        self.stage = 'INIT'
+        self.startup = startup_timings()
+        self.parsed_binlog = None
+        self.saved_binlog = None
+        self.in_flight = 0
+        self.flushed_batches = 0
+        self.flushed_rows = 0
+        # origin of the last flushed buffer, see delivery.buffer_origin
+        self.last_origin = None
+        self.error = None
+
+    # ---------- lifecycle ----------
+
+    def stop(self):
+        self.stopped = True
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+    async def _put(self, item):
+        """Put with backpressure, interrupted by stop."""
+        while not self.stop_event.is_set():
+            try:
+                await asyncio.wait_for(self.queue.put(item), timeout=0.5)
+                return
+            except asyncio.TimeoutError:
+                continue
+
+    def _put_threadsafe(self, item):
+        """Called from executor threads."""
+        asyncio.run_coroutine_threadsafe(self._put(item), self.loop).result()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.queue = asyncio.Queue(maxsize=self.app_settings.get('async_queue_len', 10000))
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        self.regeneration_flushed = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        await asyncio.to_thread(self._preflight)
+        health = await asyncio.start_unix_server(self._health, path=self._health_socket_path())
+        await call_hook(self.plugin.init)
+
+        flusher = asyncio.create_task(self._flush_loop())
+        try:
+            binlog = binlog_file(self.app_settings['binlog_file'])
+            if not binlog.load():
+                binlog = await self._full_regeneration()
+            if not self.stop_event.is_set():
+                await call_hook(self.plugin.initiate_synch_mode)
+                self.stage = 'SYNCH'
+                reader = self.loop.run_in_executor(None, self._read_binlog, binlog)
+                await self._until_stopped(reader)
+        except Exception as e:
+            logger.exception(f"Exception: {e}")
+            self.error = str(e)
+        finally:
+            self.stop()
+            await asyncio.gather(flusher, return_exceptions=True)
+            health.close()
+            await health.wait_closed()
+            await call_hook(self.plugin.tear_down)
+        return 0 if self.error is None else -1
+
+    async def _until_stopped(self, future):
+        """Waits for an executor future or for stop, the reader thread finishes on its own after stop."""
+        stop_wait = asyncio.create_task(self.stop_event.wait())
+        done, _ = await asyncio.wait({future, stop_wait}, return_when=asyncio.FIRST_COMPLETED)
+        if future in done:
+            future.result()
+        else:
+            await future
+        stop_wait.cancel()
+
+    def _health_socket_path(self):
+        path = self.app_settings['health_socket']
+        if os.path.exists(path):
+            os.remove(path)
+        return path
+
+    def _preflight(self):
+        from .engine import preflight_check_ex
+        conn = pymysql.connect(**self.mysql_settings)
+        try:
+            cursor = conn.cursor()
+            preflight_check_ex(cursor, self.mysql_settings, self.app_settings, timings=self.startup)
+            if self.tables.has_patterns():
+                self.tables.resolve(cursor)
+            if self.converters:
+                self.converters.load(cursor, self.tables.scan | set(self.tables.init))
+        finally:
+            conn.close()
+
+    # ---------- producers, executor threads ----------
+
+    def _regenerate_tables(self, version):
+        """Reads a consistent snapshot of init tables by id ranges, one connection."""
+        batch_len = int(self.app_settings['full_regeneration_batch_len'])
+        table_columns = self.app_settings.get('table_columns', {})
+        conn = pymysql.connect(**self.mysql_settings)
+        try:
+            cursor = conn.cursor(pymysql.cursors.DictCursor)
+            cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+            cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT;")
+            for schema, table in self.tables.init:
+                key = self.tables.key(schema, table)
+                convert = self.converters.get(schema, table) if self.converters else None
+                last_id = None
+                while not self.stopped:
+                    where = f"WHERE id > {last_id} " if last_id is not None else ""
+                    cursor.execute(f"SELECT {select_columns(table_columns.get(table))} FROM {schema}.{table} {where}ORDER BY id LIMIT {batch_len};")
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    for r in rows:
+                        if convert:
+                            convert(r)
+                        self._put_threadsafe(('event', 'insert', key, compact_row.from_dict(r) if self.compact_rows else r, version))
+                    last_id = rows[-1]['id']
+        finally:
+            conn.close()
+
+    def _read_binlog(self, binlog):
+        binlog_stream, gtid_positioning = open_binlog_stream(self.mysql_settings, self.app_settings, binlog, self.tables)
+        decoder = binlog_decoder(
+            binlog_stream, binlog.copy(), self.tables, self.app_settings,
+            converters=self.converters,
+            keep_before=self.plugin.need_before_values or self.compaction,
+            compact_rows=self.compact_rows,
+            gtid_positioning=gtid_positioning,
+        )
+
+        logger.info(f"🚀 Async binlog consumer started from {binlog}")
+        self.startup.mark('consumer_started')
+        try:
+            while not self.stopped:
+                for event in binlog_stream:
+                    if self.stopped:
+                        break
+                    if decoder.is_gtid(event):
+                        decoder.begin(event)
+                    elif decoder.is_commit(event):
+                        self._commit_position(decoder, event)
+                    elif decoder.is_scanned_rows(event):
+                        key = decoder.key(event)
+                        for event_type, row_event, version in decoder.rows(event):
+                            self._put_threadsafe(('event', event_type, key, row_event, version))
+                    else:
+                        tables = decoder.schema_change(event)
+                        if tables:
+                            self._schema_change(decoder, self._commit_position(decoder, event), tables, event.query)
+                time.sleep(0.2)
+        finally:
+            binlog_stream.close()
+
+    def _commit_position(self, decoder, event):
+        """Commit marker of a transaction, -> the committed position."""
+        binlog = decoder.commit(event)
+        self.parsed_binlog = binlog
+        self._put_threadsafe(('binlog', binlog.copy()))
+        return binlog
+
+    def _saved(self, binlog):
+        """The checkpoint is at binlog or after it, by GTID with gtid_positioning, see engine.position_reached."""
+        if self.saved_binlog is None:
+            return False
+        if self.app_settings.get('gtid_positioning', False) and binlog.gtid:
+            return self.saved_binlog.gtid_covers(binlog)
+        return not self.saved_binlog < binlog
+
+    def _schema_change(self, decoder, binlog, tables, query):
+        """DDL of scanned tables, see engine.handle_schema_change: rows before it are dumped first."""
+        logger.info(f"schema change of {tables} at {binlog}: {query}")
+        while not self.stopped and not self._saved(binlog):
+            time.sleep(0.1)
+        if self.stopped:
+            return
+        decoder.forget_tables(tables)
+        for schema, table in tables:
+            if self.plugin.schema_changed:
+                asyncio.run_coroutine_threadsafe(call_hook(self.plugin.schema_changed, schema, table, query), self.loop).result()
+
+    async def _full_regeneration(self):
+        await call_hook(self.plugin.initiate_full_regeneration)
+        self.stage = 'REGENERATION'
+        self.regeneration = True
+        binlog = await asyncio.to_thread(get_binlog_from_db, self.mysql_settings, self.app_settings)
+        # snapshot rows are older than any binlog event after the snapshot position
+        version = version_horizon(binlog, self.app_settings.get('gtid_positioning', False)).version
+        await self._until_stopped(self.loop.run_in_executor(None, self._regenerate_tables, version))
+        if self.stop_event.is_set():
+            return binlog
+        # the marker is flushed after all snapshot rows, it saves the first checkpoint
+        await self._put(('binlog', binlog.copy()))
+        waits = {asyncio.create_task(self.regeneration_flushed.wait()), asyncio.create_task(self.stop_event.wait())}
+        _, pending = await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        self.regeneration = False
+        await call_hook(self.plugin.finished_full_regeneration)
+        return binlog
+
+    # ---------- flush ----------
+
+    async def _flush_loop(self):
+        buffer = synch_buffer(compaction=self.compaction)
+        rows = 0
+        started_at = time.time()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout=min(self.interval, 0.5))
+                except asyncio.TimeoutError:
+                    item = None
+
+                if item is not None:
+                    if item[0] == 'event':
+                        _, event_type, table, event, version = item
+                        buffer.put_event(event_type, table, event, version)
+                        rows += 1
+                    else:
+                        buffer.put_binlog(item[1])
+
+                # in synch mode only whole transactions are flushed; regeneration has no markers until the end
+                ready = rows >= self.batch_len or time.time() - started_at >= self.interval
+                if ready and (buffer.binlog is not None or (self.regeneration and rows)):
+                    await self._flush(buffer)
+                    buffer = synch_buffer(compaction=self.compaction)
+                    rows = 0
+                    started_at = time.time()
+                elif not rows and buffer.binlog is None:
+                    started_at = time.time()
+        except Exception as e:
+            logger.exception(f"Flush exception: {e}")
+            self.error = str(e)
+            self.stop()
+
+    async def _flush(self, buffer):
+        if self.stage == 'SYNCH' and buffer.len():
+            # as engine.run_workers_thread: the plugin is prepared before the rows of every sync batch
+            await call_hook(self.plugin.initiate_dropdown_workers)
+        insert_storage = insert_buffer()
+        await self._transform(buffer, insert_storage)
+
+        tasks = []
+        count = 0
+        self.last_origin = buffer_origin(buffer, self.last_origin)
+        while True:
+            pack = insert_storage.get_similar_pack_clear()
+            if pack is None:
+                break
+            if pack:
+                count += len(pack)
+                tasks.append(asyncio.create_task(self._dump_pack(pack, self.last_origin, len(tasks))))
+        # all packs of a batch are independent: one row per key in the buffer
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+        if buffer.binlog is not None:
+            binlog = buffer.binlog
+            assert await asyncio.to_thread(binlog.save)
+            self.saved_binlog = binlog.copy()
+            if self.regeneration:
+                self.regeneration_flushed.set()
+        self.flushed_batches += 1
+        self.flushed_rows += count
+
+    async def _transform(self, buffer, insert_storage):
+        if self.table_mapping:
+            for key in buffer.tables():
+                schema, table = self.tables.split(key)
+                converter = self.table_mapping.get(table)
+                if converter is None:
+                    continue
+                items = buffer.pop_table(key)
+                if items:
+                    # deletes without deleted_column are left to the plugin
+                    rest = []
+                    insert_storage.push_rows(converter.target, converter.columns, converter.convert_items(items, schema, rest))
+                    buffer.put_items(rest)
+
+        process_event = self.plugin.process_event
+        is_async = inspect.iscoroutinefunction(process_event)
+        pending = []
+        while True:
+            event = buffer.get_event()
+            if event is None:
+                break
+            schema, table = self.tables.split(event.table)
+            payload = event.event
+            if self.compact_rows and not self.plugin.compact_rows:
+                payload = materialize_event(event.event_type, payload)
+            kwargs = {}
+            if self.plugin.process_event_version:
+                kwargs['version'] = event.version
+            if self.plugin.process_event_schema:
+                kwargs['schema'] = schema
+            if is_async:
+                pending.append(process_event(event.event_type, table, payload, **kwargs))
+            else:
+                self._push_result(insert_storage, process_event(event.event_type, table, payload, **kwargs))
+        if pending:
+            for result in await asyncio.gather(*pending):
+                self._push_result(insert_storage, result)
+
+    @staticmethod
+    def _push_result(insert_storage, result):
+        assert result is not None, f"Unexpected None for result"
+        for r in result:
+            insert_storage.push(r.table_name, r.columns, r.values)
+
+    async def _dump_pack(self, pack, origin=None, pack_index=0):
+        table_name = pack[0].table_name
+        columns = pack[0].keys
+        values = [p.values for p in pack]
+        kwargs = {'batch_id': batch_id(origin, pack_index, table_name, columns, values)} if self.dump_batch_id else {}
+        if self.plugin.dump_columns is not None:
+            func, data = self.plugin.dump_columns, rows_to_columns(pack)
+        else:
+            func, data = self.plugin.dump_values, values
+
+        attempt = 0
+        while True:
+            async with self.semaphore:
+                self.in_flight += 1
+                try:
+                    if inspect.iscoroutinefunction(func):
+                        await func(table_name, columns, data, **kwargs)
+                    else:
+                        # a blocking sink doesn't stop the loop
+                        await asyncio.to_thread(func, table_name, columns, data, **kwargs)
+                    return
+                except Exception as e:
+                    if attempt >= self.retries or self.stop_event.is_set():
+                        raise
+                    delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+                    attempt += 1
+                    logger.warning(f"dump of {table_name} failed, retry {attempt}/{self.retries} in {delay}s: {e}")
+                finally:
+                    self.in_flight -= 1
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), timeout=delay)
+                raise RuntimeError("Engine is stopping")
+            except asyncio.TimeoutError:
+                pass
+
+    # ---------- health ----------
+
+    async def _health(self, reader, writer):
+        try:
+            try:
+                request = await asyncio.wait_for(reader.readline(), timeout=HEALTH_REQUEST_WAIT)
+            except asyncio.TimeoutError:
+                request = b''
+            if request.strip():
+                # commands of the health socket (regenerate, profile, memory, tune) need the threaded engine
+                response = {"status": "error", "error": "engine 'asyncio' doesn't support health commands"}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+                return
+            try:
+                binlog_db = await asyncio.to_thread(get_binlog_from_db, self.mysql_settings, self.app_settings)
+            except Exception as e:
+                binlog_db = None
+                logger.warning(f"health: {e}")
+            response = {
+                "status": "ok" if self.error is None else "error",
+                "engine": "asyncio",
+                "stage": self.stage,
+                "binlog_server_current": str(binlog_db),
+                "binlog_server_parsed": str(self.parsed_binlog),
+                "consumer_binlog": str(self.saved_binlog),
+                "startup": self.startup.statistic(),
+                "queue_len": self.queue.qsize(),
+                "in_flight": self.in_flight,
+                "flushed_batches": self.flushed_batches,
+                "flushed_rows": self.flushed_rows,
+                "error": self.error or '',
+            }
+            writer.write((json.dumps(response) + "\n").encode())
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+def run(MYSQL_SETTINGS, APP_SETTINGS):
+    return asyncio.run(async_engine(MYSQL_SETTINGS, APP_SETTINGS).run())
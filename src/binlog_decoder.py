@@ -0,0 +1,142 @@
+from pymysqlreplication import BinLogStreamReader
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+from pymysqlreplication.event import MariadbGtidEvent, XidEvent, QueryEvent
+
+from .rows import compact_row
+from .tools import binlog_version, gtid_version, gtid_seq, project_row, ddl_tables, check_binlog_in_range
+
+
+def open_binlog_stream(mysql_settings, app_settings, binlog, tables, binlogs=None):
+    """
+    Reader of the binlog after the checkpoint, -> (stream, gtid_positioning).
+    GTID auto-positioning: the server seeks by its gtid index, no SHOW BINARY LOGS needed,
+    and the position is valid on any primary of the replication topology.
+    """
+    gtid_positioning = app_settings.get('gtid_positioning', False) and bool(binlog.gtid)
+    if gtid_positioning:
+        position = dict(auto_position=binlog.gtid_str(), is_mariadb=True)
+    else:
+        if not check_binlog_in_range(mysql_settings, binlog, binlogs=binlogs):
+            raise ValueError(f"Binlog {binlog} is out of range")
+        position = dict(log_file=binlog.file, log_pos=binlog.pos)
+
+    stream = BinLogStreamReader(
+        connection_settings=mysql_settings,
+        server_id=app_settings['unique_consumer_server_id'],          # уникальный server_id для consumer
+        blocking=False,             # ждём новые события
+        resume_stream=True,        # продолжим с последней позиции, если указана
+        only_events=[
+            WriteRowsEvent,
+            UpdateRowsEvent,
+            DeleteRowsEvent,
+            XidEvent,
+            QueryEvent,
+            MariadbGtidEvent,
+        ],
+        only_schemas=tables.only_schemas(),
+        only_tables=tables.only_tables(),
+        freeze_schema=True,
+        **position,
+    )
+    return stream, gtid_positioning
+
+
+class binlog_decoder:
+    """
+    Binlog events -> rows and commit markers, shared by engine.py and async_engine.py, so both engines
+    decode, convert and version rows the same way. The engines keep only their own reactions:
+    where rows and markers go and how a schema change waits for the sink.
+    """
+
+    def __init__(self, binlog_stream, binlog, tables, app_settings, converters=None, keep_before=False, compact_rows=False, gtid_positioning=False):
+        self.stream = binlog_stream
+        # position of the last commit, updated in place
+        self.binlog = binlog
+        self.tables = tables
+        self.converters = converters
+        self.keep_before = keep_before
+        self.make_row = compact_row.from_dict if compact_rows else project_row
+        self.table_columns = app_settings.get('table_columns', {})
+        self.gtid_positioning = gtid_positioning
+        # row versions by GTID seq_no, they survive switchover to another primary; see tools.gtid_version()
+        self.gtid_versions = app_settings.get('gtid_positioning', False)
+        # (domain_id, gtid) of the current transaction, committed into binlog by commit()
+        self.current_gtid = None
+        # rows of the current transaction, the row number of gtid versions
+        self.transaction_rows = 0
+
+    @staticmethod
+    def is_gtid(event):
+        return isinstance(event, MariadbGtidEvent)
+
+    @staticmethod
+    def is_commit(event):
+        return isinstance(event, XidEvent)
+
+    def begin(self, event):
+        self.current_gtid = (event.domain_id, event.gtid)
+        self.transaction_rows = 0
+
+    def commit(self, event):
+        """Transaction (or DDL) is committed at the end of the event, -> copy of the position."""
+        self.binlog.pos = event.packet.log_pos
+        self.binlog.file = self.stream.log_file
+        if self.current_gtid:
+            self.binlog.gtid[self.current_gtid[0]] = self.current_gtid[1]
+            self.current_gtid = None
+        if self.gtid_positioning:
+            # non-blocking stream reconnects on every loop, it has to continue after the last commit
+            self.stream.auto_position = self.binlog.gtid_str()
+        return self.binlog.copy()
+
+    def schema_change(self, event):
+        """Scanned tables changed by a DDL QueryEvent, [] - nothing to do."""
+        if not isinstance(event, QueryEvent):
+            return []
+        schema = event.schema.decode() if isinstance(event.schema, bytes) else event.schema
+        ddl = ddl_tables(event.query, schema)
+        return [t for t in ddl[1] if self.tables.is_scanned(*t)] if ddl else []
+
+    def forget_tables(self, tables):
+        """After DDL rows are read with the new schema: cached table maps and converters are dropped."""
+        for table_id, table in list(self.stream.table_map.items()):
+            if (getattr(table, 'schema', None), getattr(table, 'table', None)) in tables:
+                del self.stream.table_map[table_id]
+        if self.converters:
+            for schema, table in tables:
+                self.converters.invalidate(schema, table)
+
+    def is_scanned_rows(self, event):
+        return isinstance(event, (WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent)) and self.tables.is_scanned(event.schema, event.table)
+
+    def key(self, event):
+        return self.tables.key(event.schema, event.table)
+
+    def domain(self):
+        return self.current_gtid[0] if self.current_gtid else None
+
+    def rows(self, event):
+        """Rows of a rows event -> (event_type, row event, version), values converted and projected."""
+        columns = self.table_columns.get(event.table)
+        event_pos = event.packet.log_pos - event.event_size
+        convert = self.converters.get(event.schema, event.table, event.columns) if self.converters else None
+        make_row = self.make_row
+        seq_no = gtid_seq(self.current_gtid[1]) if self.gtid_versions and self.current_gtid else None
+        for row_index, row in enumerate(event.rows):
+            if convert:
+                for values in row.values():
+                    convert(values)
+            if seq_no is not None:
+                version = gtid_version(seq_no, self.transaction_rows)
+                self.transaction_rows += 1
+            else:
+                version = binlog_version(self.stream.log_file, event_pos, row_index)
+            if isinstance(event, WriteRowsEvent):
+                yield 'insert', make_row(row['values'], columns), version
+            elif isinstance(event, UpdateRowsEvent):
+                yield 'update', {
+                    'before_values': make_row(row['before_values'], columns) if self.keep_before else None,
+                    'after_values': make_row(row['after_values'], columns),
+                }, version
+            else:
+                yield 'delete', {'values': make_row(row['values'], columns)}, version
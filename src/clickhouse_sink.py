@@ -0,0 +1,164 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def transient_error(e) -> bool:
+    """Network and server-availability errors are retried, errors of the data or the query are not."""
+    from clickhouse_connect.driver.exceptions import OperationalError, StreamFailureError
+    return isinstance(e, (OperationalError, StreamFailureError, ConnectionError, TimeoutError))
+
+
+class clickhouse_sink:
+    """
+    Built-in ClickHouse sink, selected by APP_SETTINGS['clickhouse_sink']:
+
+        'clickhouse_sink': {
+            'host': '127.0.0.1', 'port': 8123, 'user': 'default', 'password': '', 'database': 'default',
+            'pool_size': 4,                 # long-lived clients, one per concurrent insert
+            'compress': 'lz4',              # HTTP body compression of inserts
+            'async_insert': False,          # server-side buffering of small inserts
+            'retries': 0,                   # own retries of an insert, packs are retried by delivery_retries
+            'retry_backoff': 0.5,           # seconds, doubled on every attempt
+            'acquire_timeout': 30,          # seconds to wait for a free client, then the insert fails
+        }
+
+    Clients are created on demand and kept in the pool; a client which has failed is closed and replaced.
+    """
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.pool_size = settings.get('pool_size', 4)
+        self.retries = settings.get('retries', 0)
+        self.retry_backoff = settings.get('retry_backoff', 0.5)
+        self.acquire_timeout = settings.get('acquire_timeout', 30)
+        self.insert_settings = {}
+        if settings.get('async_insert'):
+            # the checkpoint is saved after dump, so the insert must be flushed by the server before the answer
+            self.insert_settings = {'async_insert': 1, 'wait_for_async_insert': 1}
+
+        # idle clients, the last released is taken first
+        self.pool = []
+        self.lock = threading.Lock()
+        # signalled on every release, a failed client frees its place in the pool as well
+        self.released = threading.Condition(self.lock)
+        self.clients = 0
+        self.closed = False
+
+        self.inserts = 0
+        self.rows = 0
+        self.retried = 0
+        self.errors = 0
+
+    def _new_client(self):
+        import clickhouse_connect
+        return clickhouse_connect.get_client(
+            host=self.settings.get('host', '127.0.0.1'),
+            port=self.settings.get('port', 8123),
+            username=self.settings.get('user', 'default'),
+            password=self.settings.get('password', ''),
+            database=self.settings.get('database', 'default'),
+            compress=self.settings.get('compress', 'lz4'),
+        )
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self.released:
+            while True:
+                if self.closed:
+                    raise RuntimeError("clickhouse sink is closed")
+                if self.pool:
+                    return self.pool.pop()
+                if self.clients < self.pool_size:
+                    self.clients += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # transient: retried like a network error
+                    raise TimeoutError(f"no free clickhouse client in {self.acquire_timeout}s")
+                self.released.wait(remaining)
+        try:
+            return self._new_client()
+        except Exception:
+            with self.released:
+                self.clients -= 1
+                self.released.notify()
+            raise
+
+    def _release(self, client, failed=False):
+        with self.released:
+            drop = failed or self.closed
+            if drop:
+                self.clients -= 1
+            else:
+                self.pool.append(client)
+            self.released.notify()
+        if drop:
+            self._close_client(client)
+
+    @staticmethod
+    def _close_client(client):
+        try:
+            client.close()
+        except Exception as e:
+            logger.debug(f"close client: {e}")
+
+    def _insert(self, table_name, columns, data, column_oriented, batch_id):
+        settings = self.insert_settings
+        if batch_id is not None:
+            # same token for a retried pack, ClickHouse drops the repeated block
+            settings = dict(settings, insert_deduplication_token=batch_id)
+        attempt = 0
+        while True:
+            client = None
+            try:
+                client = self._acquire()
+                client.insert(table=table_name, data=data, column_names=columns,
+                              column_oriented=column_oriented, settings=settings)
+                self._release(client)
+                break
+            except Exception as e:
+                if client is not None:
+                    self._release(client, failed=True)
+                if attempt >= self.retries or not transient_error(e):
+                    with self.lock:
+                        self.errors += 1
+                    raise
+                delay = self.retry_backoff * 2 ** attempt
+                attempt += 1
+                with self.lock:
+                    self.retried += 1
+                logger.warning(f"insert into {table_name} failed, retry {attempt}/{self.retries} in {delay}s: {e}")
+                time.sleep(delay)
+
+        with self.lock:
+            self.inserts += 1
+            self.rows += len(data[0]) if column_oriented and data else len(data)
+
+    def dump_values(self, table_name, columns, values, batch_id=None):
+        self._insert(table_name, columns, values, column_oriented=False, batch_id=batch_id)
+
+    def dump_columns(self, table_name, columns, data, batch_id=None):
+        self._insert(table_name, columns, data, column_oriented=True, batch_id=batch_id)
+
+    def close(self):
+        with self.released:
+            self.closed = True
+            idle, self.pool = self.pool, []
+            self.clients -= len(idle)
+            # waiters fail at once instead of waiting for clients, which are not returned any more
+            self.released.notify_all()
+        for client in idle:
+            self._close_client(client)
+
+    def statistic(self):
+        with self.lock:
+            return {
+                "clients": self.clients,
+                "inserts": self.inserts,
+                "rows": self.rows,
+                "retries": self.retried,
+                "errors": self.errors,
+            }
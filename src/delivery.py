@@ -0,0 +1,149 @@
+import time
+import uuid
+import pickle
+import itertools
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# origins of buffers without replay-stable coordinates are unique to the process run
+RUN_ID = uuid.uuid4().hex
+_RUN_ORIGINS = itertools.count(1)
+
+
+def buffer_origin(buffer, previous=None) -> str:
+    """
+    Coordinates of a swapped buffer for pack ids: its commit marker, a replay of the same binlog range gets the same one.
+    A buffer without an own marker (regeneration rows, partial chunks, micro batches) or with the marker
+    of the previous buffer (previous - its origin) gets an origin unique to the run: such packs are never deduplicated.
+    """
+    binlog = buffer.binlog
+    if binlog is not None and not buffer.partial:
+        origin = f"{binlog.file}:{binlog.pos}:{binlog.gtid_str()}"
+        if origin != previous:
+            return origin
+    return f"{RUN_ID}:{next(_RUN_ORIGINS)}"
+
+
+def batch_id(origin, pack_index, table_name, columns, values) -> str:
+    """
+    Id of a pack for deduplication in the sink: origin of its buffer, number of the pack in the buffer and the content.
+    Retries and a replay with the same packs get the same id. Equal content of different buffers gets different ids,
+    a replay which splits rows into other packs (worker threads fill the insert buffer in any order) gets new ids -
+    rows are inserted once more instead of being lost.
+    """
+    payload = pickle.dumps((origin, pack_index, table_name, list(columns), values), protocol=pickle.HIGHEST_PROTOCOL)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+class delivery_stopped(Exception):
+    pass
+
+
+class delivery:
+    """
+    Retrying delivery of packs to the sink, shared by all flush threads.
+
+    A failed pack is retried with exponential backoff (backoff, 2 * backoff, ... up to max_backoff),
+    at most retries times; only after that the error goes to the caller, which stops the engine.
+    After breaker_threshold consecutive failures the circuit breaker opens: all threads pause for
+    breaker_cooldown seconds, then a single attempt probes the sink, the others wait for its result.
+    """
+
+    def __init__(self, retries=0, backoff=0.5, max_backoff=30.0, breaker_threshold=5, breaker_cooldown=10.0, is_stopped=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        # is_stopped() - the engine is stopping, waiting is interrupted
+        self.is_stopped = is_stopped or (lambda: False)
+
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.consecutive_failures = 0
+        self.open_until = None
+        self.probing = False
+
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        self.breaker_opened = 0
+
+    def _sleep(self, seconds):
+        deadline = time.time() + seconds
+        while not self.is_stopped():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 0.1))
+        raise delivery_stopped("Engine is stopping")
+
+    def _enter(self):
+        """Waits while the breaker is open; returns True, if the caller is the probe of a half-open breaker."""
+        with self.lock:
+            while True:
+                if self.open_until is None:
+                    return False
+                now = time.time()
+                if now >= self.open_until and not self.probing:
+                    self.probing = True
+                    return True
+                if self.is_stopped():
+                    raise delivery_stopped("Engine is stopping")
+                self.condition.wait(0.1)
+
+    def _success(self, probe):
+        with self.lock:
+            self.consecutive_failures = 0
+            self.open_until = None
+            if probe:
+                self.probing = False
+            self.delivered += 1
+            self.condition.notify_all()
+
+    def _failure(self, probe):
+        with self.lock:
+            self.consecutive_failures += 1
+            if probe:
+                self.probing = False
+            if self.consecutive_failures >= self.breaker_threshold:
+                if self.open_until is None or probe:
+                    self.breaker_opened += 1
+                self.open_until = time.time() + self.breaker_cooldown
+            self.condition.notify_all()
+
+    def deliver(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            probe = self._enter()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                self._failure(probe)
+                if attempt >= self.retries:
+                    with self.lock:
+                        self.failed += 1
+                    raise
+                delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+                attempt += 1
+                with self.lock:
+                    self.retried += 1
+                logger.warning(f"delivery failed, retry {attempt}/{self.retries} in {delay}s: {e}")
+                self._sleep(delay)
+                continue
+            self._success(probe)
+            return
+
+    def statistic(self):
+        with self.lock:
+            return {
+                "delivered": self.delivered,
+                "retries": self.retried,
+                "failed": self.failed,
+                "breaker_open": self.open_until is not None,
+                "breaker_opened": self.breaker_opened,
+            }
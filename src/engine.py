@@ -9,14 +9,27 @@ import threading
 import importlib
 import sys
 import json
+import fnmatch
+import contextlib
 from enum import Enum
 import traceback
 from pymysqlreplication import BinLogStreamReader
-from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
-from pymysqlreplication.event import MariadbGtidEvent, XidEvent, QueryEvent
 
-from .tools import binlog_file, plugin_wrapper, regeneration_threads_controller, get_binlog_diff, get_binlog_from_db, insert_buffer
+from .table_mapping import compile_table_mapping
+from .rows import compact_row, materialize_event
+from .value_converters import value_converters
+from .binlog_decoder import open_binlog_stream, binlog_decoder
+from .profiler import sampling_profiler
+from .memory import process_memory, table_map_statistic, interned_schemas_statistic, tracemalloc_session
+from .tuning import parse_tuning, tuned_settings, rate_limiter
+from .clickhouse_sink import clickhouse_sink
+from .delivery import delivery, batch_id, buffer_origin
+from .tools import binlog_file, plugin_wrapper, regeneration_threads_controller, get_binlog_diff, get_binlog_from_db, table_filter, insert_buffer, rows_to_columns, select_columns, checkpoint_controller, version_horizon, parse_gtid, gtid_seq, accepts_argument, get_binlogs, startup_timings
+from .table_metadata import table_metadata, schema_fingerprint
 from .synch_storage import synch_storage
+from .spill_queue import spill_queue
+from .group_scheduler import group_commit_scheduler
+from .partitioned import partitioned_applier
 
 logging.getLogger("pymysqlreplication").setLevel(logging.ERROR)
 
@@ -53,6 +66,32 @@ class Stage(Enum):
     SYNCH = 'SYNCH'
 
 USER_FUNC = None
+#sinks by name: 'default' is the main plugin (USER_FUNC), others come from APP_SETTINGS['extra_sinks']
+SINKS = {}
+DEFAULT_SINK = 'default'
+EXTRA_SINKS = []
+#settings of the main sink, which an extra sink doesn't inherit
+SINK_OWN_SETTINGS = ('clickhouse_sink', 'table_mapping', 'extra_sinks')
+#schemas and tables of the engine, patterns are resolved at start, see table_filter
+TABLES = None
+#rows are compact_row instead of dicts, see APP_SETTINGS['compact_rows']
+COMPACT_ROWS = False
+#running or last targeted regeneration of tables, see table_regeneration
+TABLE_REGENERATION = None
+#last profile of the 'profile' command, see profiler.sampling_profiler
+PROFILER = None
+#allocation tracing of the 'memory' command
+TRACEMALLOC = tracemalloc_session()
+#table-map cache of the binlog reader is reported by the 'memory' command
+BINLOG_STREAM = None
+#startup phase timings, see tools.startup_timings
+STARTUP = startup_timings()
+#rows per second of regeneration reads, see APP_SETTINGS['full_regeneration_max_rows_per_s'] and the 'tune' command
+THROTTLE = rate_limiter()
+#positions are compared by GTID, file/pos of different servers are not comparable, see APP_SETTINGS['gtid_positioning']
+GTID_POSITIONING = False
+#per-table value converters, see APP_SETTINGS['value_converters'], None - values as pymysql gives them
+CONVERTERS = None
 STOP = None
 LAST_SIGINT = None
 FORCE_EXIT_WINDOW = None
@@ -64,15 +103,333 @@ PARSED_BINLOG_TOTAL = None
 PARSED_BINLOG_MY = None
 GLOBAL_LOCK = threading.Lock()
 SYNCH_STORAGE = None
+INSERT_STORAGE = None
+#optional disk queue between binlog reader and SYNCH_STORAGE
+SPILL_QUEUE = None
+#flush pipelines by key, 'default' owns SYNCH_STORAGE, others are created per GTID domain
+PIPELINES = {}
+DEFAULT_PIPELINE = 'default'
+ROUTER = None
+CHECKPOINT = None
+#apply_mode 'group_commit': replaces ROUTER for the binlog stream
+GROUP_SCHEDULER = None
+#apply_mode 'partitioned': replaces ROUTER for the binlog stream
+PARTITIONED_APPLIER = None
+#apply_buffer runs in several threads, initiate_dropdown_workers of the plugin is called by one of them at a time
+DROPDOWN_LOCK = threading.Lock()
+
+# MariaDB GTID event flag: commit_id of the group commit follows the flags
+FL_GROUP_COMMIT_ID = 2
+
+
+def gtid_commit_id(event):
+    """Reads commit_id of a MariadbGtidEvent, pymysqlreplication stops parsing right before it."""
+    if not event.flags & FL_GROUP_COMMIT_ID:
+        return None
+    return event.packet.read_uint64()
+
+
+class sink_context:
+    """
+    One destination of the binlog stream: plugin, its table mapping, built-in sink, delivery and checkpoint file.
+    Settings of an extra sink override the main APP_SETTINGS.
+    """
+
+    def __init__(self, name, settings):
+        self.name = name
+        self.settings = settings
+        self.plugin = plugin_wrapper(settings['handle_events_plugin'])
+        # compiled table_mapping, these tables bypass plugin process_event
+        self.table_mapping = compile_table_mapping(settings)
+        # built-in sink from clickhouse_sink, replaces dump_values of the plugin
+        self.sink = None
+        if settings.get('clickhouse_sink'):
+            self.sink = clickhouse_sink(settings['clickhouse_sink'])
+            self.plugin.dump_values = self.sink.dump_values
+            self.plugin.dump_columns = self.sink.dump_columns
+        if self.plugin.dump_values is None and self.plugin.dump_columns is None:
+            raise ValueError(f"Sink '{name}': plugin must define dump_values or dump_columns, or clickhouse_sink must be configured")
+        self.dump_batch_id = accepts_argument(self.plugin.dump_columns or self.plugin.dump_values, 'batch_id')
+        # retries of failed packs
+        self.delivery = delivery(
+            retries=settings.get('delivery_retries', 0),
+            backoff=settings.get('delivery_backoff', 0.5),
+            max_backoff=settings.get('delivery_max_backoff', 30.0),
+            breaker_threshold=settings.get('delivery_breaker_threshold', 5),
+            breaker_cooldown=settings.get('delivery_breaker_cooldown', 10.0),
+            is_stopped=lambda: STOP,
+        )
+        # checkpoint of the sink at start: events and markers before it are already in the sink
+        self.start_binlog = None
+        self.start = None
+        # flush pipeline of an extra sink, the default sink uses PIPELINES
+        self.pipeline = None
+        # the sink gets rows of the full regeneration; a sink with a checkpoint catches up from it instead
+        self.regenerates = True
+
+    def set_start(self, binlog):
+        self.start_binlog = binlog.copy() if binlog else None
+        self.start = version_horizon(binlog, GTID_POSITIONING) if binlog else None
+
+    def is_applied(self, version, domain=None):
+        return self.start is not None and self.start.before(version, domain)
+
+    def skips(self, version, domain=None):
+        """The row isn't routed to the sink: it's before the checkpoint or the sink sits out the full regeneration."""
+        if STAGE != Stage.SYNCH and not self.regenerates:
+            return True
+        return self.is_applied(version, domain)
+
+    def is_applied_binlog(self, binlog):
+        return self.start_binlog is not None and position_reached(self.start_binlog, binlog)
+
+
+def position_reached(saved, binlog):
+    """saved is at binlog or after it: by GTID with gtid_positioning, by file/pos otherwise"""
+    if GTID_POSITIONING and binlog.gtid:
+        return saved.gtid_covers(binlog)
+    return not saved < binlog
+
+
+def oldest_position(app_settings, positions):
+    """
+    Reader position for several checkpoints. With gtid_positioning every domain starts from its lowest seq_no,
+    a domain which some checkpoint hasn't seen yet is read from its beginning.
+    """
+    oldest = min(positions)
+    gtid = oldest.gtid
+    if GTID_POSITIONING:
+        domains = set.intersection(*(set(p.gtid) for p in positions))
+        gtid = {domain: min((p.gtid[domain] for p in positions), key=gtid_seq) for domain in domains}
+    return binlog_file(app_settings['binlog_file'], file=oldest.file, pos=oldest.pos, gtid=gtid)
+
+
+def regeneration_pipelines():
+    """Pipelines, which get full regeneration rows: of the default sink and of extra sinks without a checkpoint."""
+    pipelines = [PIPELINES[DEFAULT_PIPELINE]] if SINKS[DEFAULT_SINK].regenerates else []
+    return pipelines + [c.pipeline for c in EXTRA_SINKS if c.regenerates]
+
+
+def load_checkpoint(context):
+    binlog = binlog_file(file_path=context.settings['binlog_file'])
+    return binlog if binlog.load() else None
+
+
+def copy_row(row):
+    # compact rows are read-only, they are shared as is
+    return row if isinstance(row, compact_row) else dict(row)
+
+
+def copy_event(event_type, event):
+    """Extra sinks get their own row dicts, plugins are allowed to change events in place."""
+    if event_type in ('insert', 'snapshot'):
+        return copy_row(event)
+    if event_type == 'update':
+        before = event.get('before_values')
+        return {'before_values': copy_row(before) if before is not None else None, 'after_values': copy_row(event['after_values'])}
+    return {'values': copy_row(event['values'])}
+
+
+class flush_pipeline:
+    """Storage with its own flush thread, which dumps events through the plugin and commits their binlog position."""
+
+    def __init__(self, key, storage, domain=None, owns_gtid=True, context=None):
+        self.key = key
+        self.domain = domain
+        self.owns_gtid = owns_gtid
+        self.storage = storage
+        self.insert_storage = insert_buffer()
+        self.thread = None
+        # sink of the pipeline, None - the default one
+        self.context = context
+        # all regeneration rows of the pipeline are dumped
+        self.regeneration_dumped = False
+        # origin of the last dumped buffer, see delivery.buffer_origin
+        self.last_origin = None
+
+    def get_context(self):
+        return self.context or SINKS[DEFAULT_SINK]
+
+    def start(self, app_settings):
+        self.thread = threading.Thread(target=run_workers_thread, daemon=True, name=f"flusher-{self.key}", args=(app_settings, self))
+        self.thread.start()
+
+
+def new_storage(app_settings):
+    return synch_storage(
+        max_len=app_settings['clickhouse_max_batch_len'],
+        max_bytes=app_settings.get('synch_storage_max_bytes'),
+        allow_partial=app_settings.get('large_transaction_streaming', False),
+        compaction=app_settings.get('synch_compaction', False),
+    )
+
+
+class event_router:
+    """
+    Routes binlog events to flush pipelines.
+    With parallel_domains every GTID domain gets its own pipeline, so a slow domain does not hold back others.
+    Binlog markers go to every pipeline: a marker only says that the pipeline has got all its events before it.
+    """
+
+    def __init__(self, app_settings):
+        self.app_settings = app_settings
+        self.parallel_domains = app_settings.get('parallel_domains', False)
+        self.lock = threading.Lock()
+        # last routed marker, a new pipeline has nothing pending before it
+        self.last_binlog = None
+
+    def get_pipeline(self, domain):
+        if not self.parallel_domains or domain is None:
+            return PIPELINES[DEFAULT_PIPELINE]
+        key = f"domain-{domain}"
+        pipeline = PIPELINES.get(key)
+        if pipeline is None:
+            with self.lock:
+                pipeline = PIPELINES.get(key)
+                if pipeline is None:
+                    pipeline = flush_pipeline(key, new_storage(self.app_settings), domain=domain)
+                    CHECKPOINT.register(key, self.last_binlog or CHECKPOINT.binlog, domain=domain)
+                    PIPELINES[key] = pipeline
+                    pipeline.start(self.app_settings)
+                    logger.info(f"pipeline for gtid domain {domain} started")
+        return pipeline
+
+    def put_event(self, event_type, table, event, domain=None, version=None):
+        if not EXTRA_SINKS:
+            # one sink: the reader starts from its checkpoint, there is nothing to skip
+            self.get_pipeline(domain).storage.put_event(event_type=event_type, table=table, event=event, version=version)
+            return
+        # after restart the reader starts from the oldest sink checkpoint, sinks skip what they already have
+        if not SINKS[DEFAULT_SINK].skips(version, domain):
+            self.get_pipeline(domain).storage.put_event(event_type=event_type, table=table, event=event, version=version)
+        for context in EXTRA_SINKS:
+            if not context.skips(version, domain):
+                context.pipeline.storage.put_event(event_type=event_type, table=table, event=copy_event(event_type, event), version=version)
+
+    def put_binlog(self, binlog):
+        self.last_binlog = binlog.copy()
+        if not EXTRA_SINKS or not SINKS[DEFAULT_SINK].is_applied_binlog(binlog):
+            for pipeline in list(PIPELINES.values()):
+                pipeline.storage.put_binlog(binlog)
+        for context in EXTRA_SINKS:
+            if not context.is_applied_binlog(binlog):
+                context.pipeline.storage.put_binlog(binlog)
+
+class table_regeneration:
+    """
+    Snapshot of some scanned tables while the binlog stream goes on, started by the 'regenerate' command.
+
+    Binlog rows of the tables are held while the snapshot is read; then rows older than the snapshot
+    position are dropped and the rest go on after the snapshot rows. Checkpoints are not saved until
+    the held rows are dumped, after a crash the stream is replayed from the position before the command.
+    """
+
+    def __init__(self, pairs, target):
+        self.pairs = pairs
+        self.keys = {TABLES.key(schema, table) for schema, table in pairs}
+        self.target = target
+        self.lock = threading.Lock()
+        self.held = []
+        # version of snapshot rows, binlog rows up to it are in the snapshot
+        self.version = None
+        # snapshot position in the version space, compares gtid versions by domain, see tools.version_horizon
+        self.horizon = None
+        self.snapshot_binlog = None
+        self.released = False
+        # pipeline key -> swaps of its storage at release, buffers up to it may lack held rows
+        self.resume_swaps = {}
+        self.rows = 0
+        self.dropped = 0
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def holds(self, key):
+        return key in self.keys
+
+    def _in_snapshot(self, version, domain):
+        if self.horizon is not None:
+            return self.horizon.before(version, domain)
+        return self.version is not None and version is not None and version <= self.version
+
+    def put_event(self, event_type, table, event, domain=None, version=None):
+        with self.lock:
+            if self._in_snapshot(version, domain):
+                self.dropped += 1
+                return
+            if not self.released:
+                self.held.append((event_type, table, event, domain, version))
+                return
+        self.target.put_event(event_type=event_type, table=table, event=event, domain=domain, version=version)
+
+    def release(self):
+        """Snapshot rows are routed: held rows go after them; without a snapshot (error) all held rows go."""
+        with self.lock:
+            for event_type, table, event, domain, version in self.held:
+                if self._in_snapshot(version, domain):
+                    self.dropped += 1
+                    continue
+                self.target.put_event(event_type=event_type, table=table, event=event, domain=domain, version=version)
+            self.held = []
+            self.resume_swaps = {p.key: p.storage.swaps for p in all_pipelines()}
+            self.released = True
+            self.finished_at = time.time()
+
+    def allows_save(self, pipeline, buffer_data):
+        if not self.released:
+            return False
+        swaps = self.resume_swaps.get(pipeline.key)
+        return swaps is None or buffer_data.seq > swaps
+
+    def is_finished(self):
+        """Held rows are released and the reader has passed the snapshot position."""
+        if not self.released:
+            return False
+        return self.snapshot_binlog is None or (PARSED_BINLOG_TOTAL is not None and position_reached(PARSED_BINLOG_TOTAL, self.snapshot_binlog))
+
+    def statistic(self):
+        with self.lock:
+            return {
+                "tables": sorted(self.keys),
+                "snapshot_binlog": str(self.snapshot_binlog) if self.snapshot_binlog else None,
+                "rows": self.rows,
+                "held": len(self.held),
+                "dropped": self.dropped,
+                "released": self.released,
+                "seconds": round((self.finished_at or time.time()) - self.started_at, 1),
+                "error": self.error,
+            }
+
+
+def all_pipelines():
+    return list(PIPELINES.values()) + [context.pipeline for context in EXTRA_SINKS]
+
+
+def saves_allowed(pipeline, buffer_data):
+    """Checkpoints wait while a table regeneration holds rows, see table_regeneration."""
+    return TABLE_REGENERATION is None or TABLE_REGENERATION.allows_save(pipeline, buffer_data)
+
 
 def init(MYSQL_SETTINGS, APP_SETTINGS):
-    global USER_FUNC, STOP, LAST_SIGINT, FORCE_EXIT_WINDOW, STAGE, REGENERATION_CONTROLLER, PARSED_BINLOG, PARSED_BINLOG_MY
-    USER_FUNC = plugin_wrapper(APP_SETTINGS['handle_events_plugin'])
+    global USER_FUNC, SINKS, EXTRA_SINKS, STOP, LAST_SIGINT, FORCE_EXIT_WINDOW, STAGE, REGENERATION_CONTROLLER, PARSED_BINLOG, PARSED_BINLOG_MY, THROTTLE
+    SINKS = {DEFAULT_SINK: sink_context(DEFAULT_SINK, APP_SETTINGS)}
+    for name, settings in APP_SETTINGS.get('extra_sinks', {}).items():
+        if name in SINKS:
+            raise ValueError(f"Sink name '{name}' is reserved")
+        if not settings.get('binlog_file') or settings['binlog_file'] == APP_SETTINGS['binlog_file']:
+            raise ValueError(f"Sink '{name}' needs its own binlog_file")
+        if not settings.get('handle_events_plugin'):
+            raise ValueError(f"Sink '{name}' needs handle_events_plugin")
+        inherited = {k: v for k, v in APP_SETTINGS.items() if k not in SINK_OWN_SETTINGS}
+        SINKS[name] = sink_context(name, dict(inherited, **settings))
+    EXTRA_SINKS = [c for name, c in SINKS.items() if name != DEFAULT_SINK]
+    USER_FUNC = SINKS[DEFAULT_SINK].plugin
     STOP = False
     LAST_SIGINT = 0
     FORCE_EXIT_WINDOW = 1.5
     STAGE = Stage.INIT
     REGENERATION_CONTROLLER = regeneration_threads_controller(APP_SETTINGS['full_regeneration_threads_count'])
+    THROTTLE = rate_limiter(APP_SETTINGS.get('full_regeneration_max_rows_per_s', 0))
     PARSED_BINLOG = None
     PARSED_BINLOG_MY = None
 
@@ -91,10 +448,20 @@ FORBIDDEN = {
     "DROP", "ALTER", "CREATE", "TRUNCATE"
 }
 
-def save_binlog_position(binlog):
+def save_binlog_position(binlog, pipeline=None):
     logger.info(f"save binlog {binlog}")
+    if binlog and pipeline is not None and pipeline.context is not None:
+        # extra sink: own checkpoint file, its pipeline is the only one of the sink
+        binlog = binlog.copy()
+        binlog.file_path = pipeline.context.settings['binlog_file']
+        assert binlog.save()
+        return
     if binlog:
+        if pipeline is not None and CHECKPOINT is not None:
+            binlog = CHECKPOINT.commit(pipeline.key, binlog, domain=pipeline.domain, owns_gtid=pipeline.owns_gtid)
         assert binlog.save()
+        if SPILL_QUEUE:
+            SPILL_QUEUE.commit(binlog)
 
 
 def handle_stop(signum, frame):
@@ -113,7 +480,7 @@ def handle_stop(signum, frame):
 signal.signal(signal.SIGINT, handle_stop)   # Ctrl+C
 signal.signal(signal.SIGTERM, handle_stop)
 
-def preflight_check_ex(cursor, mysql_settings, app_settings):
+def preflight_check_ex(cursor, mysql_settings, app_settings, timings=None):
     def check_grants(cursor):
         cursor.execute("SHOW GRANTS FOR CURRENT_USER")
         grants = [row[0] for row in cursor.fetchall()]
@@ -217,74 +584,124 @@ def preflight_check_ex(cursor, mysql_settings, app_settings):
         if len(errors):
             raise RuntimeError(f"Can't find tables: {errors} | db_name {db_name}\nquery: {q}\nfetch result: {r}")
 
-    check_grants(cursor)
-    check_variables(cursor)
-    assert_readonly(cursor)
-    probe_binlog(mysql_settings)
-    if len(app_settings.get('scan_tables', [])):
-        check_tables(cursor, app_settings['db_name'], app_settings['scan_tables'])
+    def timed_probe():
+        started_at = time.perf_counter()
+        probe_binlog(mysql_settings)
+        if timings is not None:
+            timings.add('binlog_probe', time.perf_counter() - started_at)
+
+    # the replication probe has its own connection and is the slowest check, it goes beside the queries
+    probe = threading.Thread(target=timed_probe, daemon=True, name="preflight-binlog-probe")
+    probe.start()
+    try:
+        with timings.phase('preflight_queries') if timings is not None else contextlib.nullcontext():
+            check_grants(cursor)
+            check_variables(cursor)
+            assert_readonly(cursor)
+            # patterns are checked when they are resolved, see table_filter.resolve()
+            if len(app_settings.get('scan_tables', [])) and not table_filter(app_settings).has_patterns():
+                check_tables(cursor, app_settings['db_name'], app_settings['scan_tables'])
+    finally:
+        probe.join()
+
 
+def wait_checkpoint(app_settings, binlog):
+    """Waits until every sink has saved a checkpoint at binlog or after it, False - the engine is stopping."""
+    paths = [app_settings['binlog_file']] + [c.settings['binlog_file'] for c in EXTRA_SINKS]
+    while not STOP:
+        saved = [binlog_file(path) for path in paths]
+        if all(b.load() and position_reached(b, binlog) for b in saved):
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def handle_schema_change(app_settings, decoder, binlog, tables, query):
+    """
+    DDL of scanned tables: the reader waits until all rows before the DDL are dumped with the old schema,
+    drops the cached table maps and converters of the tables and lets plugins migrate the sink.
+    Rows after the DDL are read with the new schema, without restart.
+    """
+    logger.info(f"schema change of {tables} at {binlog}: {query}")
+    if not wait_checkpoint(app_settings, binlog):
+        return
+    decoder.forget_tables(tables)
+    for schema, table in tables:
+        for context in SINKS.values():
+            if context.plugin.schema_changed:
+                context.plugin.schema_changed(schema, table, query)
 
-def start_binlog_consumer(mysql_settings, app_settings, binlog):
-    global USER_FUNC, GLOBAL_LOCK, STAGE, PARSED_BINLOG_TOTAL, PARSED_BINLOG_MY, SYNCH_STORAGE
-    from .tools import check_binlog_in_range
 
-    if not check_binlog_in_range(mysql_settings, binlog):
-        raise ValueError(f"Binlog {binlog} is out of range")
+def start_binlog_consumer(mysql_settings, app_settings, binlog, binlogs=None):
+    global USER_FUNC, GLOBAL_LOCK, STAGE, PARSED_BINLOG_TOTAL, PARSED_BINLOG_MY, SYNCH_STORAGE, SPILL_QUEUE, BINLOG_STREAM
 
+    binlog_stream, gtid_positioning = open_binlog_stream(mysql_settings, app_settings, binlog, TABLES, binlogs=binlogs)
 
-    USER_FUNC.initiate_synch_mode()
+    for context in SINKS.values():
+        context.plugin.initiate_synch_mode()
     STAGE = Stage.SYNCH
 
-    binlog_stream = BinLogStreamReader(
-        connection_settings=mysql_settings,
-        server_id=app_settings['unique_consumer_server_id'],          # уникальный server_id для consumer
-        blocking=False,             # ждём новые события
-        resume_stream=True,        # продолжим с последней позиции, если указана
-        only_events=[
-            WriteRowsEvent,
-            UpdateRowsEvent,
-            DeleteRowsEvent,
-            XidEvent,
-            QueryEvent,
-        ],
-        only_schemas=[app_settings['db_name']],
-        only_tables=app_settings['scan_tables'],
-        freeze_schema=True,
-        log_file=binlog.file,
-        log_pos=binlog.pos,
+    BINLOG_STREAM = binlog_stream
+
+    # with spill queue the reader never waits for the sink, events are read back by spill_pump_thread
+    target = GROUP_SCHEDULER or PARTITIONED_APPLIER or SPILL_QUEUE or ROUTER
+
+    decoder = binlog_decoder(
+        binlog_stream, binlog, TABLES, app_settings,
+        converters=CONVERTERS,
+        # before images are needed by the plugin or by compaction to find no-op updates
+        keep_before=any(c.plugin.need_before_values for c in SINKS.values()) or app_settings.get('synch_compaction', False),
+        compact_rows=COMPACT_ROWS,
+        gtid_positioning=gtid_positioning,
     )
 
-    logger.info(f"🚀 Binlog consumer started from {binlog}. Synch with [{app_settings['db_name']}] . Waiting for events...")
+    def commit_position(event):
+        global PARSED_BINLOG_TOTAL
+        committed = decoder.commit(event)
+        PARSED_BINLOG_TOTAL = committed
+        target.put_binlog(committed.copy())
+        return committed
+
+    logger.info(f"🚀 Binlog consumer started from {binlog}. Synch with {TABLES.only_schemas()} . Waiting for events...")
+
+    STARTUP.mark('consumer_started')
+    first_event = True
+    # the reader runs in the thread which has called run(), named for profiles and tracebacks
+    threading.current_thread().name = "binlog-reader"
 
     try:
         while not STOP:
             for event in binlog_stream:
                 if STOP:
                     break
+                if first_event:
+                    STARTUP.mark('first_event')
+                    first_event = False
 
-                if isinstance(event, XidEvent):
+                if decoder.is_gtid(event):
+                    decoder.begin(event)
+                    if GROUP_SCHEDULER:
+                        GROUP_SCHEDULER.begin_transaction(gtid_commit_id(event))
 
-                    binlog.pos = event.packet.log_pos
-                    binlog.file = binlog_stream.log_file
-                    PARSED_BINLOG_TOTAL = binlog.copy()
-                    SYNCH_STORAGE.put_binlog(binlog.copy())
+                elif decoder.is_commit(event):
+                    commit_position(event)
 
-                elif event.schema != app_settings['db_name']:
-                    pass
-                elif event.table not in app_settings['scan_tables']:
-                    pass
-                elif isinstance(event, (WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent)):
+                elif decoder.is_scanned_rows(event):
                     PARSED_BINLOG_MY = binlog.copy()
-                    for row in event.rows:
+                    key = decoder.key(event)
+                    domain = decoder.domain()
+                    regeneration = TABLE_REGENERATION
+                    put_event = regeneration.put_event if regeneration is not None and regeneration.holds(key) else target.put_event
+                    for event_type, row_event, version in decoder.rows(event):
                         if STOP:
                             break
-                        if isinstance(event, WriteRowsEvent):
-                            SYNCH_STORAGE.put_event(event_type='insert', table=event.table, event=row['values'])
-                        elif isinstance(event, UpdateRowsEvent):
-                            SYNCH_STORAGE.put_event(event_type='update', table=event.table, event=row)
-                        elif isinstance(event, DeleteRowsEvent):
-                            SYNCH_STORAGE.put_event(event_type='delete', table=event.table, event=row)
+                        put_event(event_type=event_type, table=key, event=row_event, domain=domain, version=version)
+
+                else:
+                    # DDL is a transaction of its own, rows before it are committed at its position
+                    tables = decoder.schema_change(event)
+                    if tables:
+                        handle_schema_change(app_settings, decoder, commit_position(event), tables, event.query)
 
             time.sleep(0.2)
     except Exception as e:
@@ -293,10 +710,76 @@ def start_binlog_consumer(mysql_settings, app_settings, binlog):
         binlog_stream.close()
         return
 
+def spill_pump_thread(app_settings):
+    global STOP, SPILL_QUEUE, ROUTER
+
+    logger.info("spill pump started")
+
+    while not STOP:
+        record = SPILL_QUEUE.get(timeout=0.5)
+        if record is None:
+            continue
+
+        if record[0] == 'event':
+            _, event_type, table, event, domain, version = record
+            ROUTER.put_event(event_type=event_type, table=table, event=event, domain=domain, version=version)
+        elif record[0] == 'binlog':
+            _, file, pos, gtid = record
+            ROUTER.put_binlog(binlog_file(file_path=app_settings['binlog_file'], file=file, pos=pos, gtid=gtid))
+        else:
+            raise Exception(f"Unknown spill record: '{record[0]}'")
+
+
+#health client may send a command line, a plain health client sends nothing
+HEALTH_REQUEST_WAIT = 0.2
+
+
+def read_health_request(conn):
+    """{'command': name, 'args': [...]} sent by the client, None - plain health request."""
+    conn.settimeout(HEALTH_REQUEST_WAIT)
+    data = b''
+    try:
+        while not data.endswith(b'\n'):
+            chunk = conn.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+    except socket.timeout:
+        pass
+    conn.settimeout(None)
+    if not data.strip():
+        return None
+    try:
+        request = json.loads(data.decode())
+    except ValueError:
+        return {'command': None}
+    return request if isinstance(request, dict) else {'command': None}
+
+
+def run_health_command(mysql_settings, app_settings, request):
+    command = HEALTH_COMMANDS.get(request.get('command'))
+    if command is None:
+        return {"status": "error", "error": f"Unknown command: '{request.get('command')}'"}
+    try:
+        result = command(mysql_settings, app_settings, [str(a) for a in request.get('args', [])])
+    except Exception as e:
+        logger.warning(f"command {request.get('command')} failed: {e}")
+        return {"status": "error", "error": str(e)}
+    return dict({"status": "ok", "error": ''}, **result)
+
+
+def send_health_response(conn, response):
+    try:
+        conn.sendall((json.dumps(response, default=str) + "\n").encode())
+    except socket.timeout:
+        logger.warning("Send timeout")
+    except (BrokenPipeError, ConnectionError) as e:
+        logger.warning(f"Client disconnected: {e}")
+
 
 def health_server(socket_path, mysql_settings, app_settings):
 
-    global STOP, GLOBAL_LOCK, REGENERATION_CONTROLLER, STAGE, PARSED_BINLOG_TOTAL, PARSED_BINLOG_MY
+    global STOP, GLOBAL_LOCK, REGENERATION_CONTROLLER, STAGE, PARSED_BINLOG_TOTAL, PARSED_BINLOG_MY, SYNCH_STORAGE, INSERT_STORAGE
     server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
     try:
         server.bind(socket_path)
@@ -316,6 +799,18 @@ def health_server(socket_path, mysql_settings, app_settings):
             except socket.timeout:
                 continue
             with conn:
+                request = read_health_request(conn)
+                if request is not None:
+                    send_health_response(conn, run_health_command(mysql_settings, app_settings, request))
+                    continue
+
+                def _binlog_diff(a, b):
+                    # after primary switchover saved file/pos may not exist on the current server
+                    try:
+                        return get_binlog_diff(mysql_settings, a, b)
+                    except ValueError:
+                        return None
+
                 binlog_db = get_binlog_from_db(mysql_settings, app_settings)
                 binlog_saved = binlog_file(file_path=app_settings['binlog_file'])
                 if not binlog_saved.load():
@@ -328,6 +823,11 @@ def health_server(socket_path, mysql_settings, app_settings):
                     else:
                         human_estimate = ''
 
+                    storage_memory = SYNCH_STORAGE.memory_statistic()
+                    compaction = SYNCH_STORAGE.statistic()
+                    insert_memory = INSERT_STORAGE.memory_statistic() if INSERT_STORAGE else {}
+                    spill = SPILL_QUEUE.statistic() if SPILL_QUEUE else {}
+
                     response = {
                         "status": "ok",
                         "stage": str(STAGE),
@@ -339,16 +839,48 @@ def health_server(socket_path, mysql_settings, app_settings):
                         "binlog_server_parsed": str(PARSED_BINLOG_TOTAL),
                         "binlog_server_app": str(PARSED_BINLOG_MY),
                         "consumer_binlog": str(binlog_saved),
-                        "binlog_parsed_diff": get_binlog_diff(mysql_settings, PARSED_BINLOG_TOTAL, binlog_db),
-                        "binlog_diff": get_binlog_diff(mysql_settings, binlog_saved, binlog_db),
+                        "binlog_parsed_diff": _binlog_diff(PARSED_BINLOG_TOTAL, binlog_db),
+                        "binlog_diff": _binlog_diff(binlog_saved, binlog_db),
+                        "server_gtid": binlog_db.gtid_str(),
+                        "consumer_gtid": binlog_saved.gtid_str() if binlog_saved else None,
+                        "storage_events": storage_memory['events'],
+                        "storage_bytes": storage_memory['bytes'],
+                        "storage_inflight_bytes": storage_memory['inflight_bytes'],
+                        "storage_bytes_high_water": storage_memory['bytes_high_water'],
+                        "storage_max_bytes": storage_memory['max_bytes'],
+                        "storage_partial_chunks": storage_memory['partial_chunks'],
+                        "storage_overflow_events": storage_memory['overflow_events'],
+                        "compaction_insert_delete": compaction['insert_delete'],
+                        "compaction_noop_update": compaction['noop_update'],
+                        "compaction_merged": compaction['merged'],
+                        "insert_buffer_bytes": insert_memory.get('bytes', 0),
+                        "insert_buffer_bytes_high_water": insert_memory.get('bytes_high_water', 0),
+                        "spill_bytes": spill.get('bytes'),
+                        "spill_segments": spill.get('segments'),
+                        "spill_binlog": spill.get('last_binlog'),
+                        "pipelines": {k: v.storage.len() for k, v in list(PIPELINES.items())},
+                        "group_commit": GROUP_SCHEDULER.statistic() if GROUP_SCHEDULER else None,
+                        "partitioned": PARTITIONED_APPLIER.statistic() if PARTITIONED_APPLIER else None,
+                        "sink": SINKS[DEFAULT_SINK].sink.statistic() if SINKS[DEFAULT_SINK].sink else None,
+                        "delivery": SINKS[DEFAULT_SINK].delivery.statistic(),
+                        "value_converters": CONVERTERS.statistic() if CONVERTERS else None,
+                        "extra_sinks": {
+                            c.name: {
+                                "checkpoint": str(load_checkpoint(c)),
+                                "storage_events": c.pipeline.storage.len(),
+                                "sink": c.sink.statistic() if c.sink else None,
+                                "delivery": c.delivery.statistic(),
+                            }
+                            for c in EXTRA_SINKS
+                        },
+                        "table_regeneration": TABLE_REGENERATION.statistic() if TABLE_REGENERATION else None,
+                        "startup": STARTUP.statistic(),
+                        "profile": PROFILER.statistic() if PROFILER else None,
+                        "settings": tuned_settings(app_settings),
+                        "throttle": THROTTLE.statistic(),
                         "error": '',
                     }
-                    try:
-                        conn.sendall((json.dumps(response) + "\n").encode())
-                    except socket.timeout:
-                        logger.warning("Send timeout")
-                    except (BrokenPipeError, ConnectionError) as e:
-                        logger.warning(f"Client disconnected: {e}")
+                    send_health_response(conn, response)
     except Exception as e:
         logger.critical(f"Health server exception: {e}")
     finally:
@@ -360,19 +892,223 @@ def health_server(socket_path, mysql_settings, app_settings):
 
 
 
-def full_regeneration_thread(mysql_settings, app_settings):
+def table_regeneration_thread(mysql_settings, app_settings, regeneration):
+    """Reads one consistent snapshot of the tables by id ranges, rows are routed beside the binlog stream."""
+    table_columns = app_settings.get('table_columns', {})
+    conn = None
+    try:
+        conn = pymysql.connect(**mysql_settings)
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+        cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT;")
+        # MariaDB: binlog position of the snapshot, taken atomically with it
+        cursor.execute("SHOW STATUS LIKE 'binlog_snapshot_%';")
+        status = {r['Variable_name'].lower(): r['Value'] for r in cursor.fetchall()}
+        snapshot = binlog_file(app_settings['binlog_file'], file=status['binlog_snapshot_file'], pos=int(status['binlog_snapshot_position']))
+        gtid_versions = app_settings.get('gtid_positioning', False)
+        if gtid_versions:
+            cursor.execute("SELECT BINLOG_GTID_POS(%s, %s) AS gtid;", (snapshot.file, snapshot.pos))
+            snapshot.gtid = parse_gtid(cursor.fetchall()[0]['gtid'])
+        horizon = version_horizon(snapshot, gtid_versions)
+        version = horizon.version
+        with regeneration.lock:
+            regeneration.snapshot_binlog = snapshot
+            regeneration.horizon = horizon
+            regeneration.version = version
+        logger.info(f"regeneration of {sorted(regeneration.keys)} from snapshot {snapshot}")
+
+        for schema, table in regeneration.pairs:
+            key = TABLES.key(schema, table)
+            convert = CONVERTERS.get(schema, table) if CONVERTERS else None
+            last_id = None
+            while not STOP:
+                # read every batch, the 'tune' command may change it
+                batch_len = int(app_settings['full_regeneration_batch_len'])
+                where = f"WHERE id > {last_id} " if last_id is not None else ""
+                cursor.execute(f"SELECT {select_columns(table_columns.get(table))} FROM {schema}.{table} {where}ORDER BY id LIMIT {batch_len};")
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                for r in rows:
+                    if convert:
+                        convert(r)
+                    # not 'insert': an update of the row, routed before the regeneration, may still wait in the buffer
+                    ROUTER.put_event(event_type='snapshot', table=key, event=compact_row.from_dict(r) if COMPACT_ROWS else r, version=version)
+                last_id = rows[-1]['id']
+                with regeneration.lock:
+                    regeneration.rows += len(rows)
+                # snapshot rows have no commit, the marker lets full storages swap; checkpoints are held anyway
+                ROUTER.put_binlog(ROUTER.last_binlog or CHECKPOINT.binlog)
+                THROTTLE.acquire(len(rows))
+    except Exception as e:
+        logger.exception(f"table regeneration: {e}")
+        with regeneration.lock:
+            regeneration.error = str(e)
+            regeneration.version = None
+            regeneration.horizon = None
+            regeneration.snapshot_binlog = None
+    finally:
+        if conn:
+            conn.close()
+        regeneration.release()
+        # a marker after the released rows, its buffer saves the checkpoint again
+        ROUTER.put_binlog(ROUTER.last_binlog or CHECKPOINT.binlog)
+        logger.info(f"regeneration of {sorted(regeneration.keys)} done: {regeneration.statistic()}")
+
+
+def command_regenerate(mysql_settings, app_settings, args):
+    """regenerate <table|schema.table|pattern> ... - snapshot of scanned tables while the stream goes on."""
+    global TABLE_REGENERATION
+    if STAGE != Stage.SYNCH:
+        raise ValueError(f"Tables can be regenerated only in {Stage.SYNCH}, now {STAGE}")
+    if app_settings.get('apply_mode', 'batch') != 'batch' or app_settings.get('spill_path'):
+        raise ValueError("regenerate needs apply_mode 'batch' and no spill_path")
+    if not args:
+        raise ValueError("regenerate needs table names")
+    if TABLE_REGENERATION is not None and not TABLE_REGENERATION.is_finished():
+        raise ValueError(f"Regeneration of {sorted(TABLE_REGENERATION.keys)} is running")
+    pairs = []
+    for name in args:
+        schema_pattern, table_pattern = name.split('.', 1) if '.' in name else ('*', name)
+        matched = sorted(p for p in TABLES.scan if fnmatch.fnmatchcase(p[0], schema_pattern) and fnmatch.fnmatchcase(p[1], table_pattern))
+        if not matched:
+            raise ValueError(f"'{name}' matches no table of scan_tables")
+        pairs += [p for p in matched if p not in pairs]
+
+    regeneration = table_regeneration(pairs, ROUTER)
+    TABLE_REGENERATION = regeneration
+    threading.Thread(target=table_regeneration_thread, daemon=True, name="table-regeneration", args=(mysql_settings, app_settings, regeneration)).start()
+    return {"tables": sorted(regeneration.keys)}
+
+
+PROFILE_MAX_SECONDS = 600
+
+
+def command_profile(mysql_settings, app_settings, args):
+    """profile [seconds=10] [hz=100] [file name] - samples stacks of all threads, writes a collapsed-stack file into profile_dir."""
+    global PROFILER
+    if PROFILER is not None and PROFILER.is_running():
+        raise ValueError(f"Profile {PROFILER.path} is running")
+    seconds = float(args[0]) if len(args) > 0 else 10.0
+    hz = float(args[1]) if len(args) > 1 else 100.0
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise ValueError(f"seconds must be in (0, {PROFILE_MAX_SECONDS}]")
+    if not 0 < hz <= 1000:
+        raise ValueError("hz must be in (0, 1000]")
+    name = args[2] if len(args) > 2 else f"profile-{time.strftime('%Y%m%d-%H%M%S')}.collapsed"
+    # the socket client names only the file, the directory comes from the settings
+    if name != os.path.basename(name) or name in ('', '.', '..'):
+        raise ValueError(f"'{name}' must be a file name without a directory")
+    path = os.path.join(app_settings.get('profile_dir', os.path.dirname(os.path.abspath(app_settings['binlog_file']))), name)
+    PROFILER = sampling_profiler(seconds, 1.0 / hz, path, is_stopped=lambda: STOP)
+    PROFILER.start()
+    return {"profile": PROFILER.statistic()}
+
+
+def memory_accounting():
+    """Rows and approximate bytes held by every stage of the engine."""
+    pipelines = {}
+    for pipeline in all_pipelines():
+        storage = pipeline.storage.memory_statistic()
+        insert = pipeline.insert_storage.memory_statistic()
+        pipelines[pipeline.key] = {
+            "storage_events": storage['events'],
+            "storage_bytes": storage['bytes'],
+            # swapped buffers, which are still transformed or dumped
+            "inflight_bytes": storage['inflight_bytes'],
+            "insert_buffer_rows": insert['rows'],
+            "insert_buffer_bytes": insert['bytes'],
+        }
+    regeneration = TABLE_REGENERATION.statistic() if TABLE_REGENERATION else {}
+    return {
+        "process": process_memory(),
+        "pipelines": pipelines,
+        "total_bytes": sum(p['storage_bytes'] + p['inflight_bytes'] + p['insert_buffer_bytes'] for p in pipelines.values()),
+        "group_commit": GROUP_SCHEDULER.statistic() if GROUP_SCHEDULER else None,
+        "partitioned": PARTITIONED_APPLIER.statistic() if PARTITIONED_APPLIER else None,
+        "spill": SPILL_QUEUE.statistic() if SPILL_QUEUE else None,
+        "table_regeneration_held": regeneration.get('held', 0),
+        "binlog_table_map": table_map_statistic(BINLOG_STREAM.table_map if BINLOG_STREAM else None),
+        "interned_schemas": interned_schemas_statistic(),
+        "value_converters": CONVERTERS.statistic() if CONVERTERS else None,
+        "tracemalloc": TRACEMALLOC.is_tracing(),
+    }
+
+
+def command_memory(mysql_settings, app_settings, args):
+    """
+    memory - accounting of the engine stages,
+    memory trace [frames=1] - starts tracemalloc and takes the baseline snapshot,
+    memory diff [top=20] - allocation sites grown since the baseline, memory stop - stops tracing.
+    """
+    action = args[0] if args else 'stat'
+    if action == 'stat':
+        return {"memory": memory_accounting()}
+    if action == 'trace':
+        frames = int(args[1]) if len(args) > 1 else 1
+        if not 1 <= frames <= 64:
+            raise ValueError("frames must be in [1, 64]")
+        TRACEMALLOC.start(frames)
+        return {"tracemalloc": True}
+    if action == 'diff':
+        limit = int(args[1]) if len(args) > 1 else 20
+        return {"tracemalloc": TRACEMALLOC.diff(limit)}
+    if action == 'stop':
+        TRACEMALLOC.stop()
+        return {"tracemalloc": False}
+    raise ValueError(f"Unknown memory action: '{action}'")
+
+
+def command_tune(mysql_settings, app_settings, args):
+    """
+    tune [key=value ...] - changes batch size, flush interval, workers count and the regeneration throttle
+    of all sinks at runtime, without arguments returns the active values. Values are not saved to the config.
+    """
+    values = parse_tuning(args)
+    if 'full_regeneration_threads_count' in values and app_settings.get('apply_mode', 'batch') != 'batch':
+        # group_commit / partitioned: workers and their queues are created at start
+        raise ValueError(f"full_regeneration_threads_count can't be tuned with apply_mode '{app_settings['apply_mode']}'")
+    if values:
+        with GLOBAL_LOCK:
+            # extra sinks have own copies of the inherited settings
+            for settings in [app_settings] + [c.settings for c in SINKS.values()]:
+                settings.update(values)
+            if 'clickhouse_max_batch_len' in values:
+                for pipeline in all_pipelines():
+                    pipeline.storage.set_max_len(values['clickhouse_max_batch_len'])
+            if 'clickhouse_dropdown_sleep' in values:
+                if GROUP_SCHEDULER:
+                    GROUP_SCHEDULER.interval = values['clickhouse_dropdown_sleep']
+                if PARTITIONED_APPLIER:
+                    PARTITIONED_APPLIER.commit_interval = values['clickhouse_dropdown_sleep']
+            if 'full_regeneration_max_rows_per_s' in values:
+                THROTTLE.set_rate(values['full_regeneration_max_rows_per_s'])
+        logger.info(f"tuned: {values}")
+    return {"settings": tuned_settings(app_settings)}
+
+
+#commands of the health socket: name -> func(mysql_settings, app_settings, args) -> dict
+HEALTH_COMMANDS = {
+    'regenerate': command_regenerate,
+    'profile': command_profile,
+    'memory': command_memory,
+    'tune': command_tune,
+}
+
+
+def full_regeneration_thread(mysql_settings, app_settings, version):
     global USER_FUNC, REGENERATION_CONTROLLER, SYNCH_STORAGE, STAGE
 
-    db_name = app_settings['db_name']
-    tables_name = app_settings['init_tables']
-    full_regeneration_batch_len = int(app_settings['full_regeneration_batch_len'])
+    tables_name = TABLES.init
+    table_columns = app_settings.get('table_columns', {})
 
     conn = pymysql.connect(**mysql_settings)
     cursor = conn.cursor(pymysql.cursors.DictCursor)
     cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
     cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT;")
 
-    for table in tables_name:
+    for db_name, table in tables_name:
+        key = TABLES.key(db_name, table)
         # requesting row count for each table in every thread
         # this is redundant but ensures we get maximum row count
         #   for high-load tables where each thread may have snapshots at different row counts
@@ -388,15 +1124,19 @@ def full_regeneration_thread(mysql_settings, app_settings):
 
         if STAGE == Stage.INIT:
             STAGE = Stage.REGENERATION
-        REGENERATION_CONTROLLER.put_rows_count(table, count, min_id, max_id)
+        REGENERATION_CONTROLLER.put_rows_count(key, count, min_id, max_id)
 
     REGENERATION_CONTROLLER.barrier.wait()
 
-    for table in tables_name:
+    for db_name, table in tables_name:
+        key = TABLES.key(db_name, table)
+        convert = CONVERTERS.get(db_name, table) if CONVERTERS else None
         while True:
-            current_id = REGENERATION_CONTROLLER.get_and_update_id(table, full_regeneration_batch_len)
+            # read every batch, the 'tune' command may change it
+            full_regeneration_batch_len = int(app_settings['full_regeneration_batch_len'])
+            current_id = REGENERATION_CONTROLLER.get_and_update_id(key, full_regeneration_batch_len)
 
-            q = f"SELECT * FROM {db_name}.{table} WHERE id >= {current_id} and id < {current_id + full_regeneration_batch_len};"
+            q = f"SELECT {select_columns(table_columns.get(table))} FROM {db_name}.{table} WHERE id >= {current_id} and id < {current_id + full_regeneration_batch_len};"
 
 
             cursor.execute(q)
@@ -404,13 +1144,16 @@ def full_regeneration_thread(mysql_settings, app_settings):
             count = len(result)
             logger.debug(f"Query: {q} count: {count}")
             if not count:
-                if REGENERATION_CONTROLLER.is_end(table):
+                if REGENERATION_CONTROLLER.is_end(key):
                     break
                 else:
                     continue
             for r in result:
                 #USER_FUNC.process_event('insert', db_name, table, r)
-                SYNCH_STORAGE.put_event(event_type='insert', table=table, event=r)
+                if convert:
+                    convert(r)
+                ROUTER.put_event(event_type='insert', table=key, event=compact_row.from_dict(r) if COMPACT_ROWS else r, version=version)
+            THROTTLE.acquire(count)
 
     conn.close()
 
@@ -418,14 +1161,23 @@ def full_regeneration_thread(mysql_settings, app_settings):
 
 def full_regeneration(mysql_settings, app_settings):
     global USER_FUNC, STAGE, PARSED_BINLOG_TOTAL, PARSED_BINLOG_MY, SYNCH_STORAGE, STOP, REGENERATION_CONTROLLER
-    USER_FUNC.initiate_full_regeneration()
+    sinks = [c for c in SINKS.values() if c.regenerates]
+    for context in sinks:
+        context.plugin.initiate_full_regeneration()
 
     binlog = get_binlog_from_db(mysql_settings, app_settings)
+    # snapshot rows are older than any binlog event after the snapshot position
+    version = version_horizon(binlog, app_settings.get('gtid_positioning', False)).version
 
     threads = []
 
-    for i in range(app_settings['full_regeneration_threads_count']):
-        t = threading.Thread(target=full_regeneration_thread, args=(mysql_settings, app_settings,))
+    with GLOBAL_LOCK:
+        # the 'tune' command may have changed the count after init(), the barrier waits for exactly these threads
+        threads_count = app_settings['full_regeneration_threads_count']
+        REGENERATION_CONTROLLER = regeneration_threads_controller(threads_count)
+
+    for i in range(threads_count):
+        t = threading.Thread(target=full_regeneration_thread, name=f"regeneration-{i}", args=(mysql_settings, app_settings, version,))
         t.start()
         threads.append(t)
 
@@ -438,23 +1190,54 @@ def full_regeneration(mysql_settings, app_settings):
     while not STOP and STAGE != Stage.REGENERATION_DUMP_DONE:
         time.sleep(1)
 
-    USER_FUNC.finished_full_regeneration()
+    for context in sinks:
+        context.plugin.finished_full_regeneration()
 
     PARSED_BINLOG_TOTAL = binlog.copy()
     PARSED_BINLOG_MY = binlog.copy()
 
-    save_binlog_position(binlog)
+    if SINKS[DEFAULT_SINK].regenerates:
+        save_binlog_position(binlog)
+    for context in EXTRA_SINKS:
+        if context.regenerates:
+            save_binlog_position(binlog, context.pipeline)
 
     return binlog
 
-def worker_thread(buffer_data, insert_storage):
+def worker_thread(buffer_data, insert_storage, context=None):
     global STOP
+    context = context or SINKS[DEFAULT_SINK]
+    plugin = context.plugin
+    # declaratively mapped tables are converted in bulk, each table by the thread which took it first
+    if context.table_mapping:
+        for key in buffer_data.tables():
+            schema, table = TABLES.split(key)
+            converter = context.table_mapping.get(table)
+            if converter is None:
+                continue
+            items = buffer_data.pop_table(key)
+            if items:
+                # deletes without deleted_column are left to the plugin
+                rest = []
+                insert_storage.push_rows(converter.target, converter.columns, converter.convert_items(items, schema, rest))
+                buffer_data.put_items(rest)
+
     while not STOP:
         event = buffer_data.get_event()
         if event is None:
             return
 
-        result = USER_FUNC.process_event(event.event_type, event.table, event.event)
+        # the plugin always gets the bare table name, the schema - if it asks for it
+        schema, table = TABLES.split(event.table)
+        payload = event.event
+        if COMPACT_ROWS and not plugin.compact_rows:
+            payload = materialize_event(event.event_type, payload)
+        kwargs = {}
+        if plugin.process_event_version:
+            kwargs['version'] = event.version
+        if plugin.process_event_schema:
+            kwargs['schema'] = schema
+        result = plugin.process_event(event.event_type, table, payload, **kwargs)
 
         assert result is not None, f"Unexpected None for result"
 
@@ -462,43 +1245,98 @@ def worker_thread(buffer_data, insert_storage):
             insert_storage.push(r.table_name, r.columns, r.values)
 
 
-def run_workers_thread(app_settings):
+def dump_insert_buffer(insert_storage, context=None, origin=None):
+    """
+    Dumps all packs of the insert buffer through the plugin, exceptions of the plugin are passed to the caller.
+    origin - coordinates of the transformed buffer for pack ids, see delivery.buffer_origin.
+    """
+    context = context or SINKS[DEFAULT_SINK]
+    plugin = context.plugin
+    pack_index = 0
+    while True:
+        rows = insert_storage.get_similar_pack_clear()
+        if rows is None:
+            logger.info("rows len is None")
+            break
+
+        if len(rows):
+            table_name = rows[0].table_name
+            columns = rows[0].keys
+            values = [p.values for p in rows]
+            kwargs = {'batch_id': batch_id(origin, pack_index, table_name, columns, values)} if context.dump_batch_id else {}
+            pack_index += 1
+            # a failed pack is retried by delivery, the error is raised after the last attempt
+            if plugin.dump_columns is not None:
+                context.delivery.deliver(plugin.dump_columns, table_name, columns, rows_to_columns(rows), **kwargs)
+            else:
+                context.delivery.deliver(plugin.dump_values, table_name, columns, values, **kwargs)
+            print(f"stage: {STAGE} table: {rows[0].table_name} len: {len(rows)}")
+            if STAGE in [Stage.REGENERATION, Stage.REGENERATION_PARSED_DONE]:
+                REGENERATION_CONTROLLER.add_parsed_count(len(rows))
+
+
+def apply_buffer(buffer_data):
+    """apply callback of GROUP_SCHEDULER / PARTITIONED_APPLIER: transforms a buffer in the calling thread and dumps it."""
+    if STAGE == Stage.SYNCH:
+        with DROPDOWN_LOCK:
+            SINKS[DEFAULT_SINK].plugin.initiate_dropdown_workers()
+    insert_storage = insert_buffer()
+    worker_thread(buffer_data, insert_storage)
+    if STOP:
+        raise RuntimeError("Engine is stopping")
+    dump_insert_buffer(insert_storage, origin=buffer_origin(buffer_data))
+
+
+def apply_error(e):
+    global STOP
+    logger.exception(e)
+    #to notify all other threads to stop
+    STOP = True
+
+
+def run_workers_thread(app_settings, pipeline):
 
-    global STOP, SYNCH_STORAGE, STAGE, USER_FUNC
-    timeout = app_settings['clickhouse_dropdown_sleep']
+    global STOP, STAGE, USER_FUNC
+    storage = pipeline.storage
+    context = pipeline.get_context()
+    # one buffer for the whole thread life, it's drained after every batch
+    insert_storage = pipeline.insert_storage
 
 
     logger.info(f"workers threads")
 
     while not STOP:
-        time.sleep(timeout)
+        # the interval and the workers count are read every batch, the 'tune' command may change them
+        storage.wait_full(app_settings['clickhouse_dropdown_sleep'], expecting_binlog=(STAGE == Stage.SYNCH))
         sync_mode = (STAGE == Stage.SYNCH)
         logger.info(f"run threads, sync mode: {sync_mode}")
 
-        buffer_data = SYNCH_STORAGE.get_buffer(expecting_binlog=sync_mode)
+        buffer_data = storage.get_buffer(expecting_binlog=sync_mode)
         if buffer_data is None:
             logger.info(f"buffer data is empty")
             continue
 
         if not buffer_data.len():
             if STAGE == Stage.REGENERATION_PARSED_DONE:
-                STAGE = Stage.REGENERATION_DUMP_DONE
-
-            if buffer_data.binlog:
-                save_binlog_position(buffer_data.binlog)
+                pipeline.regeneration_dumped = True
+                # regeneration rows go to the default pipeline and to every extra sink
+                if all(p.regeneration_dumped for p in regeneration_pipelines()):
+                    STAGE = Stage.REGENERATION_DUMP_DONE
+
+            if buffer_data.binlog and saves_allowed(pipeline, buffer_data):
+                save_binlog_position(buffer_data.binlog, pipeline)
+            storage.release(buffer_data)
             logger.info(f'skip due stage: {STAGE}')
             continue
 
-        insert_storage = insert_buffer()
-
         if STAGE == Stage.SYNCH:
-            USER_FUNC.initiate_dropdown_workers()
+            context.plugin.initiate_dropdown_workers()
 
         logger.info(f"launch worker threads")
 
         threads = []
         for i in range(app_settings['full_regeneration_threads_count']):
-            t = threading.Thread(target=worker_thread, args=(buffer_data, insert_storage))
+            t = threading.Thread(target=worker_thread, name=f"worker-{pipeline.key}-{i}", args=(buffer_data, insert_storage, context))
             t.start()
             threads.append(t)
 
@@ -507,51 +1345,104 @@ def run_workers_thread(app_settings):
 
         logger.info(f"workers done")
 
-        while True:
-            rows = insert_storage.get_similar_pack_clear()
-            if rows is None:
-                logger.info("rows len is None")
-                break
-
-            if len(rows):
-                columns = rows[0].keys
-                values = [p.values for p in rows]
-                try:
-                    USER_FUNC.dump_values(rows[0].table_name, columns, values)
-                    print(f"stage: {STAGE} table: {rows[0].table_name} len: {len(values)}")
-                    if STAGE in [Stage.REGENERATION, Stage.REGENERATION_PARSED_DONE]:
-                        REGENERATION_CONTROLLER.add_parsed_count(len(values))
-                except Exception as e:
-                    logger.exception(e)
-                    #to notify all other threads to stop
-                    STOP = True
-                    SYNCH_STORAGE.get_buffer(expecting_binlog=sync_mode)
-                    return
-            else:
-                pass
+        try:
+            pipeline.last_origin = buffer_origin(buffer_data, pipeline.last_origin)
+            dump_insert_buffer(insert_storage, context, origin=pipeline.last_origin)
+        except Exception as e:
+            logger.exception(e)
+            #to notify all other threads to stop
+            STOP = True
+            storage.release(buffer_data)
+            dropped = storage.get_buffer(expecting_binlog=sync_mode)
+            if dropped is not None:
+                storage.release(dropped)
+            return
 
-        if sync_mode:
+        if sync_mode and not buffer_data.partial:
             assert buffer_data.binlog is not None, f"Binlog can't be None here"
 
-        if buffer_data.binlog:
-            save_binlog_position(buffer_data.binlog)
+        if buffer_data.binlog and saves_allowed(pipeline, buffer_data):
+            save_binlog_position(buffer_data.binlog, pipeline)
+
+        storage.release(buffer_data)
 
 
 def run(MYSQL_SETTINGS, APP_SETTINGS):
 
-    global USER_FUNC, STAGE, STOP, SYNCH_STORAGE
+    global USER_FUNC, STAGE, STOP, SYNCH_STORAGE, INSERT_STORAGE, SPILL_QUEUE, PIPELINES, ROUTER, CHECKPOINT, GROUP_SCHEDULER, PARTITIONED_APPLIER, TABLES, COMPACT_ROWS, CONVERTERS, STARTUP, GTID_POSITIONING
 
+    STARTUP = startup_timings()
     init(MYSQL_SETTINGS, APP_SETTINGS)
-    SYNCH_STORAGE = synch_storage(max_len = APP_SETTINGS['clickhouse_max_batch_len'])
+    for table, columns in APP_SETTINGS.get('table_columns', {}).items():
+        if 'id' not in columns:
+            raise ValueError(f"table_columns for '{table}' must contain 'id'")
+    if APP_SETTINGS.get('parallel_domains') and not APP_SETTINGS.get('gtid_positioning'):
+        raise ValueError("parallel_domains requires gtid_positioning")
+    apply_mode = APP_SETTINGS.get('apply_mode', 'batch')
+    GTID_POSITIONING = APP_SETTINGS.get('gtid_positioning', False)
+    COMPACT_ROWS = APP_SETTINGS.get('compact_rows', False)
+    if apply_mode not in ('batch', 'group_commit', 'partitioned'):
+        raise ValueError(f"Unknown apply_mode: '{apply_mode}'")
+    if apply_mode != 'batch' and (APP_SETTINGS.get('spill_path') or APP_SETTINGS.get('parallel_domains')):
+        raise ValueError(f"apply_mode '{apply_mode}' can't be combined with spill_path or parallel_domains")
+    if EXTRA_SINKS and (apply_mode != 'batch' or APP_SETTINGS.get('spill_path')):
+        raise ValueError("extra_sinks can be used only with apply_mode 'batch' and without spill_path")
+
+    SYNCH_STORAGE = new_storage(APP_SETTINGS)
+    # with parallel domains the default pipeline doesn't own any domain, its markers carry gtid of other pipelines
+    default_pipeline = flush_pipeline(DEFAULT_PIPELINE, SYNCH_STORAGE, owns_gtid=not APP_SETTINGS.get('parallel_domains', False))
+    INSERT_STORAGE = default_pipeline.insert_storage
+    PIPELINES = {DEFAULT_PIPELINE: default_pipeline}
+    for context in EXTRA_SINKS:
+        context.pipeline = flush_pipeline(f"sink-{context.name}", new_storage(context.settings), context=context)
+    ROUTER = event_router(APP_SETTINGS)
+    CHECKPOINT = None
+    GROUP_SCHEDULER = None
+    PARTITIONED_APPLIER = None
+    SPILL_QUEUE = None
+    if APP_SETTINGS.get('spill_path'):
+        SPILL_QUEUE = spill_queue(
+            APP_SETTINGS['spill_path'],
+            segment_bytes=APP_SETTINGS.get('spill_segment_bytes', 64 * 1024 * 1024),
+            max_bytes=APP_SETTINGS.get('spill_max_bytes'),
+        )
 
     health_thread = None
-    workers_thread = None
+    pump_thread = None
 
     try:
-        conn = pymysql.connect(**MYSQL_SETTINGS)
-        cursor = conn.cursor()
-
-        preflight_check_ex(cursor, MYSQL_SETTINGS, APP_SETTINGS)
+        # one connection for all startup queries, the binlog probe of preflight goes beside them
+        with STARTUP.phase('connect'):
+            conn = pymysql.connect(**MYSQL_SETTINGS)
+            cursor = conn.cursor()
+
+        preflight_check_ex(cursor, MYSQL_SETTINGS, APP_SETTINGS, timings=STARTUP)
+
+        with STARTUP.phase('tables'):
+            TABLES = table_filter(APP_SETTINGS)
+            CONVERTERS = None
+            if APP_SETTINGS.get('value_converters'):
+                CONVERTERS = value_converters(MYSQL_SETTINGS, APP_SETTINGS['value_converters'])
+            if TABLES.has_patterns() or CONVERTERS:
+                # resolved tables and column types are kept next to the checkpoint while the schema is the same
+                metadata = table_metadata(APP_SETTINGS['binlog_file'] + '.tables.json', TABLES)
+                fingerprint = schema_fingerprint(cursor, TABLES.schema_patterns)
+                if metadata.load(fingerprint):
+                    logger.info(f"table metadata from {metadata.path}")
+                    TABLES.scan, TABLES.init = metadata.scan, metadata.init
+                else:
+                    if TABLES.has_patterns():
+                        TABLES.resolve(cursor)
+                    metadata.refresh(cursor, fingerprint, TABLES)
+                    metadata.save()
+                if CONVERTERS:
+                    CONVERTERS.put_types(metadata.column_types)
+                logger.info(f"tables: scan {len(TABLES.scan)} init {len(TABLES.init)} in schemas {TABLES.only_schemas()}")
+
+        # binlogs of the server for the range check of the checkpoint, the consumer doesn't reconnect for it
+        startup_binlogs = None
+        if not APP_SETTINGS.get('gtid_positioning', False):
+            startup_binlogs = get_binlogs(MYSQL_SETTINGS, cursor=cursor)
 
         if conn:
             conn.close()
@@ -559,23 +1450,90 @@ def run(MYSQL_SETTINGS, APP_SETTINGS):
 
         binlog = binlog_file(APP_SETTINGS['binlog_file'])
 
-        health_thread = threading.Thread(target=health_server, daemon=True, args=(APP_SETTINGS['health_socket'], MYSQL_SETTINGS, APP_SETTINGS,))
+        health_thread = threading.Thread(target=health_server, daemon=True, name="health", args=(APP_SETTINGS['health_socket'], MYSQL_SETTINGS, APP_SETTINGS,))
         health_thread.start()
 
-        USER_FUNC.init()
-
-        workers_thread = threading.Thread(target=run_workers_thread, daemon=True, args=(APP_SETTINGS,))
-        workers_thread.start()
-
-        if not binlog.load():
-            logger.debug(f"need full regeneration")
-            binlog = full_regeneration(MYSQL_SETTINGS, APP_SETTINGS)
+        with STARTUP.phase('plugins_init'):
+            for context in SINKS.values():
+                context.plugin.init()
+
+        default_pipeline.start(APP_SETTINGS)
+        for context in EXTRA_SINKS:
+            context.pipeline.start(context.settings)
+
+        has_checkpoint = binlog.load()
+        checkpoints = {context.name: load_checkpoint(context) for context in EXTRA_SINKS}
+        if not has_checkpoint or None in checkpoints.values():
+            # only sinks without a checkpoint are regenerated, the others catch up from their checkpoints
+            SINKS[DEFAULT_SINK].regenerates = not has_checkpoint
+            for context in EXTRA_SINKS:
+                context.regenerates = checkpoints[context.name] is None
+            logger.debug(f"need full regeneration of {[c.name for c in SINKS.values() if c.regenerates]}")
+            if SPILL_QUEUE:
+                SPILL_QUEUE.reset()
+            with STARTUP.phase('full_regeneration'):
+                snapshot = full_regeneration(MYSQL_SETTINGS, APP_SETTINGS)
+            # the range check is done on the new position
+            startup_binlogs = None
             logger.debug(f"regeneration - done")
+            if not has_checkpoint:
+                binlog = snapshot
+            checkpoints = {name: checkpoint or snapshot for name, checkpoint in checkpoints.items()}
         else:
             logger.debug(f"regenereation is not need, start from {str(binlog)}")
 
+        SINKS[DEFAULT_SINK].set_start(binlog)
+        for context in EXTRA_SINKS:
+            context.set_start(checkpoints[context.name])
+
+        if SPILL_QUEUE:
+            # checkpoint is the sink position, the reader continues after the data already spilled
+            if SPILL_QUEUE.last_binlog:
+                spilled = binlog_file(APP_SETTINGS['binlog_file'], file=SPILL_QUEUE.last_binlog[0], pos=SPILL_QUEUE.last_binlog[1], gtid=SPILL_QUEUE.last_gtid)
+                if not position_reached(binlog, spilled):
+                    logger.debug(f"spill queue is not empty, reader starts from {str(spilled)}")
+                    binlog = spilled
+                else:
+                    SPILL_QUEUE.reset()
+
+            pump_thread = threading.Thread(target=spill_pump_thread, daemon=True, name="spill-pump", args=(APP_SETTINGS,))
+            pump_thread.start()
+
+        CHECKPOINT = checkpoint_controller(binlog)
+        CHECKPOINT.register(DEFAULT_PIPELINE, binlog)
+
+        # one reader for all sinks: it starts from the oldest checkpoint, see event_router
+        if any(not position_reached(checkpoint, binlog) for checkpoint in checkpoints.values()):
+            binlog = oldest_position(APP_SETTINGS, [binlog] + list(checkpoints.values()))
+            logger.debug(f"extra sink is behind, reader starts from {str(binlog)}")
+
+        if apply_mode == 'group_commit':
+            GROUP_SCHEDULER = group_commit_scheduler(
+                apply=apply_buffer,
+                on_commit=save_binlog_position,
+                on_error=apply_error,
+                threads_count=APP_SETTINGS['full_regeneration_threads_count'],
+                batch_len=APP_SETTINGS.get('group_commit_batch_len', 1000),
+                max_in_flight=APP_SETTINGS.get('group_commit_max_in_flight', APP_SETTINGS['full_regeneration_threads_count'] * 2),
+                interval=APP_SETTINGS['clickhouse_dropdown_sleep'],
+                compaction=APP_SETTINGS.get('synch_compaction', False),
+            )
+            GROUP_SCHEDULER.start()
+        elif apply_mode == 'partitioned':
+            PARTITIONED_APPLIER = partitioned_applier(
+                apply=apply_buffer,
+                on_commit=save_binlog_position,
+                on_error=apply_error,
+                partitions_count=APP_SETTINGS['full_regeneration_threads_count'],
+                micro_batch_len=APP_SETTINGS.get('partition_batch_len', 500),
+                flush_interval=APP_SETTINGS.get('partition_flush_interval', 0.5),
+                commit_interval=APP_SETTINGS['clickhouse_dropdown_sleep'],
+                max_queue_len=APP_SETTINGS.get('partition_max_queue_len', 10000),
+                compaction=APP_SETTINGS.get('synch_compaction', False),
+            )
+            PARTITIONED_APPLIER.start()
 
-        start_binlog_consumer(MYSQL_SETTINGS, APP_SETTINGS, binlog)
+        start_binlog_consumer(MYSQL_SETTINGS, APP_SETTINGS, binlog, binlogs=startup_binlogs)
 
     except Exception as e:
         logger.exception(f"Exception: {e}")
@@ -586,10 +1544,20 @@ def run(MYSQL_SETTINGS, APP_SETTINGS):
         STOP = True
         if health_thread:
             health_thread.join()
-        if workers_thread:
-            workers_thread.join()
-
-        USER_FUNC.tear_down()
+        # extra sinks too: their sinks and plugins are closed below
+        for pipeline in all_pipelines():
+            if pipeline.thread:
+                pipeline.thread.join()
+        if GROUP_SCHEDULER:
+            GROUP_SCHEDULER.stop()
+        if PARTITIONED_APPLIER:
+            PARTITIONED_APPLIER.stop()
+        if SPILL_QUEUE:
+            SPILL_QUEUE.close()
+        for context in SINKS.values():
+            if context.sink:
+                context.sink.close()
+            context.plugin.tear_down()
         return 0
 
 
@@ -0,0 +1,205 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .synch_storage import synch_buffer
+
+
+def event_key(event_type, table, event):
+    if event_type == 'insert':
+        return table, event['id']
+    if event_type == 'update':
+        return table, event['after_values']['id']
+    return table, event['values']['id']
+
+
+class apply_unit:
+    """One or more consecutive commit groups, applied as one batch."""
+
+    def __init__(self, seq, compaction):
+        self.seq = seq
+        self.buffer = synch_buffer(compaction=compaction)
+        self.keys = set()
+        self.rows = 0
+        self.groups = 0
+        self.commit_id = None
+        self.deps = []
+        self.done = threading.Event()
+        self.error = None
+
+
+class group_commit_scheduler:
+    """
+    Dependency-aware apply of binlog transactions, driven by MariaDB group commit.
+
+    Transactions, which group-committed together (same commit_id in the GTID event), never touch the same rows,
+    so a commit group is never split. Consecutive groups are coalesced into an apply unit up to batch_len rows,
+    to keep sink writes reasonably big.
+
+    A sealed unit depends on every in-flight unit with a common (table, id) key; independent units are
+    transformed and dumped concurrently, dependent ones - in binlog order.
+    The checkpoint is the binlog of the last unit, before which all units are done.
+    """
+
+    def __init__(self, apply, on_commit, on_error, threads_count, batch_len, max_in_flight, interval, compaction=False):
+        # apply(buffer) - transforms and dumps a synch_buffer, raises on error
+        self.apply = apply
+        # on_commit(binlog) - saves the checkpoint
+        self.on_commit = on_commit
+        self.on_error = on_error
+        self.batch_len = batch_len
+        self.max_in_flight = max_in_flight
+        self.interval = interval
+        self.compaction = compaction
+
+        self.executor = ThreadPoolExecutor(max_workers=threads_count, thread_name_prefix='group-apply')
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        # checkpoints are saved outside of self.lock, in the order of units
+        self.commit_lock = threading.Lock()
+        self.committed_seq = -1
+        self.in_flight = OrderedDict()
+        self.next_seq = 0
+        self.unit = None
+        self.commit_id = None
+        self.in_transaction = False
+        self.sealed_at = time.time()
+        self.failed = None
+        self.stopped = False
+        self.timer = None
+
+        self.units = 0
+        self.groups = 0
+        self.dependent_units = 0
+
+    def start(self):
+        self.timer = threading.Thread(target=self._timer_thread, daemon=True, name='group-seal')
+        self.timer.start()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.condition.notify_all()
+        self.executor.shutdown(wait=True)
+
+    # ---------- consumer side ----------
+
+    def _open_unit(self):
+        if self.unit is None:
+            self.unit = apply_unit(self.next_seq, self.compaction)
+            self.next_seq += 1
+        return self.unit
+
+    def begin_transaction(self, commit_id):
+        with self.lock:
+            unit = self.unit
+            if unit is not None and (commit_id is None or commit_id != unit.commit_id):
+                # a new commit group starts here
+                if unit.rows >= self.batch_len or time.time() - self.sealed_at >= self.interval:
+                    self._seal()
+            self.commit_id = commit_id
+            self.in_transaction = True
+
+    def put_event(self, event_type, table, event, domain=None, version=None):
+        with self.lock:
+            while not self.stopped and len(self.in_flight) >= self.max_in_flight:
+                self.condition.wait()
+            if self.failed:
+                raise RuntimeError(f"Group apply failed: {self.failed}")
+
+            unit = self._open_unit()
+            unit.buffer.put_event(event_type, table, event, version)
+            unit.keys.add(event_key(event_type, table, event))
+            unit.rows += 1
+
+    def put_binlog(self, binlog):
+        with self.lock:
+            unit = self._open_unit()
+            unit.buffer.put_binlog(binlog)
+            if self.commit_id is None or self.commit_id != unit.commit_id:
+                unit.groups += 1
+                self.groups += 1
+            unit.commit_id = self.commit_id
+            self.in_transaction = False
+
+    def _timer_thread(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if self.stopped:
+                    return
+                # seal only between transactions, otherwise begin_transaction() does it
+                if not self.in_transaction and time.time() - self.sealed_at >= self.interval:
+                    self._seal()
+
+    # ---------- apply side ----------
+
+    def _seal(self):
+        """Must be called under lock."""
+        unit = self.unit
+        self.sealed_at = time.time()
+        if unit is None or (not unit.rows and unit.buffer.binlog is None):
+            return
+        self.unit = None
+
+        unit.deps = [u for u in self.in_flight.values() if not u.done.is_set() and u.keys & unit.keys]
+        if unit.deps:
+            self.dependent_units += 1
+        self.units += 1
+        self.in_flight[unit.seq] = unit
+        self.executor.submit(self._run, unit)
+
+    def _run(self, unit):
+        try:
+            for dep in unit.deps:
+                dep.done.wait()
+                if dep.error:
+                    raise RuntimeError(f"Dependency unit {dep.seq} failed")
+            self.apply(unit.buffer)
+        except Exception as e:
+            unit.error = e
+        finally:
+            unit.done.set()
+            self._complete()
+
+    def _complete(self):
+        error = None
+        with self.lock:
+            binlog = None
+            binlog_seq = None
+            # low-water mark: pop done units from the head
+            while self.in_flight:
+                seq, unit = next(iter(self.in_flight.items()))
+                if not unit.done.is_set():
+                    break
+                if unit.error:
+                    error = unit.error
+                    break
+                del self.in_flight[seq]
+                if unit.buffer.binlog:
+                    binlog = unit.buffer.binlog
+                    binlog_seq = seq
+            if error and not self.failed:
+                self.failed = error
+            else:
+                error = None
+            self.condition.notify_all()
+        if binlog:
+            # the file is written without blocking the reader and other units;
+            # a thread late with an older position doesn't overwrite a newer one
+            with self.commit_lock:
+                if binlog_seq > self.committed_seq:
+                    self.on_commit(binlog)
+                    self.committed_seq = binlog_seq
+        if error:
+            self.on_error(error)
+
+    def statistic(self):
+        with self.lock:
+            return {
+                "units": self.units,
+                "groups": self.groups,
+                "dependent_units": self.dependent_units,
+                "in_flight": len(self.in_flight),
+            }
@@ -0,0 +1,94 @@
+import sys
+import threading
+import tracemalloc
+
+from .rows import _SCHEMAS
+
+
+def process_memory() -> dict:
+    """RSS of the process and its high water mark, from /proc on Linux, the maximum only elsewhere."""
+    result = {"rss_bytes": None, "rss_high_water_bytes": None}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    result["rss_bytes"] = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    result["rss_high_water_bytes"] = int(line.split()[1]) * 1024
+    except OSError:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes elsewhere
+        result["rss_high_water_bytes"] = maxrss if sys.platform == "darwin" else maxrss * 1024
+    return result
+
+
+def table_map_statistic(table_map) -> dict:
+    """Table-map cache of pymysqlreplication: {table_id: Table}, it grows with every new table_id after DDL."""
+    if table_map is None:
+        return {"tables": 0, "columns": 0}
+    tables = list(table_map.values())
+    return {
+        "tables": len(tables),
+        "columns": sum(len(getattr(t, 'columns', ())) for t in tables),
+    }
+
+
+def interned_schemas_statistic() -> dict:
+    schemas = list(_SCHEMAS.values())
+    return {"schemas": len(schemas), "columns": sum(len(s.columns) for s in schemas)}
+
+
+class tracemalloc_session:
+    """
+    Allocation tracing between two points: start() takes the baseline snapshot, diff() compares
+    the current allocations with it by allocation site. Tracing costs memory and CPU only between start() and stop().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.baseline = None
+        self.frames = 1
+        # tracing was started by someone else, stop() leaves it running
+        self.foreign = False
+
+    def start(self, frames=1):
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self.foreign = False
+            elif self.baseline is None:
+                self.foreign = True
+            self.frames = tracemalloc.get_traceback_limit()
+            self.baseline = tracemalloc.take_snapshot()
+
+    def diff(self, limit=20):
+        with self.lock:
+            if self.baseline is None or not tracemalloc.is_tracing():
+                raise ValueError("Tracing is not started")
+            snapshot = tracemalloc.take_snapshot()
+            stats = snapshot.compare_to(self.baseline, 'traceback' if self.frames > 1 else 'lineno')
+            current, peak = tracemalloc.get_traced_memory()
+            return {
+                "traced_bytes": current,
+                "traced_peak_bytes": peak,
+                "top": [
+                    {
+                        "site": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                        "size_diff": stat.size_diff,
+                        "count_diff": stat.count_diff,
+                        "size": stat.size,
+                        "count": stat.count,
+                    }
+                    for stat in stats[:limit]
+                ],
+            }
+
+    def stop(self):
+        with self.lock:
+            self.baseline = None
+            if tracemalloc.is_tracing() and not self.foreign:
+                tracemalloc.stop()
+
+    def is_tracing(self):
+        return self.baseline is not None and tracemalloc.is_tracing()
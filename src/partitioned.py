@@ -0,0 +1,182 @@
+import time
+import threading
+from collections import deque
+
+from .synch_storage import synch_buffer
+from .group_scheduler import event_key
+
+
+class partition:
+
+    def __init__(self, index):
+        self.index = index
+        # (trx seq, event_type, table, event, version)
+        self.queue = deque()
+        # lowest trx seq of the micro-batch being applied, None if idle
+        self.inflight_seq = None
+        self.thread = None
+        self.batches = 0
+        self.rows = 0
+
+
+class partitioned_applier:
+    """
+    Streaming apply: rows are hash-partitioned by (table, id) onto N worker queues.
+    Every key is always handled by the same worker, so its events are applied in binlog order,
+    and each worker flushes its own micro-batches independently.
+
+    Transactions are numbered; the checkpoint is the binlog of the last transaction,
+    which is fully applied by all partitions (low-water mark across partitions).
+    """
+
+    def __init__(self, apply, on_commit, on_error, partitions_count, micro_batch_len, flush_interval,
+                 commit_interval, max_queue_len, compaction=False):
+        # apply(buffer) - transforms and dumps a synch_buffer, raises on error
+        self.apply = apply
+        self.on_commit = on_commit
+        self.on_error = on_error
+        self.micro_batch_len = micro_batch_len
+        self.flush_interval = flush_interval
+        self.commit_interval = commit_interval
+        self.max_queue_len = max_queue_len
+        self.compaction = compaction
+
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.partitions = [partition(i) for i in range(partitions_count)]
+        # seq of the current (not committed yet) transaction
+        self.seq = 0
+        # (trx seq, binlog) of committed transactions, not checkpointed yet
+        self.markers = deque()
+        self.stopped = False
+        self.stop_event = threading.Event()
+        self.failed = None
+        self.commit_thread = None
+
+    def start(self):
+        for p in self.partitions:
+            p.thread = threading.Thread(target=self._worker_thread, daemon=True, name=f"partition-{p.index}", args=(p,))
+            p.thread.start()
+        self.commit_thread = threading.Thread(target=self._commit_thread, daemon=True, name='partition-commit')
+        self.commit_thread.start()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.condition.notify_all()
+        for p in self.partitions:
+            if p.thread:
+                p.thread.join()
+        self.stop_event.set()
+        if self.commit_thread:
+            self.commit_thread.join()
+
+    # ---------- consumer side ----------
+
+    def put_event(self, event_type, table, event, domain=None, version=None):
+        p = self.partitions[hash(event_key(event_type, table, event)) % len(self.partitions)]
+        with self.lock:
+            while not self.stopped and not self.failed and len(p.queue) >= self.max_queue_len:
+                self.condition.wait()
+            if self.failed:
+                raise RuntimeError(f"Partition apply failed: {self.failed}")
+            p.queue.append((self.seq, event_type, table, event, version))
+            if len(p.queue) >= self.micro_batch_len:
+                self.condition.notify_all()
+
+    def put_binlog(self, binlog):
+        with self.lock:
+            self.markers.append((self.seq, binlog.copy()))
+            self.seq += 1
+
+    # ---------- workers ----------
+
+    def _take_batch(self, p):
+        """Waits for a micro-batch of the partition, must be called under lock."""
+        first_at = None
+        while not self.stopped:
+            if p.queue:
+                if first_at is None:
+                    first_at = time.time()
+                if len(p.queue) >= self.micro_batch_len or time.time() - first_at >= self.flush_interval:
+                    break
+                self.condition.wait(self.flush_interval)
+            else:
+                first_at = None
+                self.condition.wait(self.flush_interval)
+        if self.stopped:
+            return None
+
+        batch = []
+        while p.queue and len(batch) < self.micro_batch_len:
+            batch.append(p.queue.popleft())
+        p.inflight_seq = batch[0][0]
+        self.condition.notify_all()
+        return batch
+
+    def _worker_thread(self, p):
+        while True:
+            with self.lock:
+                batch = self._take_batch(p)
+            if batch is None:
+                return
+
+            # later events of a key replace earlier ones, the order inside a key is kept
+            buffer = synch_buffer(compaction=self.compaction)
+            for _, event_type, table, event, version in batch:
+                buffer.put_event(event_type, table, event, version)
+
+            try:
+                self.apply(buffer)
+            except Exception as e:
+                with self.lock:
+                    self.failed = e
+                    self.stopped = True
+                    self.condition.notify_all()
+                self.on_error(e)
+                return
+
+            with self.lock:
+                p.inflight_seq = None
+                p.batches += 1
+                p.rows += len(batch)
+
+    # ---------- checkpoint ----------
+
+    def _low_water(self):
+        """Highest trx seq, which is applied by all partitions, must be called under lock."""
+        low = self.seq - 1
+        for p in self.partitions:
+            if p.inflight_seq is not None:
+                low = min(low, p.inflight_seq - 1)
+            if p.queue:
+                low = min(low, p.queue[0][0] - 1)
+        return low
+
+    def commit(self):
+        """Saves the checkpoint at the low-water mark, if it has moved."""
+        with self.lock:
+            if self.failed:
+                return
+            low = self._low_water()
+            binlog = None
+            while self.markers and self.markers[0][0] <= low:
+                binlog = self.markers.popleft()[1]
+            if binlog:
+                self.on_commit(binlog)
+
+    def _commit_thread(self):
+        while not self.stop_event.wait(self.commit_interval):
+            self.commit()
+        # last commit after workers are stopped
+        self.commit()
+
+    def statistic(self):
+        with self.lock:
+            return {
+                "partitions": [
+                    {"queue": len(p.queue), "batches": p.batches, "rows": p.rows}
+                    for p in self.partitions
+                ],
+                "pending_transactions": len(self.markers),
+            }
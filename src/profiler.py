@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(thread_name, frame):
+    """Frame -> 'thread;outer;...;inner', the collapsed format of flamegraph.pl and speedscope."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+
+class sampling_profiler:
+    """
+    Wall-clock sampling profiler of all threads of the process: every interval seconds the stacks
+    of all threads are taken from sys._current_frames() and counted as collapsed stacks.
+    Nothing runs while no profile is requested; the sampling thread itself is not sampled.
+    Idle threads are sampled too (waiting in a lock or a socket), so the profile shows where time goes, not only CPU.
+    """
+
+    def __init__(self, seconds: float, interval: float, path: str, is_stopped=None):
+        self.seconds = seconds
+        self.interval = interval
+        self.path = path
+        self.is_stopped = is_stopped or (lambda: False)
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.thread = None
+
+    def start(self):
+        self.started_at = time.time()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="profiler")
+        self.thread.start()
+
+    def sample(self):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        me = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            self.stacks[collapse_stack(names.get(ident, f"thread-{ident}"), frame)] += 1
+        self.samples += 1
+
+    def _run(self):
+        deadline = time.time() + self.seconds
+        try:
+            while time.time() < deadline and not self.is_stopped():
+                self.sample()
+                time.sleep(self.interval)
+            self.save()
+        except Exception as e:
+            logger.exception(f"profiler: {e}")
+            self.error = str(e)
+        finally:
+            self.finished_at = time.time()
+
+    def save(self):
+        tmp_file = self.path + ".tmp"
+        with open(tmp_file, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        os.replace(tmp_file, self.path)
+
+    def is_running(self):
+        return self.thread is not None and self.finished_at is None
+
+    def top_functions(self, limit=10):
+        """Functions by samples on top of the stack - self time."""
+        top = Counter()
+        for stack, count in self.stacks.items():
+            top[stack.rsplit(";", 1)[-1]] += count
+        return top.most_common(limit)
+
+    def statistic(self):
+        return {
+            "running": self.is_running(),
+            "path": self.path,
+            "seconds": self.seconds,
+            "samples": self.samples,
+            "stacks": len(self.stacks),
+            "top": [] if self.is_running() else [f"{name} {count}" for name, count in self.top_functions()],
+            "error": self.error,
+        }
@@ -0,0 +1,109 @@
+import threading
+
+
+class row_schema:
+    """Column names of a row, shared by all rows with the same columns; created only through intern_schema()."""
+
+    __slots__ = ('columns', 'index')
+
+    def __init__(self, columns: tuple):
+        self.columns = columns
+        self.index = {c: i for i, c in enumerate(columns)}
+
+
+_SCHEMAS = {}
+_SCHEMAS_LOCK = threading.Lock()
+
+
+def intern_schema(columns) -> row_schema:
+    columns = tuple(columns)
+    schema = _SCHEMAS.get(columns)
+    if schema is None:
+        with _SCHEMAS_LOCK:
+            schema = _SCHEMAS.setdefault(columns, row_schema(columns))
+    return schema
+
+
+class compact_row:
+    """
+    Read-only row: a tuple of values and a reference to the interned column schema,
+    instead of a dict with its own keys per row. Supports the read part of the dict interface,
+    so row['id'], row.get(), keys(), items(), dict(row) work as before.
+    """
+
+    __slots__ = ('schema', 'values')
+
+    def __init__(self, schema: row_schema, values: tuple):
+        self.schema = schema
+        self.values = values
+
+    @classmethod
+    def from_dict(cls, row: dict, columns=None):
+        """pymysqlreplication / DictCursor row -> compact row, columns - projection, None - all columns."""
+        if columns is None:
+            return cls(intern_schema(row.keys()), tuple(row.values()))
+        columns = [c for c in columns if c in row]
+        return cls(intern_schema(columns), tuple([row[c] for c in columns]))
+
+    def __getitem__(self, column):
+        return self.values[self.schema.index[column]]
+
+    def get(self, column, default=None):
+        i = self.schema.index.get(column)
+        return default if i is None else self.values[i]
+
+    def __contains__(self, column):
+        return column in self.schema.index
+
+    def __iter__(self):
+        return iter(self.schema.columns)
+
+    def __len__(self):
+        return len(self.values)
+
+    def keys(self):
+        return self.schema.columns
+
+    def items(self):
+        return zip(self.schema.columns, self.values)
+
+    def to_dict(self) -> dict:
+        return dict(zip(self.schema.columns, self.values))
+
+    def __eq__(self, other):
+        if isinstance(other, compact_row):
+            if self.schema is other.schema:
+                return self.values == other.values
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.schema.columns, self.values))
+
+    def __repr__(self):
+        return f"compact_row({self.to_dict()!r})"
+
+    def __reduce__(self):
+        # schema is interned again on load, e.g. records of the spill queue
+        return _restore_row, (self.schema.columns, self.values)
+
+
+def _restore_row(columns, values):
+    return compact_row(intern_schema(columns), values)
+
+
+def materialize_event(event_type, event):
+    """Event with compact rows -> event with dicts, for plugins which change or keep rows as dicts."""
+    if event_type == 'insert':
+        return event.to_dict() if isinstance(event, compact_row) else event
+    if event_type == 'update':
+        before = event.get('before_values')
+        after = event['after_values']
+        return {
+            'before_values': before.to_dict() if isinstance(before, compact_row) else before,
+            'after_values': after.to_dict() if isinstance(after, compact_row) else after,
+        }
+    values = event['values']
+    return {'values': values.to_dict() if isinstance(values, compact_row) else values}
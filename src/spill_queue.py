@@ -0,0 +1,342 @@
+import os
+import re
+import json
+import mmap
+import time
+import pickle
+import struct
+import zlib
+from collections import deque
+from threading import Lock, Condition
+
+# record header: payload length, crc32 of payload
+HEADER = struct.Struct('<II')
+SEGMENT_NAME = re.compile(r'^(\d{12})\.seg$')
+CURSOR_FILE = 'cursor.json'
+# unflushed bytes after which the writer makes data visible to the reader, even inside a transaction
+FLUSH_BYTES = 1024 * 1024
+
+
+class spill_queue:
+    """
+    Append-only, segment-based local log between the binlog reader and synch_storage.
+
+    The reader appends events and binlog markers (put_event / put_binlog) and never waits for the sink.
+    A pump thread reads records back (get) and feeds synch_storage at sink speed.
+    commit(binlog) is called after the sink checkpoint has been saved: it moves the durable read cursor
+    to the matching marker and removes fully consumed segments.
+
+    On restart, records after the cursor are replayed, the tail after the last complete binlog marker
+    is truncated, and last_binlog tells where the binlog reader has to continue.
+    """
+
+    def __init__(self, path: str, segment_bytes: int = 64 * 1024 * 1024, max_bytes: int = None):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+
+        self.lock = Lock()
+        self.condition = Condition(self.lock)
+
+        # (binlog file, binlog pos) and gtid string of the last marker written
+        self.last_binlog = None
+        self.last_gtid = None
+
+        self.write_segment = None
+        self.write_file = None
+        self.write_offset = 0
+        self.unflushed = 0
+        # what the reader is allowed to see: (segment, offset)
+        self.flushed = None
+
+        self.read_segment = None
+        self.read_offset = 0
+        self.read_map = None
+        self.read_map_segment = None
+        # the active segment is read by one handle, it's reopened when the reader moves to another segment
+        self.read_file = None
+        self.read_file_segment = None
+        # markers read, but not committed yet: (binlog key, segment, offset after marker)
+        self.markers = deque()
+
+        self.cursor = None
+
+        os.makedirs(self.path, exist_ok=True)
+        self._recover()
+
+    # ---------- files ----------
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, f"{segment:012d}.seg")
+
+    def _segments(self):
+        result = []
+        for name in os.listdir(self.path):
+            m = SEGMENT_NAME.match(name)
+            if m:
+                result.append(int(m.group(1)))
+        return sorted(result)
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.path, CURSOR_FILE), "r") as f:
+                data = json.load(f)
+            return int(data['segment']), int(data['offset'])
+        except (IOError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save_cursor(self, segment, offset):
+        cursor_path = os.path.join(self.path, CURSOR_FILE)
+        tmp_file = cursor_path + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"segment": segment, "offset": offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, cursor_path)
+        self.cursor = (segment, offset)
+
+    @staticmethod
+    def _scan(data, offset):
+        """
+        Iterates valid records of a segment from offset.
+        Yields (record, offset after record), stops on a torn or corrupted record.
+        """
+        size = len(data)
+        while offset + HEADER.size <= size:
+            length, crc = HEADER.unpack_from(data, offset)
+            start = offset + HEADER.size
+            end = start + length
+            if end > size:
+                return
+            payload = bytes(data[start:end])
+            if zlib.crc32(payload) != crc:
+                return
+            yield pickle.loads(payload), end
+            offset = end
+
+    def _recover(self):
+        segments = self._segments()
+        cursor = self._load_cursor()
+
+        if not segments:
+            cursor = (0, 0)
+        elif cursor is None or cursor[0] not in segments:
+            cursor = (segments[0], 0)
+
+        # drop the tail after the last complete binlog marker
+        while segments:
+            segment = segments[-1]
+            with open(self._segment_path(segment), "rb") as f:
+                data = f.read()
+            start = cursor[1] if segment == cursor[0] else 0
+            marker_end = None
+            for record, end in self._scan(data, start):
+                if record[0] == 'binlog':
+                    marker_end = end
+                    self.last_binlog = (record[1], record[2])
+                    self.last_gtid = record[3]
+
+            if marker_end is not None:
+                with open(self._segment_path(segment), "r+b") as f:
+                    f.truncate(marker_end)
+                break
+
+            if segment == cursor[0]:
+                with open(self._segment_path(segment), "r+b") as f:
+                    f.truncate(cursor[1])
+                break
+
+            os.remove(self._segment_path(segment))
+            segments.pop()
+
+        for segment in segments:
+            if segment < cursor[0]:
+                os.remove(self._segment_path(segment))
+
+        self.write_segment = segments[-1] if segments else cursor[0]
+        self.write_file = open(self._segment_path(self.write_segment), "ab")
+        self.write_offset = self.write_file.tell()
+        self.flushed = (self.write_segment, self.write_offset)
+
+        self.read_segment, self.read_offset = cursor
+        self._save_cursor(*cursor)
+
+    def reset(self):
+        """Removes all spilled data, used when the checkpoint is rebuilt by full regeneration."""
+        with self.lock:
+            self._close_read_map()
+            self._close_read_file()
+            self.write_file.close()
+            for segment in self._segments():
+                os.remove(self._segment_path(segment))
+            self.last_binlog = None
+            self.last_gtid = None
+            self.markers.clear()
+            self.write_segment = 0
+            self.write_file = open(self._segment_path(self.write_segment), "ab")
+            self.write_offset = 0
+            self.unflushed = 0
+            self.flushed = (0, 0)
+            self.read_segment, self.read_offset = 0, 0
+            self._save_cursor(0, 0)
+            self.condition.notify_all()
+
+    def close(self):
+        with self.lock:
+            self._close_read_map()
+            self._close_read_file()
+            if self.write_file:
+                self.write_file.flush()
+                self.write_file.close()
+                self.write_file = None
+
+    # ---------- writer ----------
+
+    def _disk_bytes(self):
+        if self.cursor[0] == self.write_segment:
+            return self.write_offset - self.cursor[1]
+        return (self.write_segment - self.cursor[0]) * self.segment_bytes + self.write_offset - self.cursor[1]
+
+    def _append(self, record, flush):
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        data = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self.lock:
+            while self.max_bytes and self._disk_bytes() >= self.max_bytes:
+                self.condition.wait()
+
+            self.write_file.write(data)
+            self.write_offset += len(data)
+            self.unflushed += len(data)
+
+            if self.write_offset >= self.segment_bytes:
+                self.write_file.flush()
+                os.fsync(self.write_file.fileno())
+                self.write_file.close()
+                self.write_segment += 1
+                self.write_file = open(self._segment_path(self.write_segment), "ab")
+                self.write_offset = 0
+                flush = True
+
+            if flush or self.unflushed >= FLUSH_BYTES:
+                self.write_file.flush()
+                self.unflushed = 0
+                self.flushed = (self.write_segment, self.write_offset)
+                self.condition.notify_all()
+
+    def put_event(self, event_type, table, event, domain=None, version=None):
+        self._append(('event', event_type, table, event, domain, version), flush=False)
+
+    def put_binlog(self, binlog):
+        self._append(('binlog', binlog.file, binlog.pos, binlog.gtid_str()), flush=True)
+        self.last_binlog = (binlog.file, binlog.pos)
+        self.last_gtid = binlog.gtid_str()
+
+    # ---------- reader ----------
+
+    def _close_read_map(self):
+        if self.read_map is not None:
+            self.read_map.close()
+            self.read_map = None
+            self.read_map_segment = None
+
+    def _close_read_file(self):
+        if self.read_file is not None:
+            self.read_file.close()
+            self.read_file = None
+            self.read_file_segment = None
+
+    def _read_next(self):
+        """Returns the next visible record or None, must be called under lock."""
+        while True:
+            flushed_segment, flushed_offset = self.flushed
+
+            if self.read_segment > flushed_segment:
+                return None
+
+            if self.read_segment == flushed_segment:
+                if self.read_offset >= flushed_offset:
+                    return None
+                # active segment: it's growing, so plain reads instead of mmap
+                if self.read_file_segment != self.read_segment:
+                    self._close_read_file()
+                    self.read_file = open(self._segment_path(self.read_segment), "rb")
+                    self.read_file_segment = self.read_segment
+                # the file is only appended, a seek inside the read buffer costs no system call
+                self.read_file.seek(self.read_offset)
+                header = self.read_file.read(HEADER.size)
+                length, crc = HEADER.unpack(header)
+                payload = self.read_file.read(length)
+            else:
+                # sealed segment: map it once and read all records from the map
+                self._close_read_file()
+                if self.read_map_segment != self.read_segment:
+                    self._close_read_map()
+                    with open(self._segment_path(self.read_segment), "rb") as f:
+                        if os.fstat(f.fileno()).st_size:
+                            self.read_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                            self.read_map_segment = self.read_segment
+                if self.read_map is None or self.read_offset >= len(self.read_map):
+                    self._close_read_map()
+                    self.read_segment += 1
+                    self.read_offset = 0
+                    continue
+                length, crc = HEADER.unpack_from(self.read_map, self.read_offset)
+                start = self.read_offset + HEADER.size
+                payload = self.read_map[start:start + length]
+
+            if zlib.crc32(payload) != crc:
+                raise ValueError(f"Spill queue is corrupted: segment {self.read_segment} offset {self.read_offset}")
+
+            self.read_offset += HEADER.size + length
+            record = pickle.loads(payload)
+            if record[0] == 'binlog':
+                self.markers.append(((record[1], record[2]), self.read_segment, self.read_offset))
+            return record
+
+    def get(self, timeout=None):
+        """
+        Returns the next record: ('event', event_type, table, event, domain, version) or ('binlog', file, pos, gtid).
+        Waits up to timeout seconds for new data, returns None if there is nothing.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.lock:
+            while True:
+                record = self._read_next()
+                if record is not None:
+                    return record
+                if deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def commit(self, binlog):
+        """Moves the durable cursor to the last marker <= binlog, which the sink has committed."""
+        key = (binlog.file, binlog.pos)
+        with self.lock:
+            cursor = None
+            while self.markers and self.markers[0][0] <= key:
+                _, segment, offset = self.markers.popleft()
+                cursor = (segment, offset)
+            if cursor is None:
+                return
+            # marker was the last record of a sealed segment
+            segment, offset = cursor
+            if segment < self.write_segment and offset >= os.path.getsize(self._segment_path(segment)):
+                cursor = (segment + 1, 0)
+            self._save_cursor(*cursor)
+            for segment in self._segments():
+                if segment < cursor[0] and segment != self.read_map_segment:
+                    os.remove(self._segment_path(segment))
+            self.condition.notify_all()
+
+    def statistic(self):
+        with self.lock:
+            return {
+                "segments": self.write_segment - self.cursor[0] + 1,
+                "bytes": self._disk_bytes(),
+                "last_binlog": f"{self.last_binlog[0]}:{self.last_binlog[1]}" if self.last_binlog else None,
+            }
@@ -1,5 +1,35 @@
+import sys
 from threading import Lock, Condition
 
+from .rows import compact_row
+
+
+def estimate_event_size(event) -> int:
+    """
+    Approximate memory footprint of an event in bytes.
+    Counts the container and its values, nested dicts/lists (update images) are walked recursively.
+    Column names are not counted - they are shared between rows.
+    """
+    if event is None:
+        return 0
+    size = sys.getsizeof(event)
+    if isinstance(event, compact_row):
+        # the schema is shared, only the values tuple belongs to the row
+        event = event.values
+        size += sys.getsizeof(event)
+    if isinstance(event, dict):
+        values = event.values()
+    elif isinstance(event, (list, tuple)):
+        values = event
+    else:
+        return size
+    for value in values:
+        if isinstance(value, (dict, list, tuple, compact_row)):
+            size += estimate_event_size(value)
+        else:
+            size += sys.getsizeof(value)
+    return size
+
 class version_lock:
 
     def __init__(self):
@@ -17,18 +47,46 @@ class version_lock:
 
 class synch_item:
 
-    def __init__(self, event_type: str, table: str, event):
+    __slots__ = ('event_type', 'table', 'event', 'version', 'replaces', 'bytes')
+
+    def __init__(self, event_type: str, table: str, event, version: int = None, replaces: bool = False, bytes: int = 0):
         self.event_type = event_type
         self.table = table
         self.event = event
+        # row version derived from binlog coordinates, see tools.binlog_version()
+        self.version = version
+        # compaction: the insert has absorbed a delete, so the sink may have the row
+        self.replaces = replaces
+        # estimated size of the event, returned to the budget when the item is replaced
+        self.bytes = bytes
+
+def compaction_statistic():
+    return {
+        # insert + delete of the same row inside a batch, both dropped
+        "insert_delete": 0,
+        # update with after image equal to before image, dropped
+        "noop_update": 0,
+        # events merged into the previous event of the same row
+        "merged": 0,
+    }
+
 
 class synch_buffer:
 
-    def __init__(self):
+    def __init__(self, compaction: bool = False):
+        #net-change mode: keep only the net effect per row within the buffer
+        self.compaction = compaction
+        self.compaction_statistic = compaction_statistic()
         self.insert = {}
         self.update = {}
         self.delete = {}
         self.binlog = None
+        #approximate bytes of events put into the buffer, see estimate_event_size()
+        self.bytes = 0
+        #chunk of a transaction without commit, the binlog position must not be saved after it
+        self.partial = False
+        #number of the swap, which has taken the buffer out of synch_storage
+        self.seq = 0
         self.lock = Lock()
 
     def len(self):
@@ -44,12 +102,14 @@ class synch_buffer:
 
 
     def copy(self):
-        new = synch_buffer()
+        new = synch_buffer(compaction=self.compaction)
+        new.compaction_statistic = self.compaction_statistic.copy()
         new.insert = self.insert.copy()
         new.update = self.update.copy()
         new.delete = self.delete.copy()
         if self.binlog:
             new.binlog = self.binlog.copy()
+        new.bytes = self.bytes
         return new
 
 
@@ -82,102 +142,321 @@ class synch_buffer:
                     return value
         return None
 
+    def tables(self):
+        with self.lock:
+            return set(self.insert) | set(self.update) | set(self.delete)
+
+    def pop_table(self, table):
+        """Takes all events of the table out of the buffer at once: inserts, updates, deletes."""
+        items = []
+        with self.lock:
+            for d in (self.insert, self.update, self.delete):
+                events = d.pop(table, None)
+                if events:
+                    items.extend(events.values())
+        return items
+
+    def put_items(self, items):
+        """Puts items taken by pop_table() back as they are, e.g. the ones a table mapping can't convert."""
+        with self.lock:
+            for item in items:
+                if item.event_type == 'delete':
+                    self.delete.setdefault(item.table, {})[item.event['values']['id']] = item
+                elif item.event_type == 'update':
+                    self.update.setdefault(item.table, {})[item.event['after_values']['id']] = item
+                else:
+                    self.insert.setdefault(item.table, {})[item.event['id']] = item
+
+    def put_event(self, event_type, table, event, version=None, event_bytes=0):
+        #bytes of the event are counted here, items replaced or dropped by the event are subtracted by _drop()
+        self.bytes += event_bytes
+        if event_type == 'insert':
+            self.put_insert(table, event, version, event_bytes)
+        elif event_type == 'snapshot':
+            self.put_snapshot(table, event, version, event_bytes)
+        elif event_type == 'update':
+            self.put_update(table, event, version, event_bytes)
+        elif event_type == 'delete':
+            self.put_delete(table, event, version, event_bytes)
+        else:
+            raise Exception(f"Unknown event type: '{event_type}'")
+
+    def _drop(self, item):
+        if item is not None:
+            self.bytes -= item.bytes
+
     def put_binlog(self, binlog):
         if self.binlog is None:
             self.binlog = binlog.copy()
         elif binlog > self.binlog:
             self.binlog = binlog.copy()
 
-    def put_insert(self, table: str, event):
+    def put_insert(self, table: str, event, version: int = None, event_bytes: int = 0):
         if table not in self.insert:
             self.insert[table] = {}
         id = event['id']
+
+        replaces = False
+        if self.compaction:
+            if table in self.delete and id in self.delete[table]:
+                # delete + insert: the row is replaced, the insert carries the final image
+                self._drop(self.delete[table].pop(id))
+                self.compaction_statistic['merged'] += 1
+                replaces = True
+            elif id in self.insert[table]:
+                replaces = self.insert[table][id].replaces
+
         #replace if need - it's ok
-        self.insert[table][id] = synch_item(event_type='insert', table=table, event=event)
+        self._drop(self.insert[table].get(id))
+        self.insert[table][id] = synch_item(event_type='insert', table=table, event=event, version=version, replaces=replaces, bytes=event_bytes)
 
         if table in self.update:
             assert id not in self.update[table]
         if table in self.delete:
             assert id not in self.delete[table]
 
-    def put_update(self, table: str, event):
+    def put_snapshot(self, table: str, event, version: int = None, event_bytes: int = 0):
+        """
+        Row of a table regeneration snapshot, stored as an insert. The snapshot is taken after the rows
+        routed before it, so it already contains their changes: a pending update or delete of the row is replaced.
+        """
+        id = event['id']
+        for pending in (self.update, self.delete):
+            if table in pending:
+                self._drop(pending[table].pop(id, None))
+        self.put_insert(table, event, version, event_bytes)
+        # the sink may have the row: a delete after the snapshot must reach it
+        self.insert[table][id].replaces = True
+
+    def put_update(self, table: str, event, version: int = None, event_bytes: int = 0):
         if table not in self.update:
             self.update[table] = {}
         id = event['after_values']['id']
 
-        self.update[table][id] = synch_item(event_type='update', table=table, event=event)
+        if self.compaction:
+            self._put_update_compact(table, id, event, version, event_bytes)
+            return
+
+        self._drop(self.update[table].get(id))
+        self.update[table][id] = synch_item(event_type='update', table=table, event=event, version=version, bytes=event_bytes)
 
         if table in self.insert:
             if id in self.insert[table]:
-                del self.insert[table][id]
+                self._drop(self.insert[table].pop(id))
 
         if table in self.delete:
             assert id not in self.delete[table]
 
 
-    def put_delete(self, table: str, event):
+    def _put_update_compact(self, table, id, event, version, event_bytes=0):
+        if table in self.insert and id in self.insert[table]:
+            # insert + update: still an insert, with the final image
+            previous = self.insert[table][id]
+            self._drop(previous)
+            self.insert[table][id] = synch_item(event_type='insert', table=table, event=event['after_values'], version=version, replaces=previous.replaces, bytes=event_bytes)
+            self.compaction_statistic['merged'] += 1
+            return
+
+        before = event.get('before_values')
+        previous = self.update[table].get(id)
+        if previous is not None:
+            # update chain: before image of the first update, after image of the last one
+            before = previous.event.get('before_values')
+            event = {'before_values': before, 'after_values': event['after_values']}
+            self.compaction_statistic['merged'] += 1
+            self._drop(self.update[table].pop(id))
+
+        if before is not None and before == event['after_values']:
+            self.bytes -= event_bytes
+            self.compaction_statistic['noop_update'] += 1
+            return
+
+        self.update[table][id] = synch_item(event_type='update', table=table, event=event, version=version, bytes=event_bytes)
+
+        if table in self.delete:
+            assert id not in self.delete[table]
+
+    def put_delete(self, table: str, event, version: int = None, event_bytes: int = 0):
         id = event['values']['id']
 
+        if self.compaction and table in self.insert and id in self.insert[table]:
+            previous = self.insert[table].pop(id)
+            self._drop(previous)
+            if not previous.replaces:
+                # insert + delete: the sink has never seen the row
+                self.bytes -= event_bytes
+                self.compaction_statistic['insert_delete'] += 1
+                return
+            # delete + insert + delete: the sink still has the row of before the first delete
+            self.compaction_statistic['merged'] += 1
+
         if table not in self.delete:
             self.delete[table] = {}
-        self.delete[table][id] = synch_item(event_type='delete', table=table, event=event)
+        self._drop(self.delete[table].get(id))
+        self.delete[table][id] = synch_item(event_type='delete', table=table, event=event, version=version, bytes=event_bytes)
 
         if table in self.insert:
             if id in self.insert[table]:
-                del self.insert[table][id]
+                self._drop(self.insert[table].pop(id))
         if table in self.update:
             if id in self.update[table]:
-                del self.update[table][id]
+                self._drop(self.update[table].pop(id))
 
 
 
 class synch_storage:
 
-    def __init__(self, max_len: int):
+    def __init__(self, max_len: int, max_bytes: int = None, allow_partial: bool = False, compaction: bool = False):
         self.lock = Lock()
         self.swap_condition = Condition(self.lock)
-        self.buffer = synch_buffer()
+        self.compaction = compaction
+        self.compaction_statistic = compaction_statistic()
+        self.buffer = synch_buffer(compaction=compaction)
         self.max_len = max_len
         self.size = 0
+        # memory budget: bytes of the current buffer plus bytes of swapped buffers,
+        # which are still processed by workers (released by release())
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.inflight_bytes = 0
+        self.bytes_high_water = 0
+        # large transaction mode: a full buffer without commit is swapped as a partial chunk
+        self.allow_partial = allow_partial
+        self.partial_chunks = 0
+        # consumer mode of the last wait_full()/get_buffer(): with True a buffer is swapped only with a commit marker
+        self.expecting_binlog = None
+        # events put over the budget into a buffer, which can't be swapped before the commit of its transaction
+        self.overflow_events = 0
+        # buffers taken by get_buffer(), the buffer gets its number as seq
+        self.swaps = 0
+
+    def _is_full(self):
+        if self.size >= self.max_len:
+            return True
+        if self.max_bytes and self.bytes + self.inflight_bytes >= self.max_bytes:
+            return True
+        return False
+
+    def _buffer_is_full(self):
+        """The current buffer alone reaches the limits, swapped buffers aren't counted."""
+        if self.size >= self.max_len:
+            return True
+        if self.max_bytes and self.bytes >= self.max_bytes:
+            return True
+        return False
+
+    def _must_wait(self):
+        if not self._is_full():
+            return False
+        if self.expecting_binlog and self.buffer.binlog is None and not self.allow_partial and self._buffer_is_full():
+            # the transaction is bigger than the budget and has no commit yet: nothing can swap the buffer,
+            # waiting would deadlock with get_buffer(), so the buffer grows over the budget until the commit
+            self.overflow_events += 1
+            return False
+        return True
+
+    def set_max_len(self, max_len: int):
+        """New batch size at runtime: a smaller one lets wait_full() swap, a larger one wakes blocked writers."""
+        with self.lock:
+            self.max_len = max_len
+            self.swap_condition.notify_all()
 
-    def put_event(self, event_type, table, event):
+    def put_event(self, event_type, table, event, version=None):
+        event_bytes = estimate_event_size(event)
         with self.lock:
-            while self.size >= self.max_len:
+            while self._must_wait():
                 self.swap_condition.wait()
 
-            if event_type == 'insert':
-                self.buffer.put_insert(table, event)
-            elif event_type == 'update':
-                self.buffer.put_update(table, event)
-            elif event_type == 'delete':
-                self.buffer.put_delete(table, event)
-            else:
-                raise Exception(f"Unknown event type: '{event_type}'")
+            # replaced items of the same row return their bytes to the budget
+            before = self.buffer.bytes
+            self.buffer.put_event(event_type, table, event, version, event_bytes)
             self.size += 1
+            self.bytes += self.buffer.bytes - before
+            if self.bytes + self.inflight_bytes > self.bytes_high_water:
+                self.bytes_high_water = self.bytes + self.inflight_bytes
+            if self._is_full():
+                # wake up wait_full()
+                self.swap_condition.notify_all()
+
+    def _is_swappable(self, expecting_binlog):
+        if not self._is_full():
+            return False
+        if not expecting_binlog:
+            return True
+        # a partial chunk is cut only by the size of the buffer itself, not by memory of swapped buffers
+        return self.buffer.binlog is not None or (self.allow_partial and self._buffer_is_full())
+
+    def wait_full(self, timeout, expecting_binlog):
+        """Sleeps up to timeout seconds, returns earlier if the storage is full, blocks writers and can be swapped."""
+        with self.lock:
+            if self.expecting_binlog != expecting_binlog:
+                self.expecting_binlog = expecting_binlog
+                # writers blocked by an unswappable buffer re-check it
+                self.swap_condition.notify_all()
+            self.swap_condition.wait_for(lambda: self._is_swappable(expecting_binlog), timeout)
 
     def get_buffer(self, expecting_binlog):
 
         with self.lock:
 
+            self.expecting_binlog = expecting_binlog
             self.swap_condition.notify_all()
 
+            partial = False
             if expecting_binlog:
                 if self.buffer.binlog is None:
-                    return None
+                    # transaction bigger than the buffer: stream it by chunks,
+                    # the binlog position is saved only with the chunk, which contains the commit
+                    if not self.allow_partial or not self.size or not self._buffer_is_full():
+                        return None
+                    partial = True
+                    self.partial_chunks += 1
 
             result = self.buffer.copy()
-            self.buffer = synch_buffer()
+            result.partial = partial
+            self.swaps += 1
+            result.seq = self.swaps
+            for k, v in result.compaction_statistic.items():
+                self.compaction_statistic[k] += v
+            self.buffer = synch_buffer(compaction=self.compaction)
             self.size = 0
+            self.inflight_bytes += self.bytes
+            self.bytes = 0
             return result
 
+    def release(self, buffer):
+        """Returns memory of the buffer (got by get_buffer) to the budget, after it has been dumped."""
+        with self.lock:
+            self.inflight_bytes -= buffer.bytes
+            buffer.bytes = 0
+            self.swap_condition.notify_all()
+
 
     def put_binlog(self, binlog):
         with self.lock:
             self.buffer.put_binlog(binlog)
+            if self._is_full():
+                self.swap_condition.notify_all()
 
     def len(self):
         with self.lock:
             return self.size
 
+    def memory_statistic(self):
+        with self.lock:
+            return {
+                "events": self.size,
+                "bytes": self.bytes,
+                "inflight_bytes": self.inflight_bytes,
+                "bytes_high_water": self.bytes_high_water,
+                "max_bytes": self.max_bytes,
+                "partial_chunks": self.partial_chunks,
+                "overflow_events": self.overflow_events,
+            }
+
+    def statistic(self):
+        """Totals of net-change compaction over all swapped buffers."""
+        with self.lock:
+            return self.compaction_statistic.copy()
 
 
@@ -0,0 +1,116 @@
+from decimal import Decimal
+
+# named casts for APP_SETTINGS['table_mapping'][table]['casts'], a callable can be given as well
+CASTS = {
+    'int': int,
+    'float': float,
+    'str': str,
+    'bool': bool,
+    'decimal': Decimal,
+}
+
+MAPPING_KEYS = {'target', 'columns', 'rename', 'constants', 'casts', 'version_column', 'deleted_column', 'schema_column'}
+
+
+class table_converter:
+    """
+    Row converter of one source table, compiled from a declarative mapping:
+
+        'items': {
+            'target': 'items_ch',                 # target table, the source name by default
+            'columns': ['id', 'name', 'value'],   # source columns, table_columns of the table by default
+            'rename': {'name': 'title'},
+            'constants': {'source': 'shop'},
+            'casts': {'value': 'int'},
+            'version_column': 'version',          # gets the engine row version
+            'deleted_column': 'deleted',          # 1 for deletes, 0 otherwise; without it deletes go to the plugin
+            'schema_column': 'tenant',            # source schema, for tables of several schemas in one target
+        }
+
+    The row expression is generated once, so a row costs one call without per-column branching.
+    """
+
+    def __init__(self, table: str, mapping: dict, default_columns=None):
+        unknown = set(mapping) - MAPPING_KEYS
+        if unknown:
+            raise ValueError(f"table_mapping for '{table}': unknown keys {sorted(unknown)}")
+
+        source_columns = list(mapping.get('columns') or default_columns or [])
+        if not source_columns:
+            raise ValueError(f"table_mapping for '{table}' needs 'columns' or table_columns")
+        rename = mapping.get('rename', {})
+        constants = mapping.get('constants', {})
+        casts = mapping.get('casts', {})
+        for column in list(rename) + list(casts):
+            if column not in source_columns:
+                raise ValueError(f"table_mapping for '{table}': unknown column '{column}'")
+
+        self.table = table
+        self.target = mapping.get('target', table)
+        self.soft_delete = bool(mapping.get('deleted_column'))
+
+        namespace = {}
+        columns = []
+        expressions = []
+        for column in source_columns:
+            columns.append(rename.get(column, column))
+            value = f"row[{column!r}]"
+            cast = casts.get(column)
+            if cast is not None:
+                if not callable(cast):
+                    if cast not in CASTS:
+                        raise ValueError(f"table_mapping for '{table}': unknown cast '{cast}'")
+                    cast = CASTS[cast]
+                name = f"_cast{len(namespace)}"
+                namespace[name] = cast
+                value = f"(None if {value} is None else {name}({value}))"
+            expressions.append(value)
+        for column, constant in constants.items():
+            name = f"_const{len(namespace)}"
+            namespace[name] = constant
+            columns.append(column)
+            expressions.append(name)
+        if mapping.get('version_column'):
+            columns.append(mapping['version_column'])
+            expressions.append("version")
+        if self.soft_delete:
+            columns.append(mapping['deleted_column'])
+            expressions.append("deleted")
+        if mapping.get('schema_column'):
+            columns.append(mapping['schema_column'])
+            expressions.append("schema")
+
+        if len(set(columns)) != len(columns):
+            raise ValueError(f"table_mapping for '{table}': duplicate target columns {columns}")
+        self.columns = columns
+
+        source = f"def convert(row, version, deleted, schema):\n    return [{', '.join(expressions)}]\n"
+        exec(compile(source, f"<table_mapping {table}>", "exec"), namespace)
+        self.convert = namespace['convert']
+
+    def convert_items(self, items, schema=None, rest=None):
+        """
+        synch_item list -> list of target rows, in the order of self.columns.
+        Without deleted_column a delete has no target row: it's appended to rest for plugin process_event.
+        """
+        convert = self.convert
+        rows = []
+        for item in items:
+            if item.event_type == 'insert':
+                rows.append(convert(item.event, item.version, 0, schema))
+            elif item.event_type == 'update':
+                rows.append(convert(item.event['after_values'], item.version, 0, schema))
+            elif self.soft_delete:
+                rows.append(convert(item.event['values'], item.version, 1, schema))
+            elif rest is not None:
+                rest.append(item)
+        return rows
+
+
+def compile_table_mapping(app_settings):
+    """APP_SETTINGS['table_mapping'] -> {source table: table_converter}"""
+    table_columns = app_settings.get('table_columns', {})
+    return {
+        table: table_converter(table, mapping, table_columns.get(table))
+        for table, mapping in app_settings.get('table_mapping', {}).items()
+    }
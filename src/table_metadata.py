@@ -0,0 +1,110 @@
+import os
+import json
+import fnmatch
+import logging
+
+from .tools import has_pattern
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_SCHEMAS = ('mysql', 'information_schema', 'performance_schema', 'sys')
+
+
+def schema_fingerprint(cursor, schema_patterns) -> str:
+    """
+    One-row checksum of the columns of the configured schemas: CREATE, ALTER, DROP or RENAME of their tables changes it.
+    Other schemas of the server are neither read nor counted; patterns are resolved by the list of schemas.
+    """
+    schemas = sorted(set(schema_patterns))
+    if any(has_pattern(p) for p in schemas):
+        cursor.execute(
+            f"SELECT SCHEMA_NAME FROM information_schema.SCHEMATA WHERE SCHEMA_NAME NOT IN ({', '.join(['%s'] * len(SYSTEM_SCHEMAS))})",
+            SYSTEM_SCHEMAS,
+        )
+        schemas = sorted(r[0] for r in cursor.fetchall() if any(fnmatch.fnmatchcase(r[0], p) for p in schema_patterns))
+        if not schemas:
+            return "0:0:0"
+    cursor.execute(
+        "SELECT COUNT(*), COALESCE(SUM(CRC32(CONCAT_WS('.', TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, DATA_TYPE, ORDINAL_POSITION))), 0) "
+        f"FROM information_schema.COLUMNS WHERE TABLE_SCHEMA IN ({', '.join(['%s'] * len(schemas))})",
+        schemas,
+    )
+    count, checksum = cursor.fetchall()[0]
+    return f"{len(schemas)}:{count}:{checksum}"
+
+
+def fetch_column_types(cursor, pairs) -> dict:
+    """(schema, table) pairs -> {(schema, table): {column: DATA_TYPE}} by one information_schema query."""
+    pairs = set(pairs)
+    types = {pair: {} for pair in pairs}
+    if not pairs:
+        return types
+    schemas = sorted({s for s, _ in pairs})
+    cursor.execute(
+        "SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS "
+        f"WHERE TABLE_SCHEMA IN ({', '.join(['%s'] * len(schemas))}) ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION",
+        schemas,
+    )
+    for schema, table, column, data_type in cursor.fetchall():
+        if (schema, table) in types:
+            types[(schema, table)][column] = data_type.lower()
+    return types
+
+
+class table_metadata:
+    """
+    Resolved tables and column types, saved next to the checkpoint (<binlog_file>.tables.json).
+    A restart uses them while the schema fingerprint and the table settings are the same,
+    so it needs one aggregate query instead of pattern resolution and column queries.
+    """
+
+    def __init__(self, path: str, tables):
+        self.path = path
+        # patterns of the settings, a changed setting invalidates the file
+        self.settings = [tables.schema_patterns, tables.scan_patterns, tables.init_patterns]
+        self.fingerprint = None
+        self.scan = set()
+        self.init = []
+        self.column_types = {}
+
+    def load(self, fingerprint) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("fingerprint") != fingerprint or data.get("settings") != self.settings:
+                return False
+            self.scan = {tuple(p) for p in data["scan"]}
+            self.init = [tuple(p) for p in data["init"]]
+            self.column_types = {(s, t): columns for s, t, columns in data["column_types"]}
+        except (json.JSONDecodeError, IOError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"table metadata {self.path} is ignored: {e}")
+            return False
+        self.fingerprint = fingerprint
+        return True
+
+    def refresh(self, cursor, fingerprint, tables):
+        """Metadata of resolved tables from information_schema."""
+        self.fingerprint = fingerprint
+        self.scan = set(tables.scan)
+        self.init = list(tables.init)
+        self.column_types = fetch_column_types(cursor, self.scan | set(self.init))
+
+    def save(self):
+        data = {
+            "fingerprint": self.fingerprint,
+            "settings": self.settings,
+            "scan": sorted(self.scan),
+            "init": self.init,
+            "column_types": [[s, t, columns] for (s, t), columns in sorted(self.column_types.items())],
+        }
+        tmp_file = self.path + ".tmp"
+        try:
+            with open(tmp_file, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_file, self.path)
+        except IOError as e:
+            logger.warning(f"table metadata {self.path} is not saved: {e}")
+            return False
+        return True
@@ -5,21 +5,87 @@ import socket
 import time
 import pymysql
 import importlib
+import inspect
+import fnmatch
 import threading
-import clickhouse_connect
+from array import array
+from contextlib import contextmanager
 from functools import total_ordering
+from .synch_storage import estimate_event_size
+
+# binlog positions are 32-bit, the file number goes to the higher bits
+BINLOG_VERSION_FILE_SHIFT = 32
+
+
+def binlog_version(file: str, pos: int, row_index: int = 0) -> int:
+    """
+    Monotonic row version from binlog coordinates: file number, start position of the rows event and row index.
+    Every row takes at least one byte of the event, so pos + row_index never reaches the next event.
+    The same binlog row always gets the same version, so replays after restart are idempotent.
+    """
+    return (int(file.rsplit('.', 1)[1]) << BINLOG_VERSION_FILE_SHIFT) + pos + row_index
+
+
+# with gtid_positioning: seq_no of the transaction goes to the higher bits, the row number inside it to the lower ones
+GTID_VERSION_ROW_SHIFT = 32
+
+
+def gtid_version(seq_no: int, row_index: int = 0) -> int:
+    """
+    Row version with gtid_positioning: GTID seq_no and the row number inside the transaction.
+    seq_no of a domain continues on a new primary after switchover, file numbers don't,
+    so these versions keep growing where binlog_version() would go back. Comparable within one GTID domain.
+    """
+    return (int(seq_no) << GTID_VERSION_ROW_SHIFT) + row_index
+
+
+def gtid_seq(gtid: str) -> int:
+    """'0-1-100' -> 100"""
+    return int(gtid.rsplit('-', 1)[1])
+
+
+def parse_gtid(value):
+    """'0-1-100,1-2-5' -> {0: '0-1-100', 1: '1-2-5'}"""
+    result = {}
+    if not value:
+        return result
+    for gtid in value.split(','):
+        gtid = gtid.strip()
+        if gtid:
+            result[int(gtid.split('-')[0])] = gtid
+    return result
+
 
 @total_ordering
 class binlog_file:
 
-    def __init__(self, file_path: str, file: str =None, pos: int =None):
+    def __init__(self, file_path: str, file: str =None, pos: int =None, gtid=None):
         self.file = file
         self.pos = int(pos) if pos else 0
         self.file_path = file_path
+        # last committed GTID per domain: {domain_id: 'domain-server-seq'}
+        self.gtid = parse_gtid(gtid) if isinstance(gtid, str) or gtid is None else dict(gtid)
 
     def __str__(self):
+        if self.gtid:
+            return f"file: {self.file} pos: {self.pos} gtid: {self.gtid_str()} [{self.file_path}]"
         return f"file: {self.file} pos: {self.pos} [{self.file_path}]"
 
+    def gtid_str(self):
+        return ",".join(self.gtid[domain] for domain in sorted(self.gtid))
+
+    def gtid_seqs(self):
+        """{domain_id: seq_no} of the last committed transactions"""
+        return {domain: gtid_seq(gtid) for domain, gtid in self.gtid.items()}
+
+    def gtid_covers(self, other):
+        """
+        Every transaction of other is committed here: seq_no of each domain of other isn't greater than ours.
+        Unlike file/pos it holds across the servers of one replication topology.
+        """
+        seqs = self.gtid_seqs()
+        return all(domain in seqs and seq <= seqs[domain] for domain, seq in other.gtid_seqs().items())
+
     def __eq__(self, other):
         if not isinstance(other, binlog_file):
             return NotImplemented
@@ -33,7 +99,7 @@ class binlog_file:
         return self.file < other.file
 
     def copy(self):
-        return binlog_file(file_path=self.file_path, file=self.file, pos=self.pos)
+        return binlog_file(file_path=self.file_path, file=self.file, pos=self.pos, gtid=self.gtid)
 
     def load(self):
         if not os.path.exists(self.file_path):
@@ -43,6 +109,7 @@ class binlog_file:
                 data = json.load(f)
                 self.file = data.get("log_file")
                 self.pos = data.get("log_pos")
+                self.gtid = parse_gtid(data.get("gtid"))
             # проверка, что данные валидные
             if not isinstance(self.file, str) or not isinstance(self.pos, int):
                 return False
@@ -55,7 +122,8 @@ class binlog_file:
         tmp_file = self.file_path + ".tmp"
         data = {
             "log_file": self.file,
-            "log_pos": self.pos
+            "log_pos": self.pos,
+            "gtid": self.gtid_str(),
         }
         try:
             with open(tmp_file, "w") as f:
@@ -69,6 +137,83 @@ class binlog_file:
 
 
 
+class version_horizon:
+    """
+    Binlog position in the row version space. version - version of snapshot rows taken at the position,
+    lower than any row after it; before(version, domain) - the row was committed before the position.
+    With GTID versions every domain is compared by its own seq_no, for snapshot rows the lowest domain is taken.
+    """
+
+    def __init__(self, binlog, gtid_versions=False):
+        self.gtid_versions = gtid_versions
+        if gtid_versions:
+            # first version after the position in every domain
+            self.domains = {domain: gtid_version(seq + 1) for domain, seq in binlog.gtid_seqs().items()}
+            self.version = min(self.domains.values(), default=gtid_version(1)) - 1
+        else:
+            self.domains = None
+            self.version = binlog_version(binlog.file, binlog.pos) - 1
+
+    def before(self, version, domain=None):
+        if version is None:
+            return False
+        if self.gtid_versions:
+            start = self.domains.get(domain)
+            return start is not None and version < start
+        return version <= self.version
+
+
+class checkpoint_controller:
+    """
+    Merges binlog positions committed by several flush pipelines into one checkpoint.
+    file/pos is the lowest committed position, the GTID of a domain comes from the pipeline owning the domain;
+    the GTID of a domain without a pipeline comes with any marker, nothing of the domain is pending.
+    """
+
+    def __init__(self, binlog):
+        self.lock = threading.Lock()
+        self.binlog = binlog.copy()
+        self.positions = {}
+        # pipeline key -> gtid domain it owns
+        self.domains = {}
+
+    def register(self, key, binlog, domain=None):
+        """New pipeline: nothing before binlog is pending in it."""
+        with self.lock:
+            if key not in self.positions:
+                self.positions[key] = binlog.copy()
+            if domain is not None:
+                self.domains[key] = domain
+
+    def commit(self, key, binlog, domain=None, owns_gtid=True):
+        """
+        Pipeline key has dumped everything up to binlog.
+        owns_gtid: domain=None - gtid of all domains, otherwise gtid of the domain only.
+        Returns the merged checkpoint.
+        """
+        with self.lock:
+            self.positions[key] = binlog.copy()
+            if domain is not None:
+                self.domains[key] = domain
+            if owns_gtid:
+                if domain is None:
+                    self.binlog.gtid.update(binlog.gtid)
+                elif domain in binlog.gtid:
+                    self.binlog.gtid[domain] = binlog.gtid[domain]
+            else:
+                # e.g. a DDL in a domain, which has had no rows yet: a pipeline is created by the first row,
+                # before its marker, so a domain without a pipeline has nothing pending before this marker
+                owned = set(self.domains.values())
+                for d, gtid in binlog.gtid.items():
+                    if d not in owned:
+                        self.binlog.gtid[d] = gtid
+
+            low = min(self.positions.values())
+            self.binlog.file = low.file
+            self.binlog.pos = low.pos
+            return self.binlog.copy()
+
+
 class plugin_wrapper:
 
     def __init__(self, module_path):
@@ -90,8 +235,174 @@ class plugin_wrapper:
         self.tear_down = getattr(module, 'tear_down')
         # вызывается в мультипоточном режиме, для обработки накопленных данных
         self.process_event = getattr(module, 'process_event')
+        # process_event(event_type, table, event, version) - плагин принимает версию строки от движка
+        self.process_event_version = accepts_argument(self.process_event, 'version')
+        # process_event(..., schema) - плагин принимает имя схемы, нужно при нескольких схемах (APP_SETTINGS 'schemas')
+        self.process_event_schema = accepts_argument(self.process_event, 'schema')
         # вызывается после завершения работы всех воркеров, в рамках собранного пакета данных, для сброса данных в хранилище
-        self.dump_values = getattr(module, 'dump_values')
+        self.dump_values = getattr(module, 'dump_values', None)
+        # необязательный флаг: плагину нужны before_values в update-событиях, иначе они не хранятся (None)
+        self.need_before_values = getattr(module, 'need_before_values', False)
+        # необязательный флаг: плагин читает строки как отображения и не меняет их, при compact_rows словари не создаются
+        self.compact_rows = getattr(module, 'compact_rows', False)
+        # необязательная колоночная альтернатива dump_values: dump_columns(table_name, columns, data), data - по массиву на колонку
+        self.dump_columns = getattr(module, 'dump_columns', None)
+        # необязательно: schema_changed(schema, table, query) - DDL таблицы из scan_tables, вызывается после сброса всех строк до DDL
+        self.schema_changed = getattr(module, 'schema_changed', None)
+
+
+def has_pattern(name) -> bool:
+    return any(c in name for c in '*?[')
+
+
+class table_filter:
+    """
+    Schemas and tables of the engine: APP_SETTINGS 'schemas' (default - [db_name]), 'scan_tables', 'init_tables'.
+    Every name may be a shell-style pattern: 'tenant_*', 'orders*'. Patterns are resolved into concrete
+    (schema, table) pairs by resolve() from information_schema at start.
+
+    With 'schemas' events are keyed by 'schema.table' through the whole pipeline, so equal table names of
+    different tenants never mix; without it the key is the bare table name, as before.
+    """
+
+    def __init__(self, app_settings):
+        self.qualified = bool(app_settings.get('schemas'))
+        self.schema_patterns = list(app_settings.get('schemas') or [app_settings['db_name']])
+        self.scan_patterns = list(app_settings.get('scan_tables', []))
+        self.init_patterns = list(app_settings.get('init_tables', []))
+        # (schema, table) pairs, without patterns they are known without the database
+        self.scan = set()
+        self.init = []
+        if not self.has_patterns():
+            self.scan = {(s, t) for s in self.schema_patterns for t in self.scan_patterns}
+            self.init = [(s, t) for s in self.schema_patterns for t in self.init_patterns]
+
+    def has_patterns(self) -> bool:
+        return any(has_pattern(n) for n in self.schema_patterns + self.scan_patterns + self.init_patterns)
+
+    def key(self, schema, table):
+        return f"{schema}.{table}" if self.qualified else table
+
+    def split(self, key):
+        """key -> (schema, table)"""
+        if self.qualified:
+            return tuple(key.split('.', 1))
+        return self.schema_patterns[0], key
+
+    def is_scanned(self, schema, table) -> bool:
+        return (schema, table) in self.scan
+
+    @staticmethod
+    def _match(pairs, schema_patterns, table_patterns):
+        result = []
+        for schema, table in pairs:
+            if any(fnmatch.fnmatchcase(schema, p) for p in schema_patterns) and \
+                    any(fnmatch.fnmatchcase(table, p) for p in table_patterns):
+                result.append((schema, table))
+        return result
+
+    def resolve(self, cursor):
+        """Resolves patterns against information_schema, raises if a pattern matches nothing."""
+        cursor.execute("SELECT TABLE_SCHEMA, TABLE_NAME FROM information_schema.TABLES WHERE TABLE_TYPE = 'BASE TABLE' ORDER BY 1, 2")
+        pairs = [(r[0], r[1]) for r in cursor.fetchall()]
+        for patterns, kind in ((self.schema_patterns, 'schemas'), (self.scan_patterns, 'scan_tables'), (self.init_patterns, 'init_tables')):
+            names = {s for s, _ in pairs} if kind == 'schemas' else {t for _, t in pairs}
+            missing = [p for p in patterns if not fnmatch.filter(names, p)]
+            if missing:
+                raise RuntimeError(f"Nothing matches {kind}: {missing}")
+        self.scan = set(self._match(pairs, self.schema_patterns, self.scan_patterns))
+        self.init = self._match(pairs, self.schema_patterns, self.init_patterns)
+
+    def only_schemas(self):
+        return sorted({s for s, _ in self.scan})
+
+    def only_tables(self):
+        return sorted({t for _, t in self.scan})
+
+
+_DDL_COMMENT_RE = re.compile(r"/\*.*?\*/|--[^\n]*|#[^\n]*", re.S)
+_DDL_RE = re.compile(
+    r"\s*(?:(ALTER|CREATE|DROP|RENAME)\s+(?:(?:ONLINE|OFFLINE|IGNORE|TEMPORARY|OR\s+REPLACE)\s+)*TABLE|(TRUNCATE)(?:\s+TABLE)?)\s+"
+    r"(?:IF\s+(?:NOT\s+)?EXISTS\s+)?(.*)", re.I | re.S)
+_DDL_NAME_RE = re.compile(r"\s*(?:`((?:[^`]|``)+)`|([\w$]+))(?:\s*\.\s*(?:`((?:[^`]|``)+)`|([\w$]+)))?")
+_DDL_SEPARATOR_RE = re.compile(r"\s*(?:,|\bTO\b)", re.I)
+_DDL_ALTER_RENAME_RE = re.compile(r"\bRENAME\s+(?!(?:COLUMN|INDEX|KEY|CONSTRAINT)\b)(?:TO\s+|AS\s+)?(?=[`\w$])", re.I)
+
+
+def _ddl_name(match, default_schema):
+    first = (match.group(1) or '').replace('``', '`') or match.group(2)
+    second = (match.group(3) or '').replace('``', '`') or match.group(4)
+    return (first, second) if second else (default_schema, first)
+
+
+def ddl_tables(query, default_schema):
+    """
+    Table DDL of a QueryEvent -> (verb, [(schema, table)]), None for any other query.
+    Names of every table the statement touches are returned: both names of RENAME, all tables of DROP.
+    """
+    match = _DDL_RE.match(_DDL_COMMENT_RE.sub(' ', query))
+    if not match:
+        return None
+    verb = (match.group(1) or match.group(2)).lower()
+    rest = match.group(3)
+    tables = []
+    pos = 0
+    while True:
+        name = _DDL_NAME_RE.match(rest, pos)
+        if not name:
+            break
+        tables.append(_ddl_name(name, default_schema))
+        pos = name.end()
+        if verb not in ('drop', 'rename'):
+            break
+        separator = _DDL_SEPARATOR_RE.match(rest, pos)
+        if not separator:
+            break
+        pos = separator.end()
+    if verb == 'alter' and tables:
+        rename = _DDL_ALTER_RENAME_RE.search(rest, pos)
+        if rename:
+            name = _DDL_NAME_RE.match(rest, rename.end())
+            if name:
+                tables.append(_ddl_name(name, default_schema))
+    return verb, tables
+
+
+def accepts_argument(func, name) -> bool:
+    return func is not None and name in inspect.signature(func).parameters
+
+
+def column_array(values):
+    """
+    Column values -> array('q') for int64 columns, array('d') for float columns, otherwise the values as is.
+    None or bool values keep the column as a plain sequence.
+    """
+    if values and all(type(v) is int for v in values):
+        try:
+            return array('q', values)
+        except OverflowError:
+            return values
+    if values and all(type(v) is float for v in values):
+        return array('d', values)
+    return values
+
+
+def rows_to_columns(rows):
+    """insert_item_row list -> one sequence per column, built in one pass over the rows."""
+    return [column_array(column) for column in zip(*[r.values for r in rows])]
+
+
+def project_row(row, columns):
+    """Keeps only allowed columns of the row, None - all columns."""
+    if columns is None:
+        return row
+    return {c: row[c] for c in columns if c in row}
+
+
+def select_columns(columns):
+    if columns is None:
+        return "*"
+    return ", ".join(f"`{c}`" for c in columns)
 
 
 class regeneration_threads_controller:
@@ -176,10 +487,13 @@ class regeneration_threads_controller:
 
 class insert_item_row:
 
+    __slots__ = ('table_name', 'keys', 'values', 'bytes')
+
     def __init__(self, table_name: str, keys: [], values: []):
         self.table_name = table_name
         self.keys = keys
         self.values = values
+        self.bytes = 0
 
 
 class insert_buffer:
@@ -188,10 +502,32 @@ class insert_buffer:
 
         self.lock = threading.Lock()
         self.items = []
+        self.bytes = 0
+        self.bytes_high_water = 0
 
     def push(self, table, columns, data) -> bool:
+        item = insert_item_row(table, columns, data)
+        item.bytes = estimate_event_size(data)
+        with self.lock:
+            self.items.append(item)
+            self.bytes += item.bytes
+            if self.bytes > self.bytes_high_water:
+                self.bytes_high_water = self.bytes
+
+    def push_rows(self, table, columns, rows):
+        """Bulk push of rows with the same columns, the columns list is shared by all items."""
+        items = []
+        total = 0
+        for data in rows:
+            item = insert_item_row(table, columns, data)
+            item.bytes = estimate_event_size(data)
+            total += item.bytes
+            items.append(item)
         with self.lock:
-            self.items.append(insert_item_row(table, columns, data))
+            self.items.extend(items)
+            self.bytes += total
+            if self.bytes > self.bytes_high_water:
+                self.bytes_high_water = self.bytes
 
     def get_similar_pack_clear(self):
 
@@ -215,23 +551,44 @@ class insert_buffer:
                 pack.append(item)
 
             del self.items[:len(pack)]
+            for item in pack:
+                self.bytes -= item.bytes
             return pack
 
+    def memory_statistic(self):
+        with self.lock:
+            return {
+                "rows": len(self.items),
+                "bytes": self.bytes,
+                "bytes_high_water": self.bytes_high_water,
+            }
+
 
-def get_health_answer(socket_path):
+def get_health_answer(socket_path, command=None, args=()):
+    """Health of the engine, or the answer to a command of the health socket, e.g. command='regenerate', args=['items']."""
 
     with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
         s.connect(socket_path)
-        data = s.recv(4096)
+        if command is not None:
+            s.sendall((json.dumps({'command': command, 'args': list(args)}) + "\n").encode())
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            data += chunk
 
     return json.loads(data.decode())
     #print(json.loads(data))
 
-def get_binlogs(mysql_settings):
-    conn = pymysql.connect(
-        **mysql_settings
-    )
-    cursor = conn.cursor()
+def get_binlogs(mysql_settings, cursor=None):
+    """SHOW BINARY LOGS, on the cursor of an open connection or on a new connection."""
+    conn = None
+    if cursor is None:
+        conn = pymysql.connect(
+            **mysql_settings
+        )
+        cursor = conn.cursor()
 
     cursor.execute(
         "SHOW BINARY LOGS;"
@@ -243,7 +600,8 @@ def get_binlogs(mysql_settings):
     for r in result:
         binlogs.append(binlog_file(file_path='/var/tmp/1', file=r[0], pos=r[1]))
 
-    conn.close()
+    if conn:
+        conn.close()
 
     return binlogs
 
@@ -306,6 +664,7 @@ def start(MYSQL_SETTINGS, APP_SETTINGS, as_thread=True):
         thread = threading.Thread(
             target=run,
             daemon=True,
+            name="engine",
             args=(MYSQL_SETTINGS, APP_SETTINGS,)
         )
 
@@ -326,10 +685,13 @@ def stop(thread, wait_interval_s = 20):
 def get_binlog_from_db(MYSQL_SETTINGS, APP_SETTINGS):
     conn = pymysql.connect(**MYSQL_SETTINGS)
     cursor = conn.cursor()
+    # gtid first: if the server moves between the queries, gtid is older and resume replays a bit more
+    cursor.execute("SELECT @@gtid_binlog_pos;")
+    gtid = cursor.fetchall()[0][0]
     cursor.execute("SHOW MASTER STATUS;")
     r = cursor.fetchall()
 
-    binlog = binlog_file(file_path=APP_SETTINGS['binlog_file'], file=r[0][0], pos=r[0][1])
+    binlog = binlog_file(file_path=APP_SETTINGS['binlog_file'], file=r[0][0], pos=r[0][1], gtid=gtid)
 
     conn.close()
     return binlog
@@ -341,8 +703,38 @@ def preflight_check(MYSQL_SETTINGS, APP_SETTINGS):
     preflight_check_ex(cursor, MYSQL_SETTINGS, APP_SETTINGS)
     conn.close()
 
+class startup_timings:
+    """Seconds of startup phases for health: phases measured by phase(), moments since start by mark()."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.phases = {}
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.phases[name] = round(seconds, 3)
+
+    @contextmanager
+    def phase(self, name):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started_at)
+
+    def mark(self, name):
+        self.add(name, time.time() - self.started_at)
+
+    def statistic(self):
+        with self.lock:
+            return dict(self.phases)
+
+
 class process_event_result:
 
+    __slots__ = ('table_name', 'columns', 'values')
+
     def __init__(self, table_name, columns, values):
         self.table_name = table_name
         self.columns = columns
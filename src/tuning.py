@@ -0,0 +1,73 @@
+import time
+import threading
+
+# settings which the 'tune' command changes while the engine runs: name -> (type, min, max)
+TUNABLE_SETTINGS = {
+    'clickhouse_max_batch_len': (int, 1, 10_000_000),
+    'clickhouse_dropdown_sleep': (float, 0.01, 3600),
+    'full_regeneration_threads_count': (int, 1, 256),
+    'full_regeneration_batch_len': (int, 1, 10_000_000),
+    # rows per second of regeneration reads, 0 - unlimited
+    'full_regeneration_max_rows_per_s': (float, 0, 1_000_000_000),
+}
+
+
+def parse_tuning(args) -> dict:
+    """['key=value', ...] -> {key: value}; every value is checked before anything is applied."""
+    values = {}
+    for arg in args:
+        name, sep, text = arg.partition('=')
+        if not sep:
+            raise ValueError(f"'{arg}' is not key=value")
+        if name not in TUNABLE_SETTINGS:
+            raise ValueError(f"'{name}' can't be tuned, tunable: {', '.join(TUNABLE_SETTINGS)}")
+        kind, low, high = TUNABLE_SETTINGS[name]
+        try:
+            value = kind(text)
+        except ValueError:
+            raise ValueError(f"{name}: '{text}' is not {kind.__name__}")
+        if not low <= value <= high:
+            raise ValueError(f"{name} must be in [{low}, {high}]")
+        values[name] = value
+    return values
+
+
+def tuned_settings(app_settings) -> dict:
+    """Active values of the tunable settings."""
+    return {name: app_settings.get(name, 0) for name in TUNABLE_SETTINGS}
+
+
+class rate_limiter:
+    """
+    Shared budget of rows per second for several reader threads: acquire(n) reserves the time of n rows
+    and sleeps until it comes. rate 0 - unlimited. set_rate() applies to the next reservations.
+    """
+
+    def __init__(self, rate: float = 0):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.next_at = 0.0
+        self.waited = 0.0
+
+    def set_rate(self, rate: float):
+        with self.lock:
+            self.rate = rate
+            # the debt of the old rate is forgiven
+            self.next_at = 0.0
+
+    def acquire(self, count: int) -> float:
+        with self.lock:
+            if not self.rate:
+                return 0.0
+            now = time.monotonic()
+            start = max(now, self.next_at)
+            self.next_at = start + count / self.rate
+            delay = start - now
+            self.waited += delay
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def statistic(self):
+        with self.lock:
+            return {"rate": self.rate, "waited_s": round(self.waited, 3)}
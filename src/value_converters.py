@@ -0,0 +1,188 @@
+import json
+import threading
+import pymysql
+from pymysqlreplication.constants import FIELD_TYPE
+from .table_metadata import fetch_column_types
+
+# information_schema.COLUMNS.DATA_TYPE -> type family of APP_SETTINGS['value_converters']
+DATA_TYPE_FAMILIES = {
+    'decimal': 'decimal',
+    'json': 'json',
+    'datetime': 'datetime', 'timestamp': 'datetime',
+    'date': 'date',
+    'time': 'time',
+    'bit': 'bit',
+    'char': 'text', 'varchar': 'text', 'tinytext': 'text', 'text': 'text', 'mediumtext': 'text', 'longtext': 'text',
+    'binary': 'binary', 'varbinary': 'binary', 'tinyblob': 'binary', 'blob': 'binary', 'mediumblob': 'binary', 'longblob': 'binary',
+}
+
+# table-map event column type -> type family, string types are split into text/binary by the charset
+FIELD_TYPE_FAMILIES = {
+    FIELD_TYPE.DECIMAL: 'decimal', FIELD_TYPE.NEWDECIMAL: 'decimal',
+    FIELD_TYPE.JSON: 'json',
+    FIELD_TYPE.DATETIME: 'datetime', FIELD_TYPE.DATETIME2: 'datetime',
+    FIELD_TYPE.TIMESTAMP: 'datetime', FIELD_TYPE.TIMESTAMP2: 'datetime',
+    FIELD_TYPE.DATE: 'date', FIELD_TYPE.NEWDATE: 'date',
+    FIELD_TYPE.TIME: 'time', FIELD_TYPE.TIME2: 'time',
+    FIELD_TYPE.BIT: 'bit',
+}
+STRING_FIELD_TYPES = {
+    FIELD_TYPE.VARCHAR, FIELD_TYPE.VAR_STRING, FIELD_TYPE.STRING,
+    FIELD_TYPE.TINY_BLOB, FIELD_TYPE.MEDIUM_BLOB, FIELD_TYPE.LONG_BLOB, FIELD_TYPE.BLOB,
+}
+
+
+def _json_str(v):
+    # text of regeneration and parsed values of the binlog are dumped the same way, so both give equal strings
+    if isinstance(v, (str, bytes)):
+        try:
+            v = json.loads(v)
+        except ValueError:
+            return v.decode('utf-8') if isinstance(v, bytes) else v
+    return json.dumps(v, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def _json_object(v):
+    if isinstance(v, (str, bytes)):
+        return json.loads(v)
+    return v
+
+
+def _bit_int(v):
+    if isinstance(v, bytes):
+        return int.from_bytes(v, 'big')
+    if isinstance(v, str):
+        # pymysqlreplication gives bits as '0101'
+        return int(v, 2)
+    return int(v)
+
+
+def _text_str(v):
+    return v.decode('utf-8', errors='replace') if isinstance(v, bytes) else v
+
+
+def _binary_hex(v):
+    return v.hex() if isinstance(v, bytes) else v
+
+
+# named conversions of every family, a callable can be given as well
+CONVERSIONS = {
+    'decimal': {'float': float, 'str': str},
+    'json': {'str': _json_str, 'object': _json_object},
+    'datetime': {'str': lambda v: v.isoformat(sep=' ') if hasattr(v, 'isoformat') else v},
+    'date': {'str': lambda v: v.isoformat() if hasattr(v, 'isoformat') else v},
+    'time': {'seconds': lambda v: v.total_seconds() if hasattr(v, 'total_seconds') else v, 'str': str},
+    'bit': {'int': _bit_int},
+    'text': {'str': _text_str},
+    'binary': {'hex': _binary_hex},
+}
+
+
+def column_family(column):
+    """pymysqlreplication Column -> type family or None"""
+    family = FIELD_TYPE_FAMILIES.get(column.type)
+    if family is None and column.type in STRING_FIELD_TYPES:
+        family = 'text' if getattr(column, 'character_set_name', None) else 'binary'
+    return family
+
+
+def compile_converter(name, families, rules):
+    """
+    {column: type family} -> convert(row) which replaces values of converted columns in place and returns the row,
+    None if no column of the table is converted. The function is generated once, a row costs one call.
+    """
+    namespace = {}
+    lines = []
+    for column, family in families.items():
+        rule = rules.get(family)
+        if rule is None:
+            continue
+        func = rule if callable(rule) else CONVERSIONS[family][rule]
+        fname = f"_conv{len(namespace)}"
+        namespace[fname] = func
+        lines.append(f"    v = row.get({column!r})\n    if v is not None:\n        row[{column!r}] = {fname}(v)\n")
+    if not lines:
+        return None
+    source = "def convert(row):\n" + "".join(lines) + "    return row\n"
+    exec(compile(source, f"<value_converters {name}>", "exec"), namespace)
+    return namespace['convert']
+
+
+class value_converters:
+    """
+    Per-table converters of column values, selected by APP_SETTINGS['value_converters']:
+
+        'value_converters': {
+            'decimal': 'float',     # or 'str'
+            'json': 'str',          # or 'object'
+            'datetime': 'str',      # datetime and timestamp columns
+            'date': 'str',
+            'time': 'seconds',      # or 'str'
+            'bit': 'int',
+            'text': 'str',          # bytes of char/text columns are decoded
+            'binary': 'hex',
+        }
+
+    Column types are read once: from information_schema by load() at start, or from the table-map event
+    of the binlog row event for a table which isn't loaded. Regeneration and binlog rows of a table go through
+    the same converter, so both paths give the sink equal values. invalidate() drops a table after DDL.
+    """
+
+    def __init__(self, mysql_settings, rules: dict):
+        for family, rule in rules.items():
+            if family not in CONVERSIONS:
+                raise ValueError(f"value_converters: unknown type '{family}'")
+            if not callable(rule) and rule not in CONVERSIONS[family]:
+                raise ValueError(f"value_converters: unknown conversion '{rule}' for '{family}'")
+        self.mysql_settings = mysql_settings
+        self.rules = rules
+        self.lock = threading.Lock()
+        # (schema, table) -> convert function or None
+        self.converters = {}
+        self.compiled = 0
+
+    def _put(self, schema, table, families):
+        convert = compile_converter(f"{schema}.{table}", families, self.rules)
+        with self.lock:
+            self.converters[(schema, table)] = convert
+            self.compiled += 1
+        return convert
+
+    def load(self, cursor, pairs):
+        """Column types of all (schema, table) pairs by one information_schema query."""
+        self.put_types(fetch_column_types(cursor, pairs))
+
+    def put_types(self, column_types):
+        """{(schema, table): {column: DATA_TYPE}}, e.g. cached by table_metadata."""
+        for (schema, table), columns in column_types.items():
+            self._put(schema, table, {c: DATA_TYPE_FAMILIES.get(t.lower()) for c, t in columns.items()})
+
+    def get(self, schema, table, columns=None):
+        """
+        Converter of the table, columns - pymysqlreplication columns of the table-map event.
+        Without columns a table which isn't loaded is read from information_schema.
+        """
+        try:
+            return self.converters[(schema, table)]
+        except KeyError:
+            pass
+        if columns is not None:
+            return self._put(schema, table, {c.name: column_family(c) for c in columns})
+        conn = pymysql.connect(**self.mysql_settings)
+        try:
+            self.load(conn.cursor(), [(schema, table)])
+        finally:
+            conn.close()
+        return self.converters[(schema, table)]
+
+    def invalidate(self, schema, table):
+        with self.lock:
+            self.converters.pop((schema, table), None)
+
+    def statistic(self):
+        with self.lock:
+            return {
+                "tables": len(self.converters),
+                "converted_tables": sum(1 for c in self.converters.values() if c is not None),
+                "compiled": self.compiled,
+            }
@@ -0,0 +1,99 @@
+import asyncio
+
+
+def _settings(tmp_path):
+    return {
+        'db_name': 'shop',
+        'scan_tables': ['items'],
+        'init_tables': ['items'],
+        'handle_events_plugin': 'plugins_test.plugin_test',
+        'binlog_file': str(tmp_path / 'binlog.pos'),
+        'health_socket': str(tmp_path / 'health.sock'),
+        'clickhouse_max_batch_len': 100,
+        'clickhouse_dropdown_sleep': 0.1,
+        'full_regeneration_batch_len': 10,
+        'unique_consumer_server_id': 1,
+        'async_max_in_flight': 2,
+        'delivery_retries': 1,
+        'delivery_backoff': 0,
+    }
+
+
+def test_async_flush_dumps_packs_concurrently(tmp_path):
+    from src.async_engine import async_engine
+    from src.synch_storage import synch_buffer
+    from src.tools import binlog_file
+
+    engine = async_engine({}, _settings(tmp_path))
+    dumped = []
+    failures = [1]
+
+    async def dump_values(table_name, columns, values):
+        if failures:
+            failures.pop()
+            raise ConnectionError("sink is down")
+        await asyncio.sleep(0)
+        dumped.append((table_name, columns, values))
+
+    engine.plugin.dump_values = dump_values
+    engine.plugin.dump_columns = None
+
+    async def scenario():
+        engine.stop_event = asyncio.Event()
+        engine.semaphore = asyncio.Semaphore(engine.max_in_flight)
+        buffer = synch_buffer()
+        buffer.put_event('insert', 'items', {'id': 1, 'name': 'a', 'value': 1}, version=10)
+        buffer.put_event('update', 'items', {'before_values': None, 'after_values': {'id': 2, 'name': 'b', 'value': 2}}, version=11)
+        buffer.put_event('insert', 'other', {'id': 1}, version=12)
+        buffer.put_binlog(binlog_file(str(tmp_path / 'binlog.pos'), file='mysql-bin.000001', pos=100))
+        await engine._flush(buffer)
+
+    asyncio.run(scenario())
+
+    rows = sorted(v for _, _, values in dumped for v in values)
+    assert rows == [[1, 'a', 1, 10], [2, 'b', 2, 11]]
+    assert engine.flushed_rows == 2
+    saved = binlog_file(str(tmp_path / 'binlog.pos'))
+    assert saved.load() and saved.pos == 100
+
+
+def test_async_flush_initiates_dropdown_workers(tmp_path):
+    from src.async_engine import async_engine
+    from src.synch_storage import synch_buffer
+    from src.tools import binlog_file
+
+    engine = async_engine({}, _settings(tmp_path))
+    calls = []
+
+    async def initiate_dropdown_workers():
+        calls.append('initiate')
+
+    engine.plugin.initiate_dropdown_workers = initiate_dropdown_workers
+    engine.plugin.process_event = lambda event_type, table, event, **kwargs: calls.append(event_type) or []
+
+    async def scenario():
+        engine.stop_event = asyncio.Event()
+        engine.semaphore = asyncio.Semaphore(engine.max_in_flight)
+        engine.stage = 'SYNCH'
+        buffer = synch_buffer()
+        buffer.put_event('insert', 'other', {'id': 1}, version=10)
+        buffer.put_binlog(binlog_file(str(tmp_path / 'binlog.pos'), file='mysql-bin.000001', pos=100))
+        await engine._flush(buffer)
+        # a batch of a bare marker has no rows, the plugin isn't called
+        empty = synch_buffer()
+        empty.put_binlog(binlog_file(str(tmp_path / 'binlog.pos'), file='mysql-bin.000001', pos=200))
+        await engine._flush(empty)
+
+    asyncio.run(scenario())
+    assert calls == ['initiate', 'insert']
+
+
+def test_async_engine_rejects_unsupported_settings(tmp_path):
+    import pytest
+    from src.async_engine import async_engine
+
+    settings = dict(_settings(tmp_path), clickhouse_sink={'host': '127.0.0.1'}, spill_path=str(tmp_path))
+    with pytest.raises(ValueError, match="clickhouse_sink, spill_path"):
+        async_engine({}, settings)
+    # the default apply mode is accepted
+    async_engine({}, dict(_settings(tmp_path), apply_mode='batch'))
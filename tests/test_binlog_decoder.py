@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+
+def _rows_event(cls, rows, log_pos=500, event_size=100):
+    event = cls.__new__(cls)
+    event.schema, event.table, event.columns = 'shop', 'items', []
+    # rows are parsed from the packet on first access
+    event._RowsEvent__rows = rows
+    event.packet = SimpleNamespace(log_pos=log_pos)
+    event.event_size = event_size
+    return event
+
+
+def test_decoder_rows_and_commit(tmp_path):
+    from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent
+    from pymysqlreplication.event import XidEvent, MariadbGtidEvent
+    from src.binlog_decoder import binlog_decoder
+    from src.tools import binlog_file, binlog_version, table_filter
+
+    stream = SimpleNamespace(log_file='mysql-bin.000002', table_map={}, auto_position=None)
+    tables = table_filter({'db_name': 'shop', 'scan_tables': ['items']})
+    binlog = binlog_file(str(tmp_path / 'binlog.pos'), file='mysql-bin.000002', pos=4)
+    decoder = binlog_decoder(stream, binlog, tables, {'table_columns': {'items': ['id', 'value']}}, gtid_positioning=True)
+
+    gtid = MariadbGtidEvent.__new__(MariadbGtidEvent)
+    gtid.domain_id, gtid.gtid = 0, '0-1-7'
+    assert decoder.is_gtid(gtid)
+    decoder.begin(gtid)
+
+    insert = _rows_event(WriteRowsEvent, [{'values': {'id': 1, 'value': 2, 'wide': 'x'}}])
+    update = _rows_event(UpdateRowsEvent, [{'before_values': {'id': 1, 'value': 2}, 'after_values': {'id': 1, 'value': 3}}], log_pos=700)
+    assert decoder.is_scanned_rows(insert) and decoder.key(insert) == 'items' and decoder.domain() == 0
+    assert list(decoder.rows(insert)) == [('insert', {'id': 1, 'value': 2}, binlog_version('mysql-bin.000002', 400))]
+    # before images are dropped unless they are needed
+    assert list(decoder.rows(update))[0][1] == {'before_values': None, 'after_values': {'id': 1, 'value': 3}}
+
+    xid = XidEvent.__new__(XidEvent)
+    xid.packet = SimpleNamespace(log_pos=800)
+    committed = decoder.commit(xid)
+    assert (committed.file, committed.pos, committed.gtid_str()) == ('mysql-bin.000002', 800, '0-1-7')
+    assert stream.auto_position == '0-1-7' and decoder.domain() is None
+
+
+def test_decoder_keeps_before_values(tmp_path):
+    from pymysqlreplication.row_event import UpdateRowsEvent
+    from src.binlog_decoder import binlog_decoder
+    from src.tools import binlog_file, table_filter
+
+    stream = SimpleNamespace(log_file='mysql-bin.000002', table_map={}, auto_position=None)
+    tables = table_filter({'db_name': 'shop', 'scan_tables': ['items']})
+    binlog = binlog_file(str(tmp_path / 'binlog.pos'), file='mysql-bin.000002', pos=4)
+    # need_before_values of a plugin (or synch_compaction) keeps before images, projected like after images
+    decoder = binlog_decoder(stream, binlog, tables, {'table_columns': {'items': ['id', 'value']}}, keep_before=True)
+
+    update = _rows_event(UpdateRowsEvent, [{'before_values': {'id': 1, 'value': 2, 'wide': 'x'}, 'after_values': {'id': 1, 'value': 3, 'wide': 'y'}}])
+    assert list(decoder.rows(update))[0][1] == {'before_values': {'id': 1, 'value': 2}, 'after_values': {'id': 1, 'value': 3}}
+
+
+def test_decoder_gtid_versions(tmp_path):
+    from pymysqlreplication.row_event import WriteRowsEvent
+    from pymysqlreplication.event import MariadbGtidEvent
+    from src.binlog_decoder import binlog_decoder
+    from src.tools import binlog_file, gtid_version, table_filter, version_horizon
+
+    stream = SimpleNamespace(log_file='mysql-bin.000001', table_map={}, auto_position=None)
+    tables = table_filter({'db_name': 'shop', 'scan_tables': ['items']})
+    binlog = binlog_file(str(tmp_path / 'binlog.pos'), file='mysql-bin.000009', pos=4, gtid='0-1-41')
+    decoder = binlog_decoder(stream, binlog, tables, {'gtid_positioning': True}, gtid_positioning=True)
+
+    gtid = MariadbGtidEvent.__new__(MariadbGtidEvent)
+    gtid.domain_id, gtid.gtid = 0, '0-2-42'
+    decoder.begin(gtid)
+    first = _rows_event(WriteRowsEvent, [{'values': {'id': 1}}, {'values': {'id': 2}}])
+    second = _rows_event(WriteRowsEvent, [{'values': {'id': 3}}], log_pos=300)
+    # rows are numbered through the transaction, the binlog file of the new primary doesn't matter
+    versions = [v for _, _, v in decoder.rows(first)] + [v for _, _, v in decoder.rows(second)]
+    assert versions == [gtid_version(42, 0), gtid_version(42, 1), gtid_version(42, 2)]
+
+    horizon = version_horizon(binlog, gtid_versions=True)
+    assert horizon.version < versions[0]
+    assert horizon.before(gtid_version(41, 5), domain=0)
+    assert not horizon.before(versions[0], domain=0)
+    # a domain unknown at the position has nothing before it
+    assert not horizon.before(gtid_version(1), domain=1)
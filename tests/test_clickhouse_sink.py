@@ -0,0 +1,153 @@
+import pytest
+
+
+class fake_client:
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.inserts = []
+        self.closed = False
+
+    def insert(self, table, data, column_names, column_oriented, settings):
+        if self.failures:
+            self.failures.pop()
+            from clickhouse_connect.driver.exceptions import OperationalError
+            raise OperationalError("connection reset")
+        self.inserts.append((table, column_names, data, column_oriented, settings))
+
+    def close(self):
+        self.closed = True
+
+
+def test_sink_reuses_clients_and_retries():
+    from src.clickhouse_sink import clickhouse_sink
+
+    failures = [1]
+    clients = []
+
+    def new_client():
+        clients.append(fake_client(failures))
+        return clients[-1]
+
+    sink = clickhouse_sink({'pool_size': 2, 'retries': 5, 'retry_backoff': 0, 'async_insert': True})
+    sink._new_client = new_client
+
+    sink.dump_columns('items', ['id', 'value'], [[1, 2], [10, 20]])
+    sink.dump_values('items', ['id', 'value'], [[3, 30]])
+
+    # the failed client is replaced, the next one is reused
+    assert len(clients) == 2
+    assert clients[0].closed
+    assert len(clients[1].inserts) == 2
+    assert clients[1].inserts[0][3] is True
+    assert clients[1].inserts[0][4] == {'async_insert': 1, 'wait_for_async_insert': 1}
+    assert sink.statistic() == {"clients": 1, "inserts": 2, "rows": 3, "retries": 1, "errors": 0}
+
+    sink.close()
+    assert clients[1].closed
+
+
+def test_sink_doesnt_retry_data_errors():
+    from src.clickhouse_sink import clickhouse_sink
+
+    class bad_client(fake_client):
+        def insert(self, *args, **kwargs):
+            raise ValueError("bad data")
+
+    sink = clickhouse_sink({'retries': 5, 'retry_backoff': 0})
+    sink._new_client = lambda: bad_client([])
+    with pytest.raises(ValueError):
+        sink.dump_values('items', ['id'], [[1]])
+    assert sink.statistic()["retries"] == 0
+    assert sink.statistic()["errors"] == 1
+
+
+def test_sink_leaves_retries_to_delivery():
+    from src.clickhouse_sink import clickhouse_sink
+
+    failures = [1]
+    clients = []
+
+    def new_client():
+        clients.append(fake_client(failures))
+        return clients[-1]
+
+    # by default a failed insert is raised at once, delivery retries the whole pack
+    sink = clickhouse_sink({})
+    sink._new_client = new_client
+    from clickhouse_connect.driver.exceptions import OperationalError
+    with pytest.raises(OperationalError):
+        sink.dump_values('items', ['id'], [[1]])
+    assert sink.statistic()["retries"] == 0
+    assert clients[0].closed
+    sink.dump_values('items', ['id'], [[1]])
+    assert len(clients) == 2 and len(clients[1].inserts) == 1
+
+
+def test_sink_pool_wakes_waiters():
+    import threading
+    from clickhouse_connect.driver.exceptions import OperationalError
+    from src.clickhouse_sink import clickhouse_sink
+
+    started = threading.Event()
+    proceed = threading.Event()
+
+    class slow_failing_client(fake_client):
+        def insert(self, *args, **kwargs):
+            started.set()
+            proceed.wait(2)
+            raise OperationalError("connection reset")
+
+    clients = [slow_failing_client([]), fake_client([])]
+    sink = clickhouse_sink({'pool_size': 1, 'acquire_timeout': 5})
+    sink._new_client = lambda: clients.pop(0)
+
+    errors = []
+
+    def _failing():
+        try:
+            sink.dump_values('items', ['id'], [[1]])
+        except OperationalError as e:
+            errors.append(e)
+
+    first = threading.Thread(target=_failing)
+    first.start()
+    started.wait(2)
+    done = threading.Event()
+    second = threading.Thread(target=lambda: (sink.dump_values('items', ['id'], [[2]]), done.set()))
+    second.start()
+    # the waiter gets the place of the failed client
+    proceed.set()
+    first.join(2)
+    second.join(2)
+    assert errors and done.is_set()
+    assert sink.statistic()['clients'] == 1
+
+
+def test_sink_pool_timeout_and_close():
+    import threading
+    from src.clickhouse_sink import clickhouse_sink
+
+    sink = clickhouse_sink({'pool_size': 1, 'acquire_timeout': 0.1})
+    sink._new_client = lambda: fake_client([])
+    busy = sink._acquire()
+    with pytest.raises(TimeoutError):
+        sink._acquire()
+
+    sink.acquire_timeout = 5
+    errors = []
+
+    def _wait():
+        try:
+            sink._acquire()
+        except RuntimeError as e:
+            errors.append(e)
+
+    waiter = threading.Thread(target=_wait)
+    waiter.start()
+    sink.close()
+    waiter.join(1)
+    # close wakes the waiter, a client returned after close is closed
+    assert errors and not waiter.is_alive()
+    sink._release(busy)
+    assert busy.closed and sink.statistic()['clients'] == 0
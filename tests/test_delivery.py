@@ -0,0 +1,75 @@
+import pytest
+
+
+def test_delivery_retries_failed_pack():
+    from src.delivery import delivery
+
+    calls = []
+
+    def dump(table, columns, values, batch_id=None):
+        calls.append(batch_id)
+        if len(calls) < 3:
+            raise ConnectionError("sink is down")
+
+    d = delivery(retries=3, backoff=0, breaker_threshold=10)
+    d.deliver(dump, 'items', ['id'], [[1]], batch_id='b1')
+    assert calls == ['b1', 'b1', 'b1']
+    assert d.statistic() == {"delivered": 1, "retries": 2, "failed": 0, "breaker_open": False, "breaker_opened": 0}
+
+    d = delivery(retries=1, backoff=0)
+    with pytest.raises(ValueError):
+        d.deliver(lambda: (_ for _ in ()).throw(ValueError("bad")))
+    assert d.statistic()["failed"] == 1
+
+
+def test_delivery_circuit_breaker():
+    from src.delivery import delivery
+
+    failures = [1, 1]
+
+    def dump():
+        if failures:
+            failures.pop()
+            raise ConnectionError("sink is down")
+
+    d = delivery(retries=5, backoff=0, breaker_threshold=2, breaker_cooldown=0.05)
+    d.deliver(dump)
+    statistic = d.statistic()
+    assert statistic["breaker_opened"] == 1
+    assert statistic["breaker_open"] is False
+    assert statistic["delivered"] == 1
+
+
+def test_delivery_stops_waiting():
+    from src.delivery import delivery, delivery_stopped
+
+    def dump():
+        raise ConnectionError("sink is down")
+
+    d = delivery(retries=100, backoff=10, is_stopped=lambda: True)
+    with pytest.raises(delivery_stopped):
+        d.deliver(dump)
+
+
+def test_batch_id_deterministic(tmp_path):
+    from src.delivery import batch_id, buffer_origin
+    from src.synch_storage import synch_buffer
+    from src.tools import binlog_file
+
+    def buffer(pos):
+        b = synch_buffer()
+        if pos is not None:
+            b.put_binlog(binlog_file(str(tmp_path / 'binlog.pos'), file='mysql-bin.000001', pos=pos))
+        return b
+
+    origin = buffer_origin(buffer(100))
+    assert origin == buffer_origin(buffer(100))
+    assert batch_id(origin, 0, 'items', ['id'], [[1], [2]]) == batch_id(origin, 0, 'items', ('id',), [[1], [2]])
+    assert batch_id(origin, 0, 'items', ['id'], [[1], [2]]) != batch_id(origin, 0, 'items', ['id'], [[1], [3]])
+    # x=1, x=2, x=1 again in a later buffer: the third pack isn't a duplicate of the first one
+    later = buffer_origin(buffer(300))
+    assert batch_id(origin, 0, 'items', ['id', 'x'], [[1, 1]]) != batch_id(later, 0, 'items', ['id', 'x'], [[1, 1]])
+    assert batch_id(origin, 0, 'items', ['id'], [[1]]) != batch_id(origin, 1, 'items', ['id'], [[1]])
+    # buffers without an own marker get origins unique to the run
+    assert buffer_origin(buffer(None)) != buffer_origin(buffer(None))
+    assert buffer_origin(buffer(300), previous=later) != later
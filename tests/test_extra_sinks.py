@@ -0,0 +1,116 @@
+def test_router_fans_out_to_extra_sinks(tmp_path, monkeypatch):
+    from src import engine
+    from src.tools import binlog_file, binlog_version
+    from src.synch_storage import synch_storage
+
+    settings = {
+        'handle_events_plugin': 'plugins_test.plugin_test',
+        'binlog_file': str(tmp_path / 'main.pos'),
+    }
+    main = engine.sink_context(engine.DEFAULT_SINK, settings)
+    search = engine.sink_context('search', dict(settings, binlog_file=str(tmp_path / 'search.pos')))
+    main_pipeline = engine.flush_pipeline(engine.DEFAULT_PIPELINE, synch_storage(100))
+    search.pipeline = engine.flush_pipeline('sink-search', synch_storage(100), context=search)
+
+    monkeypatch.setattr(engine, 'SINKS', {engine.DEFAULT_SINK: main, 'search': search})
+    monkeypatch.setattr(engine, 'EXTRA_SINKS', [search])
+    monkeypatch.setattr(engine, 'PIPELINES', {engine.DEFAULT_PIPELINE: main_pipeline})
+
+    # the main sink is ahead of the search one
+    main.set_start(binlog_file(settings['binlog_file'], file='mysql-bin.000001', pos=500))
+    search.set_start(binlog_file(settings['binlog_file'], file='mysql-bin.000001', pos=200))
+
+    router = engine.event_router({})
+    event = {'id': 1, 'value': 1}
+    router.put_event('insert', 'items', event, version=binlog_version('mysql-bin.000001', 300))
+    router.put_binlog(binlog_file(settings['binlog_file'], file='mysql-bin.000001', pos=400))
+    router.put_event('insert', 'items', {'id': 2, 'value': 2}, version=binlog_version('mysql-bin.000001', 600))
+    router.put_binlog(binlog_file(settings['binlog_file'], file='mysql-bin.000001', pos=700))
+
+    assert main_pipeline.storage.len() == 1
+    assert search.pipeline.storage.len() == 2
+
+    # the extra sink has its own copy of the row
+    search_buffer = search.pipeline.storage.get_buffer(expecting_binlog=True)
+    assert search_buffer.insert['items'][1].event == event
+    assert search_buffer.insert['items'][1].event is not event
+    assert search_buffer.binlog.pos == 700
+
+    # checkpoint of the extra sink goes to its own file
+    engine.save_binlog_position(search_buffer.binlog, search.pipeline)
+    saved = binlog_file(str(tmp_path / 'search.pos'))
+    assert saved.load() and saved.pos == 700
+    assert not binlog_file(settings['binlog_file']).load()
+
+
+def test_router_compares_gtid_after_switchover(tmp_path, monkeypatch):
+    from src import engine
+    from src.tools import binlog_file, gtid_version
+    from src.synch_storage import synch_storage
+
+    settings = {
+        'handle_events_plugin': 'plugins_test.plugin_test',
+        'binlog_file': str(tmp_path / 'main.pos'),
+    }
+    main = engine.sink_context(engine.DEFAULT_SINK, settings)
+    search = engine.sink_context('search', dict(settings, binlog_file=str(tmp_path / 'search.pos')))
+    main_pipeline = engine.flush_pipeline(engine.DEFAULT_PIPELINE, synch_storage(100))
+    search.pipeline = engine.flush_pipeline('sink-search', synch_storage(100), context=search)
+    monkeypatch.setattr(engine, 'SINKS', {engine.DEFAULT_SINK: main, 'search': search})
+    monkeypatch.setattr(engine, 'PIPELINES', {engine.DEFAULT_PIPELINE: main_pipeline})
+    monkeypatch.setattr(engine, 'GTID_POSITIONING', True)
+    router = engine.event_router({})
+
+    # one sink: nothing is filtered even if the file/pos of a new primary looks older
+    monkeypatch.setattr(engine, 'EXTRA_SINKS', [])
+    main.set_start(binlog_file(settings['binlog_file'], file='mysql-bin.000090', pos=500, gtid='0-1-100'))
+    router.put_event('insert', 'items', {'id': 1}, domain=0, version=gtid_version(101))
+    assert main_pipeline.storage.len() == 1
+
+    # the checkpoints were saved on the old primary with bigger file numbers
+    monkeypatch.setattr(engine, 'EXTRA_SINKS', [search])
+    search.set_start(binlog_file(settings['binlog_file'], file='mysql-bin.000090', pos=300, gtid='0-1-98'))
+    router.put_event('insert', 'items', {'id': 2}, domain=0, version=gtid_version(99))
+    router.put_event('insert', 'items', {'id': 3}, domain=0, version=gtid_version(102))
+    router.put_binlog(binlog_file(settings['binlog_file'], file='mysql-bin.000002', pos=100, gtid='0-2-102'))
+    assert main_pipeline.storage.len() == 2 and search.pipeline.storage.len() == 2
+    assert main_pipeline.storage.buffer.binlog.gtid_str() == '0-2-102'
+
+    # the reader starts from the lowest seq_no of the domain
+    oldest = engine.oldest_position(settings, [main.start_binlog, search.start_binlog])
+    assert oldest.gtid_str() == '0-1-98'
+
+
+def test_full_regeneration_of_new_sink_only(tmp_path, monkeypatch):
+    from src import engine
+    from src.tools import binlog_file, binlog_version
+    from src.synch_storage import synch_storage
+
+    settings = {
+        'handle_events_plugin': 'plugins_test.plugin_test',
+        'binlog_file': str(tmp_path / 'main.pos'),
+    }
+    main = engine.sink_context(engine.DEFAULT_SINK, settings)
+    search = engine.sink_context('search', dict(settings, binlog_file=str(tmp_path / 'search.pos')))
+    main_pipeline = engine.flush_pipeline(engine.DEFAULT_PIPELINE, synch_storage(100))
+    search.pipeline = engine.flush_pipeline('sink-search', synch_storage(100), context=search)
+    monkeypatch.setattr(engine, 'SINKS', {engine.DEFAULT_SINK: main, 'search': search})
+    monkeypatch.setattr(engine, 'EXTRA_SINKS', [search])
+    monkeypatch.setattr(engine, 'PIPELINES', {engine.DEFAULT_PIPELINE: main_pipeline})
+    monkeypatch.setattr(engine, 'STAGE', engine.Stage.REGENERATION)
+
+    # the main sink has its checkpoint, only the new search sink is regenerated
+    main.regenerates = False
+    assert engine.regeneration_pipelines() == [search.pipeline]
+    router = engine.event_router({})
+    router.put_event('insert', 'items', {'id': 1, 'value': 1}, version=binlog_version('mysql-bin.000001', 500) - 1)
+    assert main_pipeline.storage.len() == 0
+    assert search.pipeline.storage.len() == 1
+
+    # the binlog stream after the regeneration goes to both sinks from their own positions
+    monkeypatch.setattr(engine, 'STAGE', engine.Stage.SYNCH)
+    main.set_start(binlog_file(settings['binlog_file'], file='mysql-bin.000001', pos=200))
+    search.set_start(binlog_file(settings['binlog_file'], file='mysql-bin.000001', pos=500))
+    router.put_event('insert', 'items', {'id': 2, 'value': 2}, version=binlog_version('mysql-bin.000001', 300))
+    assert main_pipeline.storage.len() == 1
+    assert search.pipeline.storage.len() == 1
@@ -0,0 +1,146 @@
+import threading
+import time
+
+
+def _binlog(pos):
+    from src.tools import binlog_file
+    return binlog_file(file_path='/var/tmp/1', file='mysql-bin.000001', pos=pos)
+
+
+def _make_scheduler(apply, commits, errors):
+    from src.group_scheduler import group_commit_scheduler
+    return group_commit_scheduler(
+        apply=apply,
+        on_commit=lambda binlog: commits.append(binlog.pos),
+        on_error=errors.append,
+        threads_count=4,
+        batch_len=1,
+        max_in_flight=8,
+        interval=60,
+    )
+
+
+def test_group_commit_keeps_groups_and_order():
+    applied = []
+    lock = threading.Lock()
+    release_first = threading.Event()
+
+    def _apply(buffer):
+        ids = sorted(buffer.insert.get('items', {}).keys()) + sorted(buffer.update.get('items', {}).keys())
+        if ids == [1, 2]:
+            release_first.wait(2)
+        with lock:
+            applied.append(ids)
+
+    commits = []
+    errors = []
+    scheduler = _make_scheduler(_apply, commits, errors)
+    scheduler.start()
+
+    # group 10: two transactions, committed together
+    scheduler.begin_transaction(10)
+    scheduler.put_event('insert', 'items', {'id': 1})
+    scheduler.put_binlog(_binlog(100))
+    scheduler.begin_transaction(10)
+    scheduler.put_event('insert', 'items', {'id': 2})
+    scheduler.put_binlog(_binlog(200))
+
+    # independent group: may run while the first is still applying
+    scheduler.begin_transaction(11)
+    scheduler.put_event('insert', 'items', {'id': 3})
+    scheduler.put_binlog(_binlog(300))
+
+    # dependent group: waits for the first one
+    scheduler.begin_transaction(12)
+    scheduler.put_event('update', 'items', {'before_values': None, 'after_values': {'id': 1}})
+    scheduler.put_binlog(_binlog(400))
+    scheduler.begin_transaction(None)
+
+    time.sleep(0.3)
+    assert applied == [[3]]
+    # checkpoint can't pass the unfinished first unit
+    assert commits == []
+
+    release_first.set()
+    scheduler.stop()
+
+    assert applied == [[3], [1, 2], [1]]
+    assert commits[-1] == 400
+    assert not errors
+    assert scheduler.statistic()['dependent_units'] == 1
+    assert scheduler.statistic()['groups'] == 3
+
+
+def test_group_commit_error_stops_checkpoint():
+    def _apply(buffer):
+        raise RuntimeError("sink is down")
+
+    commits = []
+    errors = []
+    scheduler = _make_scheduler(_apply, commits, errors)
+
+    scheduler.begin_transaction(None)
+    scheduler.put_event('insert', 'items', {'id': 1})
+    scheduler.put_binlog(_binlog(100))
+    scheduler.begin_transaction(None)
+    scheduler.stop()
+
+    assert commits == []
+    assert len(errors) == 1
+
+
+def test_group_commit_saves_outside_lock():
+    from src.group_scheduler import group_commit_scheduler
+
+    commits = []
+    errors = []
+
+    def _on_commit(binlog):
+        # the reader may seal units while the checkpoint file is written
+        assert scheduler.lock.acquire(timeout=1)
+        scheduler.lock.release()
+        commits.append(binlog.pos)
+
+    scheduler = group_commit_scheduler(
+        apply=lambda buffer: None,
+        on_commit=_on_commit,
+        on_error=errors.append,
+        threads_count=4,
+        batch_len=1,
+        max_in_flight=8,
+        interval=60,
+    )
+    scheduler.start()
+    for i in range(20):
+        scheduler.begin_transaction(i)
+        scheduler.put_event('insert', 'items', {'id': i})
+        scheduler.put_binlog(_binlog(100 + i))
+    scheduler.begin_transaction(None)
+    scheduler.stop()
+
+    assert not errors
+    # positions are saved in order, never older than the previous one
+    assert commits == sorted(commits) and commits[-1] == 119
+
+
+def test_apply_buffer_initiates_dropdown_workers(tmp_path, monkeypatch):
+    from src import engine
+    from src.synch_storage import synch_buffer
+    from src.tools import table_filter
+
+    settings = {'handle_events_plugin': 'plugins_test.plugin_test', 'binlog_file': str(tmp_path / 'main.pos')}
+    context = engine.sink_context(engine.DEFAULT_SINK, settings)
+    monkeypatch.setattr(engine, 'SINKS', {engine.DEFAULT_SINK: context})
+    monkeypatch.setattr(engine, 'TABLES', table_filter({'db_name': 'db', 'scan_tables': ['items']}))
+    monkeypatch.setattr(engine, 'COMPACT_ROWS', False)
+    monkeypatch.setattr(engine, 'STOP', False)
+    calls = []
+    monkeypatch.setattr(context.plugin, 'initiate_dropdown_workers', lambda: calls.append('initiate'))
+    monkeypatch.setattr(context.plugin, 'process_event', lambda event_type, table, event, **kwargs: calls.append(event_type) or [])
+
+    buffer = synch_buffer()
+    buffer.put_event('insert', 'items', {'id': 1})
+    monkeypatch.setattr(engine, 'STAGE', engine.Stage.SYNCH)
+    engine.apply_buffer(buffer)
+    # the plugin is prepared before the rows of the block, as in the batch mode
+    assert calls == ['initiate', 'insert']
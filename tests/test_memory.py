@@ -0,0 +1,27 @@
+def test_memory_command(monkeypatch):
+    from src import engine
+    from src.synch_storage import synch_storage
+
+    pipeline = engine.flush_pipeline(engine.DEFAULT_PIPELINE, synch_storage(100))
+    monkeypatch.setattr(engine, 'PIPELINES', {engine.DEFAULT_PIPELINE: pipeline})
+    monkeypatch.setattr(engine, 'EXTRA_SINKS', [])
+    pipeline.storage.put_event('insert', 'items', {'id': 1, 'value': 'x' * 100})
+    pipeline.insert_storage.push('items', ['id'], [1])
+
+    memory = engine.command_memory({}, {}, [])['memory']
+    stat = memory['pipelines'][engine.DEFAULT_PIPELINE]
+    assert stat['storage_events'] == 1 and stat['storage_bytes'] > 100
+    assert stat['insert_buffer_rows'] == 1
+    assert memory['total_bytes'] >= stat['storage_bytes']
+    assert memory['binlog_table_map'] == {'tables': 0, 'columns': 0}
+
+    engine.command_memory({}, {}, ['trace'])
+    try:
+        kept = [bytearray(1000) for _ in range(100)]
+        diff = engine.command_memory({}, {}, ['diff', '5'])['tracemalloc']
+        assert len(diff['top']) <= 5
+        assert any('test_memory.py' in site for item in diff['top'] for site in item['site'])
+        assert kept
+    finally:
+        engine.command_memory({}, {}, ['stop'])
+    assert not engine.TRACEMALLOC.is_tracing()
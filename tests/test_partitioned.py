@@ -0,0 +1,59 @@
+import threading
+import time
+
+
+def _binlog(pos):
+    from src.tools import binlog_file
+    return binlog_file(file_path='/var/tmp/1', file='mysql-bin.000001', pos=pos)
+
+
+def test_partitioned_per_key_order_and_low_water():
+    from src.partitioned import partitioned_applier
+
+    applied = []
+    lock = threading.Lock()
+    slow = threading.Event()
+    commits = []
+    errors = []
+
+    def _apply(buffer):
+        for table, items in list(buffer.insert.items()) + list(buffer.update.items()):
+            for id, item in items.items():
+                if id == 1 and not slow.is_set():
+                    slow.wait(2)
+                with lock:
+                    applied.append((id, item.event_type))
+
+    applier = partitioned_applier(
+        apply=_apply,
+        on_commit=lambda binlog: commits.append(binlog.pos),
+        on_error=errors.append,
+        partitions_count=4,
+        micro_batch_len=1,
+        flush_interval=0.01,
+        commit_interval=0.05,
+        max_queue_len=100,
+    )
+    applier.start()
+
+    applier.put_event('insert', 'items', {'id': 1})
+    applier.put_binlog(_binlog(100))
+    applier.put_event('update', 'items', {'before_values': None, 'after_values': {'id': 1}})
+    applier.put_binlog(_binlog(200))
+    for i in range(2, 20):
+        applier.put_event('insert', 'items', {'id': i})
+        applier.put_binlog(_binlog(200 + i))
+
+    time.sleep(0.3)
+    # the slow key holds the checkpoint, other keys are already applied
+    assert commits == []
+    assert len(applied) >= 5
+
+    slow.set()
+    time.sleep(0.3)
+    applier.stop()
+
+    key_1 = [event_type for id, event_type in applied if id == 1]
+    assert key_1 == ['insert', 'update']
+    assert commits[-1] == 219
+    assert not errors
@@ -0,0 +1,44 @@
+import threading
+
+
+def test_sampling_profiler(tmp_path):
+    from src.profiler import sampling_profiler
+
+    stop = threading.Event()
+
+    def busy_loop():
+        while not stop.is_set():
+            sum(range(1000))
+
+    busy = threading.Thread(target=busy_loop, name="busy", daemon=True)
+    busy.start()
+    path = str(tmp_path / 'profile.collapsed')
+    profiler = sampling_profiler(0.3, 0.01, path)
+    profiler.start()
+    profiler.thread.join()
+    stop.set()
+
+    assert not profiler.is_running() and profiler.samples > 0
+    lines = open(path).read().splitlines()
+    busy_lines = [line for line in lines if line.startswith("busy;")]
+    assert busy_lines and any("busy_loop (test_profiler.py" in line for line in busy_lines)
+    # the sampling thread doesn't profile itself
+    assert not any(line.startswith("profiler;") for line in lines)
+    stack, count = busy_lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+
+
+def test_profile_command_takes_file_name(tmp_path, monkeypatch):
+    import pytest
+    from src import engine
+
+    monkeypatch.setattr(engine, 'PROFILER', None)
+    settings = {'binlog_file': str(tmp_path / 'main.pos'), 'profile_dir': str(tmp_path / 'profiles')}
+    for name in ('/tmp/x.collapsed', '../x.collapsed', 'a/b.collapsed', '..'):
+        with pytest.raises(ValueError):
+            engine.command_profile({}, settings, ['0.1', '100', name])
+
+    (tmp_path / 'profiles').mkdir()
+    engine.command_profile({}, settings, ['0.1', '100', 'x.collapsed'])
+    engine.PROFILER.thread.join()
+    assert (tmp_path / 'profiles' / 'x.collapsed').exists()
@@ -0,0 +1,36 @@
+import pickle
+
+
+def test_compact_row_mapping_interface():
+    from src.rows import compact_row, intern_schema
+
+    row = compact_row.from_dict({'id': 1, 'name': 'a', 'blob': b'x'}, ['id', 'name'])
+    other = compact_row.from_dict({'id': 2, 'name': 'b'})
+    assert row.schema is other.schema is intern_schema(('id', 'name'))
+    assert row['id'] == 1 and row.get('blob') is None and 'name' in row
+    assert list(row.keys()) == ['id', 'name']
+    assert dict(row) == {'id': 1, 'name': 'a'}
+    assert row == {'id': 1, 'name': 'a'}
+    assert row != other
+
+    restored = pickle.loads(pickle.dumps(row))
+    assert restored == row and restored.schema is row.schema
+
+
+def test_compact_rows_in_buffer():
+    from src.rows import compact_row, materialize_event
+    from src.synch_storage import synch_buffer, estimate_event_size
+
+    data = {'id': 1, 'name': 'name', 'value': 10, 'price': 1.5, 'deleted': 0}
+    row = compact_row.from_dict(data)
+    assert estimate_event_size(row) < estimate_event_size(data)
+
+    buffer = synch_buffer(compaction=True)
+    buffer.put_event('update', 'items', {'before_values': row, 'after_values': compact_row.from_dict(data)})
+    # no-op update is found on compact rows as well
+    assert buffer.len() == 0
+    buffer.put_event('update', 'items', {'before_values': row, 'after_values': compact_row.from_dict(dict(data, value=11))})
+    item = buffer.get_event()
+    event = materialize_event(item.event_type, item.event)
+    assert event['after_values'] == dict(data, value=11)
+    assert type(event['after_values']) is dict
@@ -0,0 +1,91 @@
+import os
+
+
+def _binlog(file, pos):
+    from src.tools import binlog_file
+    return binlog_file(file_path='/var/tmp/1', file=file, pos=pos)
+
+
+def test_spill_queue_put_get(tmp_path):
+    from src.spill_queue import spill_queue
+
+    queue = spill_queue(str(tmp_path), segment_bytes=256)
+    for i in range(20):
+        queue.put_event('insert', 'items', {'id': i, 'name': f'name_{i}'})
+        queue.put_binlog(_binlog('mysql-bin.000001', 100 + i))
+
+    records = []
+    while True:
+        record = queue.get(timeout=0)
+        if record is None:
+            break
+        records.append(record)
+
+    assert len(records) == 40
+    assert records[0] == ('event', 'insert', 'items', {'id': 0, 'name': 'name_0'}, None, None)
+    assert records[-1] == ('binlog', 'mysql-bin.000001', 119, '')
+    assert queue.statistic()['segments'] > 1
+
+    queue.commit(_binlog('mysql-bin.000001', 119))
+    assert queue.statistic()['segments'] == 1
+    queue.close()
+
+
+def test_spill_queue_recover(tmp_path):
+    from src.spill_queue import spill_queue
+
+    queue = spill_queue(str(tmp_path), segment_bytes=1024 * 1024)
+    queue.put_event('insert', 'items', {'id': 1})
+    queue.put_binlog(_binlog('mysql-bin.000001', 100))
+    queue.put_event('insert', 'items', {'id': 2})
+    queue.put_binlog(_binlog('mysql-bin.000001', 200))
+    # unfinished transaction
+    queue.put_event('insert', 'items', {'id': 3})
+
+    assert queue.get(timeout=0)[0] == 'event'
+    assert queue.get(timeout=0)[0] == 'binlog'
+    queue.commit(_binlog('mysql-bin.000001', 100))
+    queue.close()
+
+    # torn write at the end of the segment
+    with open(os.path.join(str(tmp_path), '000000000000.seg'), 'ab') as f:
+        f.write(b'\x10\x00')
+
+    queue = spill_queue(str(tmp_path), segment_bytes=1024 * 1024)
+    assert queue.last_binlog == ('mysql-bin.000001', 200)
+    assert queue.get(timeout=0) == ('event', 'insert', 'items', {'id': 2}, None, None)
+    assert queue.get(timeout=0) == ('binlog', 'mysql-bin.000001', 200, '')
+    assert queue.get(timeout=0) is None
+    queue.close()
+
+
+def test_spill_queue_reads_active_segment_by_one_handle(tmp_path):
+    from src.spill_queue import spill_queue
+
+    queue = spill_queue(str(tmp_path), segment_bytes=1024)
+    queue.put_binlog(_binlog('mysql-bin.000001', 100))
+    assert queue.get(timeout=0)[0] == 'binlog'
+    handle = queue.read_file
+
+    # the writer appends to the segment the reader is on: the same handle sees new records
+    for i in range(3):
+        queue.put_event('insert', 'items', {'id': i})
+        queue.put_binlog(_binlog('mysql-bin.000001', 200 + i))
+        assert queue.get(timeout=0) == ('event', 'insert', 'items', {'id': i}, None, None)
+        assert queue.get(timeout=0)[0] == 'binlog'
+    assert queue.read_file is handle
+
+    # rotation: the sealed segment is read from its map, the new active one gets its own handle
+    while queue.write_segment == 0:
+        queue.put_event('insert', 'items', {'id': 100, 'name': 'x' * 100})
+    queue.put_binlog(_binlog('mysql-bin.000001', 300))
+    records = []
+    while True:
+        record = queue.get(timeout=0)
+        if record is None:
+            break
+        records.append(record)
+    assert records[-1] == ('binlog', 'mysql-bin.000001', 300, '')
+    assert queue.read_file is not handle and queue.read_file_segment == 1
+    queue.close()
+    assert queue.read_file is None
@@ -0,0 +1,239 @@
+import threading
+import time
+
+
+def test_storage_tracks_bytes():
+    from src.synch_storage import synch_storage, estimate_event_size
+
+    storage = synch_storage(max_len=100)
+    event = {'id': 1, 'name': 'x' * 1000, 'value': 1}
+    storage.put_event('insert', 'items', event)
+
+    stat = storage.memory_statistic()
+    assert stat['events'] == 1
+    assert stat['bytes'] == estimate_event_size(event)
+    assert stat['bytes'] > 1000
+
+    buffer = storage.get_buffer(expecting_binlog=False)
+    stat = storage.memory_statistic()
+    assert stat['bytes'] == 0
+    assert stat['inflight_bytes'] == buffer.bytes
+
+    storage.release(buffer)
+    stat = storage.memory_statistic()
+    assert stat['inflight_bytes'] == 0
+    assert stat['bytes_high_water'] == estimate_event_size(event)
+
+
+def test_storage_memory_backpressure():
+    from src.synch_storage import synch_storage
+
+    storage = synch_storage(max_len=100, max_bytes=2000)
+    storage.put_event('insert', 'items', {'id': 1, 'name': 'x' * 3000})
+
+    done = threading.Event()
+
+    def _put():
+        storage.put_event('insert', 'items', {'id': 2, 'name': 'y'})
+        done.set()
+
+    t = threading.Thread(target=_put)
+    t.start()
+    time.sleep(0.2)
+    assert not done.is_set()
+
+    # swapped buffer still holds memory until it's released
+    buffer = storage.get_buffer(expecting_binlog=False)
+    time.sleep(0.2)
+    assert not done.is_set()
+
+    storage.release(buffer)
+    t.join(1)
+    assert done.is_set()
+
+
+def test_insert_buffer_bytes():
+    from src.tools import insert_buffer
+
+    buffer = insert_buffer()
+    buffer.push('items', ['id', 'name'], [1, 'x' * 100])
+    buffer.push('items', ['id', 'name'], [2, 'y' * 100])
+    assert buffer.memory_statistic()['bytes'] > 200
+
+    pack = buffer.get_similar_pack_clear()
+    assert len(pack) == 2
+    stat = buffer.memory_statistic()
+    assert stat['bytes'] == 0
+    assert stat['bytes_high_water'] > 200
+
+
+def test_storage_large_transaction_chunks():
+    from src.synch_storage import synch_storage
+    from src.tools import binlog_file
+
+    storage = synch_storage(max_len=2)
+    storage.put_event('insert', 'items', {'id': 1})
+    storage.put_event('insert', 'items', {'id': 2})
+    # no commit yet - nothing to swap
+    assert storage.get_buffer(expecting_binlog=True) is None
+
+    storage = synch_storage(max_len=2, allow_partial=True)
+    storage.put_event('insert', 'items', {'id': 1})
+    assert storage.get_buffer(expecting_binlog=True) is None
+    storage.put_event('insert', 'items', {'id': 2})
+
+    storage.wait_full(10, expecting_binlog=True)
+    chunk = storage.get_buffer(expecting_binlog=True)
+    assert chunk.partial
+    assert chunk.binlog is None
+    assert chunk.len() == 2
+
+    storage.put_event('insert', 'items', {'id': 3})
+    storage.put_binlog(binlog_file(file_path='/var/tmp/1', file='mysql-bin.000001', pos=100))
+    commit = storage.get_buffer(expecting_binlog=True)
+    assert not commit.partial
+    assert commit.binlog.pos == 100
+    assert storage.memory_statistic()['partial_chunks'] == 1
+
+
+def test_buffer_compaction():
+    from src.synch_storage import synch_buffer
+
+    buffer = synch_buffer(compaction=True)
+
+    # insert + delete
+    buffer.put_insert('items', {'id': 1, 'value': 1})
+    buffer.put_delete('items', {'values': {'id': 1, 'value': 1}})
+
+    # insert + update -> insert with the final image
+    buffer.put_insert('items', {'id': 2, 'value': 1})
+    buffer.put_update('items', {'before_values': {'id': 2, 'value': 1}, 'after_values': {'id': 2, 'value': 2}})
+
+    # no-op update
+    buffer.put_update('items', {'before_values': {'id': 3, 'value': 1}, 'after_values': {'id': 3, 'value': 1}})
+
+    # update chain returning to the original row
+    buffer.put_update('items', {'before_values': {'id': 4, 'value': 1}, 'after_values': {'id': 4, 'value': 2}})
+    buffer.put_update('items', {'before_values': {'id': 4, 'value': 2}, 'after_values': {'id': 4, 'value': 1}})
+
+    # update chain
+    buffer.put_update('items', {'before_values': {'id': 5, 'value': 1}, 'after_values': {'id': 5, 'value': 2}})
+    buffer.put_update('items', {'before_values': {'id': 5, 'value': 2}, 'after_values': {'id': 5, 'value': 3}})
+
+    assert buffer.len() == 2
+    assert buffer.insert['items'][2].event == {'id': 2, 'value': 2}
+    assert buffer.update['items'][5].event == {
+        'before_values': {'id': 5, 'value': 1},
+        'after_values': {'id': 5, 'value': 3},
+    }
+    assert buffer.compaction_statistic == {'insert_delete': 1, 'noop_update': 2, 'merged': 3}
+
+
+def test_buffer_without_compaction():
+    from src.synch_storage import synch_buffer
+
+    buffer = synch_buffer()
+    buffer.put_insert('items', {'id': 1, 'value': 1})
+    buffer.put_delete('items', {'values': {'id': 1, 'value': 1}})
+    buffer.put_update('items', {'before_values': {'id': 3, 'value': 1}, 'after_values': {'id': 3, 'value': 1}})
+    assert buffer.len() == 2
+
+
+def test_buffer_compaction_keeps_last_version():
+    from src.synch_storage import synch_buffer
+
+    buffer = synch_buffer(compaction=True)
+    buffer.put_event('insert', 'items', {'id': 1, 'value': 1}, version=10)
+    buffer.put_event('update', 'items', {'before_values': {'id': 1, 'value': 1}, 'after_values': {'id': 1, 'value': 2}}, version=11)
+    buffer.put_event('update', 'items', {'before_values': {'id': 2, 'value': 1}, 'after_values': {'id': 2, 'value': 2}}, version=12)
+    buffer.put_event('update', 'items', {'before_values': {'id': 2, 'value': 2}, 'after_values': {'id': 2, 'value': 3}}, version=13)
+
+    assert buffer.insert['items'][1].version == 11
+    assert buffer.insert['items'][1].event == {'id': 1, 'value': 2}
+    assert buffer.update['items'][2].version == 13
+
+
+def test_buffer_compaction_keeps_replaced_delete():
+    from src.synch_storage import synch_buffer
+
+    # the sink has the row: delete + insert + delete must still delete it
+    buffer = synch_buffer(compaction=True)
+    buffer.put_delete('items', {'values': {'id': 1, 'value': 1}}, version=10)
+    buffer.put_insert('items', {'id': 1, 'value': 2}, version=11)
+    buffer.put_delete('items', {'values': {'id': 1, 'value': 2}}, version=12)
+
+    assert buffer.len() == 1
+    assert buffer.delete['items'][1].version == 12
+    assert buffer.compaction_statistic == {'insert_delete': 0, 'noop_update': 0, 'merged': 2}
+
+    # the same through an update of the replacing insert
+    buffer = synch_buffer(compaction=True)
+    buffer.put_delete('items', {'values': {'id': 1, 'value': 1}})
+    buffer.put_insert('items', {'id': 1, 'value': 2})
+    buffer.put_update('items', {'before_values': {'id': 1, 'value': 2}, 'after_values': {'id': 1, 'value': 3}})
+    buffer.put_delete('items', {'values': {'id': 1, 'value': 3}})
+    assert list(buffer.delete['items']) == [1] and buffer.len() == 1
+
+
+def test_storage_bytes_of_replaced_rows():
+    from src.synch_storage import synch_storage, estimate_event_size
+
+    storage = synch_storage(max_len=100)
+    for i in range(10):
+        storage.put_event('insert', 'items', {'id': 1, 'name': 'x' * 1000})
+    assert storage.memory_statistic()['bytes'] == estimate_event_size({'id': 1, 'name': 'x' * 1000})
+    storage.put_event('delete', 'items', {'values': {'id': 1}})
+    assert storage.memory_statistic()['bytes'] == estimate_event_size({'values': {'id': 1}})
+
+    storage = synch_storage(max_len=100, compaction=True)
+    storage.put_event('insert', 'items', {'id': 1, 'name': 'x' * 1000})
+    storage.put_event('delete', 'items', {'values': {'id': 1}})
+    assert storage.memory_statistic()['bytes'] == 0
+    assert storage.buffer.bytes == 0
+
+
+def test_storage_large_transaction_over_budget():
+    from src.synch_storage import synch_storage
+    from src.tools import binlog_file
+
+    storage = synch_storage(max_len=2)
+    storage.wait_full(0, expecting_binlog=True)
+    done = threading.Event()
+
+    def _put():
+        for i in range(5):
+            storage.put_event('insert', 'items', {'id': i})
+        done.set()
+
+    t = threading.Thread(target=_put)
+    t.start()
+    t.join(1)
+    # the transaction has no commit yet, the buffer grows instead of a deadlock
+    assert done.is_set()
+    assert storage.get_buffer(expecting_binlog=True) is None
+    assert storage.memory_statistic()['overflow_events'] == 3
+
+    storage.put_binlog(binlog_file(file_path='/var/tmp/1', file='mysql-bin.000001', pos=100))
+    buffer = storage.get_buffer(expecting_binlog=True)
+    assert buffer.len() == 5 and buffer.binlog.pos == 100
+
+
+def test_storage_partial_chunk_by_own_size():
+    from src.synch_storage import synch_storage
+    from src.tools import binlog_file
+
+    storage = synch_storage(max_len=100, allow_partial=True)
+    storage.put_event('insert', 'items', {'id': 1, 'name': 'x' * 3000})
+    storage.put_binlog(binlog_file(file_path='/var/tmp/1', file='mysql-bin.000001', pos=100))
+    inflight = storage.get_buffer(expecting_binlog=True)
+    storage.put_event('insert', 'items', {'id': 2})
+
+    # the budget is full only because of the swapped buffer: the small transaction isn't cut into chunks
+    storage.max_bytes = 2000
+    storage.wait_full(0.1, expecting_binlog=True)
+    assert storage.get_buffer(expecting_binlog=True) is None
+    assert storage.memory_statistic()['partial_chunks'] == 0
+
+    storage.release(inflight)
+    storage.put_binlog(binlog_file(file_path='/var/tmp/1', file='mysql-bin.000001', pos=200))
+    assert not storage.get_buffer(expecting_binlog=True).partial
@@ -0,0 +1,81 @@
+import pytest
+
+
+def test_table_mapping_converts_buffer():
+    from src.synch_storage import synch_buffer
+    from src.table_mapping import compile_table_mapping
+
+    mapping = compile_table_mapping({
+        'table_columns': {'items': ['id', 'name', 'value']},
+        'table_mapping': {
+            'items': {
+                'target': 'items_ch',
+                'rename': {'name': 'title'},
+                'constants': {'source': 'shop'},
+                'casts': {'value': 'int'},
+                'version_column': 'version',
+                'deleted_column': 'deleted',
+            },
+        },
+    })
+    converter = mapping['items']
+    assert converter.target == 'items_ch'
+    assert converter.columns == ['id', 'title', 'value', 'source', 'version', 'deleted']
+
+    buffer = synch_buffer()
+    buffer.put_event('insert', 'items', {'id': 1, 'name': 'a', 'value': '10', 'blob': b'x'}, version=5)
+    buffer.put_event('update', 'items', {'before_values': None, 'after_values': {'id': 2, 'name': 'b', 'value': None}}, version=6)
+    buffer.put_event('delete', 'items', {'values': {'id': 3, 'name': 'c', 'value': 7}}, version=7)
+    buffer.put_event('insert', 'other', {'id': 1}, version=8)
+
+    rows = sorted(converter.convert_items(buffer.pop_table('items')))
+    assert rows == [
+        [1, 'a', 10, 'shop', 5, 0],
+        [2, 'b', None, 'shop', 6, 0],
+        [3, 'c', 7, 'shop', 7, 1],
+    ]
+    # only the mapped table is taken out of the buffer
+    assert buffer.len() == 1
+
+
+def test_table_mapping_validation():
+    from src.synch_storage import synch_item
+    from src.table_mapping import table_converter
+
+    with pytest.raises(ValueError):
+        table_converter('items', {'casts': {'value': 'int'}})
+    with pytest.raises(ValueError):
+        table_converter('items', {'columns': ['id'], 'casts': {'id': 'uuid'}})
+    with pytest.raises(ValueError):
+        table_converter('items', {'columns': ['id'], 'rename': {'name': 'title'}})
+    with pytest.raises(ValueError):
+        table_converter('items', {'columns': ['id', 'value'], 'constants': {'value': 1}})
+
+    # without deleted_column deletes are left to the plugin
+    converter = table_converter('items', {'columns': ['id']})
+    rest = []
+    delete = synch_item('delete', 'items', {'values': {'id': 1}})
+    assert converter.convert_items([delete, synch_item('insert', 'items', {'id': 2})], rest=rest) == [[2]]
+    assert rest == [delete]
+
+
+def test_table_mapping_hands_deletes_to_plugin(monkeypatch):
+    from src import engine
+    from src.synch_storage import synch_buffer
+    from src.tools import insert_buffer, table_filter
+
+    settings = {'handle_events_plugin': 'plugins_test.plugin_test', 'binlog_file': '/tmp/unused.pos', 'table_mapping': {'items': {'columns': ['id', 'value']}}}
+    context = engine.sink_context(engine.DEFAULT_SINK, settings)
+    monkeypatch.setattr(engine, 'TABLES', table_filter({'db_name': 'db', 'scan_tables': ['items']}))
+    monkeypatch.setattr(engine, 'COMPACT_ROWS', False)
+    monkeypatch.setattr(engine, 'STOP', False)
+    events = []
+    monkeypatch.setattr(context.plugin, 'process_event', lambda event_type, table, event, **kwargs: events.append((event_type, table)) or [])
+
+    buffer = synch_buffer()
+    buffer.put_event('insert', 'items', {'id': 1, 'value': 1}, version=1)
+    buffer.put_event('delete', 'items', {'values': {'id': 2, 'value': 2}}, version=2)
+    insert_storage = insert_buffer()
+    engine.worker_thread(buffer, insert_storage, context)
+    assert events == [('delete', 'items')]
+    assert buffer.len() == 0
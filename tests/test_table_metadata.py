@@ -0,0 +1,55 @@
+def test_table_metadata_cache(tmp_path):
+    from src.tools import table_filter
+    from src.table_metadata import table_metadata
+
+    class cursor:
+        def __init__(self):
+            self.queries = 0
+
+        def execute(self, query, args=None):
+            self.queries += 1
+
+        def fetchall(self):
+            return [('db', 'items', 'id', 'INT'), ('db', 'items', 'price', 'decimal'), ('db', 'other', 'id', 'int')]
+
+    settings = {'db_name': 'db', 'scan_tables': ['items'], 'init_tables': ['items']}
+    tables = table_filter(settings)
+    path = str(tmp_path / 'main.pos.tables.json')
+
+    metadata = table_metadata(path, tables)
+    assert not metadata.load('10:1')
+    metadata.refresh(cursor(), '10:1', tables)
+    assert metadata.column_types == {('db', 'items'): {'id': 'int', 'price': 'decimal'}}
+    assert metadata.save()
+
+    cached = table_metadata(path, table_filter(settings))
+    assert cached.load('10:1')
+    assert cached.scan == {('db', 'items')} and cached.init == [('db', 'items')]
+    assert cached.column_types == metadata.column_types
+    # another schema or other table settings - the file is stale
+    assert not table_metadata(path, table_filter(settings)).load('11:5')
+    assert not table_metadata(path, table_filter(dict(settings, scan_tables=['items', 'other']))).load('10:1')
+
+
+def test_schema_fingerprint_reads_configured_schemas():
+    from src.table_metadata import schema_fingerprint
+
+    class cursor:
+        def __init__(self):
+            self.queries = []
+
+        def execute(self, query, args=None):
+            self.queries.append((query, list(args or [])))
+
+        def fetchall(self):
+            if 'SCHEMATA' in self.queries[-1][0]:
+                return [('tenant_1',), ('tenant_2',), ('other',)]
+            return [(3, 12345)]
+
+    c = cursor()
+    assert schema_fingerprint(c, ['db']) == '1:3:12345'
+    assert len(c.queries) == 1 and c.queries[0][1] == ['db']
+
+    c = cursor()
+    assert schema_fingerprint(c, ['tenant_*']) == '2:3:12345'
+    assert c.queries[-1][1] == ['tenant_1', 'tenant_2']
@@ -0,0 +1,83 @@
+def test_held_rows_follow_snapshot(tmp_path, monkeypatch):
+    from src import engine
+    from src.tools import binlog_file, binlog_version, table_filter
+    from src.synch_storage import synch_storage
+
+    settings = {'handle_events_plugin': 'plugins_test.plugin_test', 'binlog_file': str(tmp_path / 'main.pos')}
+    pipeline = engine.flush_pipeline(engine.DEFAULT_PIPELINE, synch_storage(100))
+    monkeypatch.setattr(engine, 'SINKS', {engine.DEFAULT_SINK: engine.sink_context(engine.DEFAULT_SINK, settings)})
+    monkeypatch.setattr(engine, 'EXTRA_SINKS', [])
+    monkeypatch.setattr(engine, 'PIPELINES', {engine.DEFAULT_PIPELINE: pipeline})
+    monkeypatch.setattr(engine, 'TABLES', table_filter({'db_name': 'db', 'scan_tables': ['items', 'other']}))
+
+    router = engine.event_router({})
+    regeneration = engine.table_regeneration([('db', 'items')], router)
+    assert regeneration.holds('items') and not regeneration.holds('other')
+
+    # binlog rows read while the snapshot is taken: one before its position, one after
+    regeneration.put_event('update', 'items', {'before_values': None, 'after_values': {'id': 1, 'value': 0}}, version=binlog_version('mysql-bin.000001', 100))
+    regeneration.put_event('update', 'items', {'before_values': None, 'after_values': {'id': 2, 'value': 3}}, version=binlog_version('mysql-bin.000001', 600))
+    router.put_binlog(binlog_file(settings['binlog_file'], file='mysql-bin.000001', pos=700))
+    old = pipeline.storage.get_buffer(expecting_binlog=True)
+    assert old.len() == 0 and not regeneration.allows_save(pipeline, old)
+
+    snapshot_version = binlog_version('mysql-bin.000001', 500) - 1
+    regeneration.version = snapshot_version
+    router.put_event('snapshot', 'items', {'id': 1, 'value': 1}, version=snapshot_version)
+    router.put_event('snapshot', 'items', {'id': 2, 'value': 2}, version=snapshot_version)
+    regeneration.release()
+    router.put_binlog(binlog_file(settings['binlog_file'], file='mysql-bin.000001', pos=700))
+
+    buffer = pipeline.storage.get_buffer(expecting_binlog=True)
+    assert regeneration.allows_save(pipeline, buffer)
+    # the row older than the snapshot is dropped, the newer one replaces the snapshot row
+    assert buffer.insert['items'][1].event == {'id': 1, 'value': 1}
+    assert buffer.update['items'][2].event['after_values'] == {'id': 2, 'value': 3}
+    assert 2 not in buffer.insert['items']
+    assert regeneration.statistic()['dropped'] == 1
+
+    # after release rows go straight on, older ones are still dropped
+    regeneration.put_event('delete', 'items', {'values': {'id': 1}}, version=binlog_version('mysql-bin.000001', 400))
+    assert pipeline.storage.len() == 0
+    regeneration.put_event('delete', 'items', {'values': {'id': 1}}, version=binlog_version('mysql-bin.000001', 800))
+    assert pipeline.storage.len() == 1
+
+
+def test_snapshot_replaces_pending_update(tmp_path, monkeypatch):
+    from src import engine
+    from src.tools import binlog_version, table_filter
+    from src.synch_storage import synch_storage
+
+    settings = {'handle_events_plugin': 'plugins_test.plugin_test', 'binlog_file': str(tmp_path / 'main.pos')}
+    pipeline = engine.flush_pipeline(engine.DEFAULT_PIPELINE, synch_storage(100, compaction=True))
+    monkeypatch.setattr(engine, 'SINKS', {engine.DEFAULT_SINK: engine.sink_context(engine.DEFAULT_SINK, settings)})
+    monkeypatch.setattr(engine, 'EXTRA_SINKS', [])
+    monkeypatch.setattr(engine, 'PIPELINES', {engine.DEFAULT_PIPELINE: pipeline})
+    monkeypatch.setattr(engine, 'TABLES', table_filter({'db_name': 'db', 'scan_tables': ['items']}))
+
+    router = engine.event_router({})
+    # routed before the regeneration, the buffer is not swapped yet
+    router.put_event('update', 'items', {'before_values': None, 'after_values': {'id': 1, 'value': 1}}, version=binlog_version('mysql-bin.000001', 100))
+    router.put_event('delete', 'items', {'values': {'id': 2}}, version=binlog_version('mysql-bin.000001', 200))
+    engine.table_regeneration([('db', 'items')], router)
+
+    snapshot_version = binlog_version('mysql-bin.000001', 500) - 1
+    router.put_event('snapshot', 'items', {'id': 1, 'value': 1}, version=snapshot_version)
+    router.put_event('snapshot', 'items', {'id': 2, 'value': 2}, version=snapshot_version)
+    buffer = pipeline.storage.buffer
+    assert buffer.insert['items'][1].event == {'id': 1, 'value': 1} and buffer.insert['items'][1].event_type == 'insert'
+    assert not buffer.update['items'] and not buffer.delete['items']
+
+    # the sink may have the snapshot row, a later delete is kept
+    router.put_event('delete', 'items', {'values': {'id': 1}}, version=binlog_version('mysql-bin.000001', 600))
+    assert 1 in buffer.delete['items']
+
+
+def test_health_commands(monkeypatch):
+    from src import engine
+
+    monkeypatch.setattr(engine, 'STAGE', engine.Stage.REGENERATION)
+    answer = engine.run_health_command({}, {}, {'command': 'regenerate', 'args': ['items']})
+    assert answer['status'] == 'error' and 'SYNCH' in answer['error']
+    answer = engine.run_health_command({}, {}, {'command': 'nope'})
+    assert answer['status'] == 'error'
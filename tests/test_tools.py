@@ -0,0 +1,157 @@
+def test_binlog_file_gtid(tmp_path):
+    from src.tools import binlog_file
+
+    path = str(tmp_path / 'binlog.pos')
+    binlog = binlog_file(file_path=path, file='mysql-bin.000002', pos=400, gtid='1-1-7,0-1-100')
+    assert binlog.gtid == {0: '0-1-100', 1: '1-1-7'}
+    assert binlog.gtid_str() == '0-1-100,1-1-7'
+    assert binlog.save()
+
+    loaded = binlog_file(file_path=path)
+    assert loaded.load()
+    assert loaded == binlog
+    assert loaded.gtid == binlog.gtid
+
+    copy = loaded.copy()
+    copy.gtid[0] = '0-1-101'
+    assert loaded.gtid[0] == '0-1-100'
+
+
+def test_checkpoint_controller_domains():
+    from src.tools import binlog_file, checkpoint_controller
+
+    def _binlog(pos, gtid):
+        return binlog_file(file_path='/var/tmp/1', file='mysql-bin.000001', pos=pos, gtid=gtid)
+
+    checkpoint = checkpoint_controller(_binlog(100, '0-1-10,1-1-20'))
+    checkpoint.register('default', _binlog(100, '0-1-10,1-1-20'))
+    checkpoint.register('domain-0', _binlog(100, '0-1-10,1-1-20'), domain=0)
+    checkpoint.register('domain-1', _binlog(100, '0-1-10,1-1-20'), domain=1)
+
+    # fast domain 0 is committed, slow domain 1 is not: gtid of domain 1 stays, file/pos is the lowest
+    merged = checkpoint.commit('domain-0', _binlog(500, '0-1-15,1-1-25'), domain=0)
+    assert merged.gtid_str() == '0-1-15,1-1-20'
+    assert merged.pos == 100
+
+    merged = checkpoint.commit('default', _binlog(500, '0-1-15,1-1-25'), owns_gtid=False)
+    assert merged.gtid_str() == '0-1-15,1-1-20'
+
+    merged = checkpoint.commit('domain-1', _binlog(400, '0-1-14,1-1-24'), domain=1)
+    assert merged.gtid_str() == '0-1-15,1-1-24'
+    assert merged.pos == 400
+
+
+def test_checkpoint_controller_ddl_in_new_domain(monkeypatch):
+    from src import engine
+    from src.tools import binlog_file, checkpoint_controller
+
+    def _binlog(pos, gtid):
+        return binlog_file(file_path='/var/tmp/1', file='mysql-bin.000001', pos=pos, gtid=gtid)
+
+    monkeypatch.setattr(engine, 'GTID_POSITIONING', True)
+    checkpoint = checkpoint_controller(_binlog(100, '0-1-10,1-1-5'))
+    checkpoint.register('default', _binlog(100, '0-1-10,1-1-5'))
+    checkpoint.register('domain-0', _binlog(100, '0-1-10,1-1-5'), domain=0)
+
+    # DDL in domain 1, which has had no rows and so no pipeline: its marker reaches the default and domain-0 pipelines
+    ddl = _binlog(600, '0-1-10,1-1-6')
+    checkpoint.commit('domain-0', ddl, domain=0)
+    merged = checkpoint.commit('default', ddl, owns_gtid=False)
+    assert merged.gtid_str() == '0-1-10,1-1-6'
+    # the reader waiting in wait_checkpoint() goes on
+    assert engine.position_reached(merged, ddl)
+
+
+def test_binlog_version_monotonic():
+    from src.tools import binlog_version
+
+    assert binlog_version('mysql-bin.000001', 400) < binlog_version('mysql-bin.000001', 400, 1)
+    assert binlog_version('mysql-bin.000001', 400, 1) < binlog_version('mysql-bin.000001', 500)
+    assert binlog_version('mysql-bin.000001', 2 ** 32 - 1) < binlog_version('mysql-bin.000002', 4)
+    # the same binlog row always gets the same version
+    assert binlog_version('mysql-bin.000003', 1000, 2) == binlog_version('mysql-bin.000003', 1000, 2)
+
+
+def test_rows_to_columns():
+    from array import array
+    from src.tools import insert_item_row, rows_to_columns
+
+    columns = ['id', 'price', 'name', 'deleted', 'big']
+    rows = [
+        insert_item_row('items', columns, [1, 1.5, 'a', None, 2 ** 63]),
+        insert_item_row('items', columns, [2, 2.5, 'b', 1, 1]),
+    ]
+    data = rows_to_columns(rows)
+    assert data[0] == array('q', [1, 2])
+    assert data[1] == array('d', [1.5, 2.5])
+    assert list(data[2]) == ['a', 'b']
+    assert list(data[3]) == [None, 1]
+    # doesn't fit int64
+    assert list(data[4]) == [2 ** 63, 1]
+
+
+def test_table_filter_patterns(fake_cursor):
+    import pytest
+    from src.tools import table_filter
+
+    legacy = table_filter({'db_name': 'shop', 'scan_tables': ['items'], 'init_tables': ['items']})
+    assert not legacy.has_patterns()
+    assert legacy.is_scanned('shop', 'items')
+    assert legacy.key('shop', 'items') == 'items'
+    assert legacy.split('items') == ('shop', 'items')
+
+    tables = table_filter({'db_name': 'shop', 'schemas': ['tenant_*'], 'scan_tables': ['orders*'], 'init_tables': ['orders']})
+    assert tables.has_patterns()
+    fake_cursor.fetchall.return_value = [
+        ('tenant_1', 'orders'), ('tenant_1', 'orders_items'), ('tenant_1', 'users'),
+        ('tenant_2', 'orders'), ('other', 'orders'),
+    ]
+    tables.resolve(fake_cursor)
+    assert tables.scan == {('tenant_1', 'orders'), ('tenant_1', 'orders_items'), ('tenant_2', 'orders')}
+    assert tables.init == [('tenant_1', 'orders'), ('tenant_2', 'orders')]
+    assert tables.only_schemas() == ['tenant_1', 'tenant_2']
+    assert tables.only_tables() == ['orders', 'orders_items']
+    assert not tables.is_scanned('other', 'orders')
+    assert tables.key('tenant_2', 'orders') == 'tenant_2.orders'
+    assert tables.split('tenant_2.orders') == ('tenant_2', 'orders')
+
+    missing = table_filter({'db_name': 'shop', 'schemas': ['tenant_*'], 'scan_tables': ['payments']})
+    with pytest.raises(RuntimeError):
+        missing.resolve(fake_cursor)
+
+
+def test_ddl_tables():
+    from src.tools import ddl_tables
+
+    assert ddl_tables("BEGIN", 'db') is None
+    assert ddl_tables("INSERT INTO items VALUES (1)", 'db') is None
+    assert ddl_tables("ALTER TABLE items ADD COLUMN x INT", 'db') == ('alter', [('db', 'items')])
+    assert ddl_tables("alter online table `shop`.`it``ems` add x int", 'db') == ('alter', [('shop', 'it`ems')])
+    assert ddl_tables("ALTER TABLE items RENAME COLUMN a TO b", 'db') == ('alter', [('db', 'items')])
+    assert ddl_tables("ALTER TABLE items ADD x INT, RENAME TO items_old", 'db') == ('alter', [('db', 'items'), ('db', 'items_old')])
+    assert ddl_tables("DROP TABLE IF EXISTS `a`,`b` /* generated by server */", 'db') == ('drop', [('db', 'a'), ('db', 'b')])
+    assert ddl_tables("RENAME TABLE a TO b, other.c TO d", 'db') == ('rename', [('db', 'a'), ('db', 'b'), ('other', 'c'), ('db', 'd')])
+    assert ddl_tables("/* c */ TRUNCATE items", 'db') == ('truncate', [('db', 'items')])
+
+
+def test_project_row_and_select_columns():
+    from src.tools import project_row, select_columns
+
+    row = {'id': 1, 'name': 'a', 'blob': b'x' * 100}
+    # None - the row as is, no copy
+    assert project_row(row, None) is row
+    assert project_row(row, ['id', 'name']) == {'id': 1, 'name': 'a'}
+    # a configured column missing in the row (dropped by DDL, not in this image) is skipped
+    assert project_row(row, ['id', 'gone']) == {'id': 1}
+
+    assert select_columns(None) == "*"
+    assert select_columns(['id', 'order']) == "`id`, `order`"
+
+
+def test_plugin_need_before_values(monkeypatch):
+    import plugins_test.plugin_test as module
+    from src.tools import plugin_wrapper
+
+    assert not plugin_wrapper('plugins_test.plugin_test').need_before_values
+    monkeypatch.setattr(module, 'need_before_values', True, raising=False)
+    assert plugin_wrapper('plugins_test.plugin_test').need_before_values
@@ -0,0 +1,103 @@
+import pytest
+
+
+def test_parse_tuning():
+    from src.tuning import parse_tuning
+
+    assert parse_tuning(['clickhouse_max_batch_len=500', 'clickhouse_dropdown_sleep=0.5']) == {
+        'clickhouse_max_batch_len': 500,
+        'clickhouse_dropdown_sleep': 0.5,
+    }
+    with pytest.raises(ValueError):
+        parse_tuning(['clickhouse_max_batch_len'])
+    with pytest.raises(ValueError):
+        parse_tuning(['binlog_file=/tmp/x'])
+    with pytest.raises(ValueError):
+        parse_tuning(['full_regeneration_threads_count=2.5'])
+    with pytest.raises(ValueError):
+        parse_tuning(['full_regeneration_threads_count=0'])
+
+
+def test_rate_limiter():
+    from src.tuning import rate_limiter
+
+    limiter = rate_limiter()
+    assert limiter.acquire(1_000_000) == 0.0
+    limiter.set_rate(1000)
+    assert limiter.acquire(50) == 0.0
+    # the second batch waits for the time of the first one
+    assert 0.03 < limiter.acquire(50) <= 0.05
+    limiter.set_rate(0)
+    assert limiter.acquire(50) == 0.0
+
+
+def test_tune_command(tmp_path, monkeypatch):
+    from src import engine
+    from src.synch_storage import synch_storage
+    from src.tuning import rate_limiter
+
+    settings = {
+        'handle_events_plugin': 'plugins_test.plugin_test',
+        'binlog_file': str(tmp_path / 'main.pos'),
+        'clickhouse_max_batch_len': 3,
+        'clickhouse_dropdown_sleep': 2,
+        'full_regeneration_threads_count': 4,
+        'full_regeneration_batch_len': 1000,
+    }
+    pipeline = engine.flush_pipeline(engine.DEFAULT_PIPELINE, synch_storage(3))
+    monkeypatch.setattr(engine, 'SINKS', {engine.DEFAULT_SINK: engine.sink_context(engine.DEFAULT_SINK, settings)})
+    monkeypatch.setattr(engine, 'EXTRA_SINKS', [])
+    monkeypatch.setattr(engine, 'PIPELINES', {engine.DEFAULT_PIPELINE: pipeline})
+    monkeypatch.setattr(engine, 'THROTTLE', rate_limiter())
+
+    # a failed value changes nothing
+    with pytest.raises(ValueError):
+        engine.command_tune({}, settings, ['clickhouse_max_batch_len=10', 'clickhouse_dropdown_sleep=-1'])
+    assert pipeline.storage.max_len == 3
+
+    for i in range(3):
+        pipeline.storage.put_event('insert', 'items', {'id': i})
+    result = engine.command_tune({}, settings, ['clickhouse_max_batch_len=10', 'full_regeneration_max_rows_per_s=500'])
+    assert result['settings']['clickhouse_max_batch_len'] == 10
+    assert result['settings']['full_regeneration_max_rows_per_s'] == 500
+    assert settings['clickhouse_max_batch_len'] == 10 and pipeline.storage.max_len == 10
+    assert engine.THROTTLE.rate == 500
+    # the storage isn't full any more, writers go on without a swap
+    pipeline.storage.put_event('insert', 'items', {'id': 3})
+    assert pipeline.storage.len() == 4
+
+    assert engine.command_tune({}, settings, [])['settings']['full_regeneration_threads_count'] == 4
+
+
+def test_tune_threads_count(tmp_path, monkeypatch):
+    from src import engine
+    from src.tools import binlog_file, regeneration_threads_controller
+
+    settings = {
+        'handle_events_plugin': 'plugins_test.plugin_test',
+        'binlog_file': str(tmp_path / 'main.pos'),
+        'full_regeneration_threads_count': 4,
+    }
+    monkeypatch.setattr(engine, 'SINKS', {engine.DEFAULT_SINK: engine.sink_context(engine.DEFAULT_SINK, settings)})
+    monkeypatch.setattr(engine, 'EXTRA_SINKS', [])
+    monkeypatch.setattr(engine, 'PIPELINES', {})
+    monkeypatch.setattr(engine, 'REGENERATION_CONTROLLER', regeneration_threads_controller(4))
+    monkeypatch.setattr(engine, 'STOP', True)
+    monkeypatch.setattr(engine, 'get_binlog_from_db', lambda *args: binlog_file(settings['binlog_file'], file='mysql-bin.000001', pos=4))
+    passed = []
+
+    def _thread(mysql_settings, app_settings, version):
+        engine.REGENERATION_CONTROLLER.barrier.wait(timeout=5)
+        passed.append(1)
+
+    monkeypatch.setattr(engine, 'full_regeneration_thread', _thread)
+
+    # tuned before the full regeneration starts: the barrier waits for the new count of threads
+    engine.command_tune({}, settings, ['full_regeneration_threads_count=2'])
+    engine.full_regeneration({}, settings)
+    assert len(passed) == 2
+
+    settings['apply_mode'] = 'group_commit'
+    with pytest.raises(ValueError):
+        engine.command_tune({}, settings, ['full_regeneration_threads_count=3'])
+    assert settings['full_regeneration_threads_count'] == 2
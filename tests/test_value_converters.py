@@ -0,0 +1,72 @@
+import datetime
+from decimal import Decimal
+
+
+def test_converters_from_information_schema_and_table_map():
+    from pymysqlreplication.column import Column
+    from pymysqlreplication.constants import FIELD_TYPE
+    from src.value_converters import value_converters
+
+    class cursor:
+        def execute(self, query, args=None):
+            self.args = args
+
+        def fetchall(self):
+            return [
+                ('db', 'items', 'id', 'int'),
+                ('db', 'items', 'price', 'decimal'),
+                ('db', 'items', 'meta', 'json'),
+                ('db', 'items', 'created', 'datetime'),
+                ('db', 'other', 'id', 'int'),
+            ]
+
+    converters = value_converters(None, {'decimal': 'float', 'json': 'str', 'datetime': 'str'})
+    converters.load(cursor(), [('db', 'items'), ('db', 'other')])
+    convert = converters.get('db', 'items')
+    row = {'id': 1, 'price': Decimal('1.50'), 'meta': {'a': 1}, 'created': datetime.datetime(2024, 1, 2, 3, 4, 5)}
+    assert convert(row) == {'id': 1, 'price': 1.5, 'meta': '{"a":1}', 'created': '2024-01-02 03:04:05'}
+    assert convert({'id': 2, 'price': None}) == {'id': 2, 'price': None}
+    # nothing to convert - no function
+    assert converters.get('db', 'other') is None
+
+    # binlog path of a table which isn't loaded: types of the table-map event give the same converter
+    columns = [Column(name='id', type=FIELD_TYPE.LONG), Column(name='price', type=FIELD_TYPE.NEWDECIMAL)]
+    convert = converters.get('db', 'new', columns)
+    assert convert({'id': 1, 'price': Decimal('2.25')}) == {'id': 1, 'price': 2.25}
+
+    converters.invalidate('db', 'new')
+    convert = converters.get('db', 'new', [Column(name='id', type=FIELD_TYPE.LONG)])
+    assert convert is None
+    assert converters.statistic()['compiled'] == 4
+
+
+def test_unknown_conversion():
+    import pytest
+    from src.value_converters import value_converters
+
+    with pytest.raises(ValueError):
+        value_converters(None, {'decimal': 'int'})
+    with pytest.raises(ValueError):
+        value_converters(None, {'money': 'float'})
+
+
+def test_json_str_same_for_regeneration_and_binlog():
+    from pymysqlreplication.column import Column
+    from pymysqlreplication.constants import FIELD_TYPE
+    from src.value_converters import value_converters
+
+    class cursor:
+        def execute(self, query, args=None):
+            pass
+
+        def fetchall(self):
+            return [('db', 'items', 'id', 'int'), ('db', 'items', 'meta', 'json')]
+
+    converters = value_converters(None, {'json': 'str'})
+    converters.load(cursor(), [('db', 'items')])
+    # regeneration: JSON text as stored by the server
+    regeneration = converters.get('db', 'items')({'id': 1, 'meta': '{"a": 1, "b": ["x", "ё"]}'})
+    # binlog of a table not loaded yet: the value parsed by the replication client
+    binlog = converters.get('db', 'new', [Column(name='id', type=FIELD_TYPE.LONG), Column(name='meta', type=FIELD_TYPE.JSON)])({'id': 1, 'meta': {'a': 1, 'b': ['x', 'ё']}})
+    assert regeneration['meta'] == binlog['meta'] == '{"a":1,"b":["x","ё"]}'
+    assert converters.get('db', 'items')({'id': 2, 'meta': b'{"a": 1}'})['meta'] == '{"a":1}'